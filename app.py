@@ -3,10 +3,16 @@ Insurance Quote Generator - Streamlit UI
 OpenAI-inspired minimal design test 1
 """
 import streamlit as st
-import asyncio
-import base64
+import queue
+import time
+import uuid
 from pathlib import Path
-from quote_agent import run_quote
+from metrics import METRICS_PORT, serve as serve_metrics
+from progress_events import EVENTS, SSE_PORT, start_sse
+from quote_store import QuoteStore, vehicle_key
+from zip_index import ensure_index, lookup as lookup_zip
+from ui_assets import build_assets
+from warm_sessions import WarmSessionPool
 
 # Page config
 st.set_page_config(
@@ -15,16 +21,63 @@ st.set_page_config(
     layout="centered"
 )
 
-# Load and encode images
-def get_base64_image(image_path):
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+@st.cache_resource
+def get_warm_pool():
+    """One warm session pool per server process"""
+    return WarmSessionPool()
 
-bg_image = get_base64_image("public/bg_image_logo.png")
-logo_svg = get_base64_image("public/LOGOBROVE_255x75.svg")
 
-# Custom CSS - OpenAI style
-st.markdown(f"""
+@st.cache_resource
+def get_quote_store():
+    return QuoteStore()
+
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Prometheus scrape endpoint, once per server process (METRICS_PORT=0 disables it)"""
+    return serve_metrics(METRICS_PORT) if METRICS_PORT else None
+
+
+@st.cache_resource
+def start_sse_endpoint():
+    """Progress events as server-sent events, once per server process (SSE_PORT=0 disables it)"""
+    return start_sse(SSE_PORT) if SSE_PORT else None
+
+
+@st.cache_resource
+def ensure_zip_index():
+    """Build the zip index on first start; False means zones resolve to the estado only"""
+    return ensure_index()
+
+
+start_metrics_endpoint()
+start_sse_endpoint()
+ensure_zip_index()
+
+
+# Speculatively log in and navigate while the user fills in the form
+if "session_key" not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
+warm_pool = get_warm_pool()
+warm_pool.prewarm(st.session_state.session_key)
+
+# Clicking "Cancelar" reruns the script, which lands here with the running quote's id
+if st.session_state.get("cancel_quote") and st.session_state.get("active_quote"):
+    warm_pool.cancel(st.session_state.active_quote)
+    st.session_state.active_quote = None
+    st.warning("Cotización cancelada")
+
+@st.cache_resource
+def get_assets():
+    """Images written to static/ once per process and referenced by URL (see ui_assets.py)"""
+    return build_assets()
+
+
+@st.cache_resource
+def get_page_css():
+    """Custom CSS - OpenAI style; built once per process"""
+    assets = get_assets()
+    return f"""
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap');
 
@@ -42,7 +95,9 @@ st.markdown(f"""
     }}
 
     .stApp {{
-        background-image: url('data:image/png;base64,{bg_image}');
+        background-image: url('{assets.background_png}');
+        background-image: image-set(url('{assets.background_webp}') type('image/webp'),
+                                    url('{assets.background_png}') type('image/png'));
         background-size: cover;
         background-position: center;
         background-repeat: no-repeat;
@@ -237,10 +292,13 @@ st.markdown(f"""
         padding: 1rem;
     }}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+st.markdown(get_page_css(), unsafe_allow_html=True)
 
 # Logo
-st.markdown(f'<img src="data:image/svg+xml;base64,{logo_svg}" class="logo">', unsafe_allow_html=True)
+st.markdown(f'<img src="{get_assets().logo}" class="logo" alt="Brove">', unsafe_allow_html=True)
 
 # Header
 st.title("Generador de Cotizaciones")
@@ -262,9 +320,17 @@ with st.form("vehicle_form"):
 
 # Process form
 if submitted:
+    zone = lookup_zip(zip_code)
     if not brand or not model or not year:
         st.error("Please fill in all required fields")
+    elif zone is None:
+        st.error(f"Código postal inválido: {zip_code}")
     else:
+        zip_code = zone.zip_code
+        st.caption(f"📍 {zone.describe()}")
+        if zone.degraded:
+            st.warning("Sin índice de códigos postales: solo se resolvió el estado y el agente elegirá la zona")
+
         # Prepare vehicle info
         vehicle_info = {
             "brand": brand.upper(),
@@ -287,6 +353,7 @@ if submitted:
             st.markdown('<div class="progress-container">', unsafe_allow_html=True)
             progress_bar = st.progress(0)
             status_text = st.empty()
+            st.button("Cancelar", key="cancel_quote")
             st.markdown('</div>', unsafe_allow_html=True)
 
         def update_progress(phase: int, message: str):
@@ -316,19 +383,94 @@ if submitted:
             progress_bar.progress(progress_value)
             status_text.info(f"**{phase_name}** - {message}")
 
+        # Step events move the bar within each phase's third
+        phase_spans = {
+            "navigation": (0, 33, phase_labels[0]),
+            "select": (33, 66, phase_labels[1]),
+            "completion": (66, 100, phase_labels[2]),
+        }
+        phase_budgets = {}
+
+        def show_event(event):
+            """Advance the progress bar on fine-grained step events"""
+            if event.type == "phase_start":
+                phase_budgets[event.phase] = event.data["max_steps"]
+            elif event.type == "step" and event.phase in phase_spans:
+                low, high, phase_name = phase_spans[event.phase]
+                budget = phase_budgets.get(event.phase) or 1
+                progress_bar.progress(int(low + (high - low) * min(event.data["step"] / budget, 1.0)))
+                actions = ", ".join(name for action in event.data["actions"] for name in action) or "thinking"
+                status_text.info(f"**{phase_name}** - step {event.data['step']}: {actions}")
+
         # Initial state
         status_text.info("🔄 Ready to start automation...")
 
-        # Run automation
+        # Run automation on the warm pool; progress arrives from its thread
+        quote_id = uuid.uuid4().hex[:12]
+        followed_ids = {quote_id, f"warm-{st.session_state.session_key}"}
+        updates = queue.Queue()
+
+        def on_event(event):
+            if event.quote_id in followed_ids:
+                updates.put(event)
+
+        def drain_updates():
+            while not updates.empty():
+                update = updates.get_nowait()
+                if isinstance(update, tuple):
+                    update_progress(*update)
+                else:
+                    show_event(update)
+
+        EVENTS.add_listener(on_event)
+        st.session_state.active_quote = quote_id
         try:
-            result = asyncio.run(run_quote(vehicle_info, update_progress))
+            future = warm_pool.submit(
+                st.session_state.session_key,
+                vehicle_info,
+                lambda phase, message: updates.put((phase, message)),
+                quote_id=quote_id
+            )
+            while not future.done():
+                drain_updates()
+                time.sleep(0.2)
+            drain_updates()
+            # Left set when a "Cancelar" click interrupts this run, so the rerun can cancel it
+            st.session_state.active_quote = None
+            result = future.result()
 
             if result["status"] == "success":
                 progress_bar.progress(100)
-                status_text.success("✅ Quote generated successfully!")
-                st.balloons()
+                if result.get("cached_at"):
+                    hours = result["cache_age_s"] / 3600
+                    status_text.success(f"✅ Cotización precalculada hace {hours:.1f} h "
+                                        f"({time.strftime('%d/%m %H:%M', time.localtime(result['cached_at']))})")
+                else:
+                    status_text.success("✅ Quote generated successfully!")
+                    st.balloons()
             else:
                 st.error(f"Error: {result['message']}")
 
         except Exception as e:
+            st.session_state.active_quote = None
             st.error(f"Unexpected error: {str(e)}")
+        finally:
+            EVENTS.remove_listener(on_event)
+
+        # Latest stored quote per insurer for this vehicle/zip
+        comparison = get_quote_store().comparison(vehicle_key(vehicle_info), zip_code)
+        if comparison:
+            st.markdown("#### Comparativo de aseguradoras")
+            st.dataframe(
+                [
+                    {
+                        "Aseguradora": row["insurer"].title(),
+                        "Prima": f"${row['premium']:,.2f} {row['currency']}",
+                        "Coberturas": len(row["coverages"]),
+                        "Fecha": time.strftime("%Y-%m-%d %H:%M", time.localtime(row["created_at"])),
+                        "PDF": row["pdf_path"] or "",
+                    }
+                    for row in comparison
+                ],
+                hide_index=True,
+            )
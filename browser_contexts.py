@@ -0,0 +1,401 @@
+"""
+Many isolated browser contexts per Chromium process
+
+Each Browser() launches a full Chromium (browser, GPU, network and utility
+processes: a few hundred MB before any page loads), so concurrency scales
+memory by whole browsers. With CONTEXT_HOSTS > 0, quote_agent.new_browser()
+instead returns a session on a shared Chromium host. Each quote gets its own
+CDP browser context, with its own cookies, storage and tabs:
+
+- ContextPool runs CONTEXT_HOSTS Chromium processes and puts each new quote
+  on the host with the fewest contexts (at most CONTEXTS_PER_HOST).
+- browser_use attaches to every target it can see and has no notion of
+  contexts. So each session connects to a local relay rather than to
+  Chromium itself. The relay opens its own upstream connection and creates
+  the context. It adds browserContextId to the browser-wide calls
+  (createTarget, cookies, downloads, permissions), and drops every target
+  and session of other contexts. Large page payloads go through without
+  being parsed.
+- A context is disposed, closing its tabs, when its session disconnects
+  (browser.kill()). If a Chromium crashes, only the quotes on that host lose
+  their sessions (retry policies take over); the host is relaunched for the
+  next quote and the other hosts carry on.
+
+Contexts are off-the-record, so they don't use the warm disk cache of
+browser_profiles.py; the host's own profile does.
+
+    python browser_contexts.py bench [--quotes 6] [--hosts 2] [--url URL]   # memory per concurrent quote
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import re
+import signal
+import socket
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from browser_use import Browser
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from metrics import REGISTRY
+
+
+CONTEXT_HOSTS = int(os.getenv("CONTEXT_HOSTS", "0"))
+CONTEXTS_PER_HOST = int(os.getenv("CONTEXTS_PER_HOST", "8"))
+
+CONTEXTS_ACTIVE = REGISTRY.gauge("browser_contexts_active", "Isolated contexts open per Chromium host", ["host"])
+HOST_RESTARTS = REGISTRY.counter("browser_context_host_restarts_total", "Chromium hosts relaunched after a crash")
+
+# Browser-wide commands that act on the default context unless told otherwise
+_CONTEXT_SCOPED = {
+    "Target.createTarget", "Browser.setDownloadBehavior", "Browser.grantPermissions",
+    "Browser.resetPermissions", "Storage.getCookies", "Storage.setCookies", "Storage.clearCookies",
+}
+# Commands a context session must not send
+_FORBIDDEN = {"Browser.close", "Browser.crash", "Target.createBrowserContext", "Target.disposeBrowserContext"}
+# Chromium writes compact JSON with "id" first in responses
+_ID = re.compile(rb'^\{"id":(\d+)')
+
+
+class _Relay:
+    """
+    Rewrites one session's CDP traffic so it only sees its own context.
+
+    Responses are matched on their leading id and only parsed for the few
+    commands whose results must be filtered. Events are parsed and routed on
+    their top-level sessionId (a byte search could match inside a payload).
+    """
+
+    def __init__(self, context_id: str):
+        self.context_id = context_id
+        self.targets: Set[str] = set()
+        self.sessions: Set[str] = set()
+        self.downloads: Set[str] = set()
+        self._pending: Dict[int, str] = {}
+
+    def outbound(self, raw: str) -> Tuple[Optional[str], Optional[str]]:
+        """(message for Chromium, or an error reply for the client)"""
+        message = json.loads(raw)
+        method, params = message.get("method", ""), message.setdefault("params", {})
+        session_id = message.get("sessionId")
+        if method in _FORBIDDEN or (session_id and session_id not in self.sessions):
+            return None, self._error(message, f"{method} is not allowed in an isolated context")
+        target_id = params.get("targetId")
+        if target_id and method.startswith("Target.") and method != "Target.createTarget" and target_id not in self.targets:
+            return None, self._error(message, "No target with given id found")
+        if method in _CONTEXT_SCOPED and not session_id:
+            params.setdefault("browserContextId", self.context_id)
+        if method in ("Target.getTargets", "Target.createTarget", "Target.attachToTarget"):
+            self._pending[message["id"]] = method
+        return json.dumps(message), None
+
+    def inbound(self, raw) -> Optional[str]:
+        """The message for the client, or None to drop it"""
+        data = raw.encode() if isinstance(raw, str) else raw
+        match = _ID.match(data)
+        if match:
+            method = self._pending.pop(int(match.group(1)), None)
+            return self._response(method, data) if method else raw
+        message = json.loads(data)
+        session_id = message.get("sessionId")
+        if session_id is not None:
+            # Events of attached pages: ours pass untouched
+            if session_id not in self.sessions:
+                return None
+            if message.get("method") == "Target.attachedToTarget":
+                # Iframes and workers auto-attached under one of our pages
+                params = message["params"]
+                self.sessions.add(params["sessionId"])
+                self.targets.add(params["targetInfo"]["targetId"])
+            return raw
+        if message.get("method", "").startswith(("Target.", "Browser.download")):
+            return self._event(message)
+        return raw
+
+    def _response(self, method: str, data: bytes) -> str:
+        message = json.loads(data)
+        result = message.get("result") or {}
+        if method == "Target.getTargets":
+            result["targetInfos"] = [t for t in result.get("targetInfos", []) if self._ours(t)]
+        elif method == "Target.createTarget" and "targetId" in result:
+            self.targets.add(result["targetId"])
+        elif method == "Target.attachToTarget" and "sessionId" in result:
+            self.sessions.add(result["sessionId"])
+        return json.dumps(message)
+
+    def _ours(self, info: dict) -> bool:
+        if info.get("browserContextId") == self.context_id:
+            self.targets.add(info["targetId"])
+            return True
+        return False
+
+    def _event(self, message: dict) -> Optional[str]:
+        method, params = message["method"], message.get("params", {})
+        if "targetInfo" in params:
+            ours = self._ours(params["targetInfo"])
+            if ours and method == "Target.attachedToTarget":
+                self.sessions.add(params["sessionId"])
+        elif method == "Target.detachedFromTarget":
+            ours = params.get("sessionId") in self.sessions
+            self.sessions.discard(params.get("sessionId"))
+        elif method == "Browser.downloadWillBegin":
+            ours = params.get("frameId") in self.targets
+            if ours:
+                self.downloads.add(params["guid"])
+        elif method == "Browser.downloadProgress":
+            ours = params.get("guid") in self.downloads
+        else:
+            # targetDestroyed, targetCrashed
+            ours = params.get("targetId") in self.targets
+        return json.dumps(message) if ours else None
+
+    @staticmethod
+    def _error(message: dict, text: str) -> str:
+        reply = {"id": message.get("id"), "error": {"code": -32000, "message": text}}
+        if message.get("sessionId"):
+            reply["sessionId"] = message["sessionId"]
+        return json.dumps(reply)
+
+
+class ChromiumHost:
+    """One Chromium process; contexts are created on it through its own session"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.browser: Optional[Browser] = None
+        self.contexts: Set[str] = set()
+        self._starting: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.browser is not None and self.browser.is_cdp_connected
+
+    async def ensure_started(self):
+        if self.alive:
+            return
+        if self._starting is None or self._starting.done():
+            self._starting = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._starting)
+
+    async def _start(self):
+        if self.browser is not None:
+            # Crashed or disconnected: its contexts are gone with it
+            HOST_RESTARTS.inc()
+            self.contexts.clear()
+            try:
+                await self.browser.kill()
+            except Exception:
+                pass
+        self.browser = Browser(keep_alive=True)
+        await self.browser.start()
+
+    async def create_context(self) -> str:
+        await self.ensure_started()
+        result = await self.browser.cdp_client.send.Target.createBrowserContext(params={"disposeOnDetach": False})
+        self.contexts.add(result["browserContextId"])
+        CONTEXTS_ACTIVE.set(len(self.contexts), host=self.index)
+        return result["browserContextId"]
+
+    async def dispose_context(self, context_id: str):
+        if context_id not in self.contexts:
+            return
+        self.contexts.discard(context_id)
+        CONTEXTS_ACTIVE.set(len(self.contexts), host=self.index)
+        if self.alive:
+            try:
+                await self.browser.cdp_client.send.Target.disposeBrowserContext(
+                    params={"browserContextId": context_id})
+            except Exception:
+                pass
+
+    async def stop(self):
+        if self.browser is not None:
+            await self.browser.kill()
+            self.browser = None
+        self.contexts.clear()
+
+
+class ContextPool:
+    """
+    Chromium hosts for one event loop, and the relay endpoint sessions connect to.
+
+    browser() is synchronous: the relay listens from construction, and the
+    context is created when the session connects.
+    """
+
+    def __init__(self, hosts: int = CONTEXT_HOSTS or 1, per_host: int = CONTEXTS_PER_HOST):
+        self.hosts = [ChromiumHost(i) for i in range(hosts)]
+        self.per_host = per_host
+        self._socket = socket.create_server(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._server = None
+        self._capacity = asyncio.Condition()
+
+    def browser(self, **kwargs) -> Browser:
+        """A Browser session on its own isolated context (created when it starts)"""
+        if self._server is None:
+            self._server = asyncio.ensure_future(serve(self._handle, sock=self._socket, max_size=None,
+                                                       compression=None, ping_interval=None))
+        return Browser(cdp_url=f"ws://127.0.0.1:{self.port}/{uuid.uuid4().hex}", keep_alive=True, **kwargs)
+
+    async def _acquire_host(self) -> Tuple[ChromiumHost, str]:
+        async with self._capacity:
+            while True:
+                host = min(self.hosts, key=lambda h: len(h.contexts))
+                if len(host.contexts) < self.per_host:
+                    # Reserve the slot before the context exists
+                    placeholder = f"pending-{uuid.uuid4().hex}"
+                    host.contexts.add(placeholder)
+                    return host, placeholder
+                await self._capacity.wait()
+
+    async def _release_host(self):
+        async with self._capacity:
+            self._capacity.notify()
+
+    async def _handle(self, client):
+        host, placeholder = await self._acquire_host()
+        context_id = None
+        try:
+            try:
+                context_id = await host.create_context()
+            finally:
+                host.contexts.discard(placeholder)
+            relay = _Relay(context_id)
+            async with connect(host.browser.cdp_url, max_size=None, compression=None, ping_interval=None) as upstream:
+                await _pump(client, upstream, relay)
+        except (ConnectionClosed, OSError):
+            pass
+        finally:
+            if context_id:
+                await host.dispose_context(context_id)
+            await self._release_host()
+
+    def stats(self) -> List[dict]:
+        return [{"host": h.index, "alive": h.alive, "contexts": len(h.contexts)} for h in self.hosts]
+
+    async def close(self):
+        for host in self.hosts:
+            await host.stop()
+        if self._server is not None:
+            (await self._server).close()
+
+
+async def _pump(client, upstream, relay: _Relay):
+    async def to_chromium():
+        async for raw in client:
+            message, error = relay.outbound(raw)
+            if error:
+                await client.send(error)
+            else:
+                await upstream.send(message)
+
+    async def to_client():
+        async for raw in upstream:
+            message = relay.inbound(raw)
+            if message is not None:
+                await client.send(message)
+
+    tasks = [asyncio.ensure_future(to_chromium()), asyncio.ensure_future(to_client())]
+    try:
+        # Either side closing (kill(), or a Chromium crash) ends the session
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await client.close()
+
+
+# Per event loop, like the scheduler's gates: each worker process and the pool thread get their own
+_pools: Dict[asyncio.AbstractEventLoop, ContextPool] = {}
+
+
+def context_pool() -> ContextPool:
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = ContextPool()
+    return _pools[loop]
+
+
+async def close_context_pool():
+    """Stop the running loop's Chromium hosts; call before the loop ends (no-op without a pool)"""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+@atexit.register
+def _kill_orphaned_hosts():
+    """Last resort for loops that ended without close_context_pool(): don't leave their Chromiums running"""
+    from browser_governor import browser_pid
+
+    for pool in _pools.values():
+        for host in pool.hosts:
+            pid = browser_pid(host.browser) if host.browser is not None else None
+            if pid:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+
+BENCH_PAGE = ("data:text/html,<title>Cotizador</title><form>"
+              + "".join(f"<label>Campo {i}<select><option>A</option><option>B</option></select></label>" for i in range(200))
+              + "</form><script>setInterval(() => document.title = Date.now(), 500)</script>")
+
+
+async def bench(quotes: int, hosts: int, url: str) -> dict:
+    """Total RSS with `quotes` pages open: one Chromium per quote vs contexts on `hosts` Chromiums"""
+    from browser_governor import browser_pid, process_tree_rss
+
+    async def open_page(browser: Browser):
+        await browser.start()
+        await browser.navigate_to(url)
+        await asyncio.sleep(2)
+
+    separate = [Browser(keep_alive=True, headless=True) for _ in range(quotes)]
+    try:
+        await asyncio.gather(*(open_page(b) for b in separate))
+        separate_rss = sum(process_tree_rss(browser_pid(b)) for b in separate)
+    finally:
+        await asyncio.gather(*(b.kill() for b in separate), return_exceptions=True)
+
+    pool = ContextPool(hosts=hosts, per_host=-(-quotes // hosts))
+    for host in pool.hosts:
+        host.browser = Browser(keep_alive=True, headless=True)
+        await host.browser.start()
+    sessions = [pool.browser() for _ in range(quotes)]
+    try:
+        await asyncio.gather(*(open_page(b) for b in sessions))
+        shared_rss = sum(process_tree_rss(browser_pid(h.browser)) for h in pool.hosts)
+    finally:
+        await asyncio.gather(*(b.kill() for b in sessions), return_exceptions=True)
+        await pool.close()
+
+    mb = 1024 * 1024
+    return {"quotes": quotes, "hosts": hosts,
+            "per_quote_mb": {"browser_per_quote": round(separate_rss / quotes / mb),
+                             "contexts": round(shared_rss / quotes / mb)},
+            "total_mb": {"browser_per_quote": round(separate_rss / mb), "contexts": round(shared_rss / mb)}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Isolated browser contexts on shared Chromium hosts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="memory per concurrent quote, both models")
+    bench_parser.add_argument("--quotes", type=int, default=6)
+    bench_parser.add_argument("--hosts", type=int, default=2)
+    bench_parser.add_argument("--url", default=BENCH_PAGE)
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args.quotes, args.hosts, args.url))
+    per_quote = result["per_quote_mb"]
+    print(f"🧠 One Chromium per quote: {per_quote['browser_per_quote']} MB/quote "
+          f"({result['total_mb']['browser_per_quote']} MB for {args.quotes})")
+    print(f"🧠 Contexts on {args.hosts} Chromiums: {per_quote['contexts']} MB/quote "
+          f"({result['total_mb']['contexts']} MB for {args.quotes})")
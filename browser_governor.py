@@ -0,0 +1,135 @@
+"""
+Browser memory governor - keeps reused browsers from growing without bound
+
+Between quotes the governor closes the tabs a quote leaves behind (Cotizar,
+Cotización Individual and the PDF each open one), samples the Chromium
+process tree's RSS, and tells the caller to recycle the browser once it has
+served GOVERNOR_MAX_QUOTES quotes or crossed GOVERNOR_MAX_RSS_MB.
+
+A browser can also grow during one long quote, and only warm-pool browsers
+are reused. So run_quote also runs watch_memory() on every path (warm pool,
+workers, CLI). It samples every GOVERNOR_SAMPLE_INTERVAL seconds and stops
+the quote once the browser passes GOVERNOR_HARD_RSS_MB; the browser is
+killed with it. Browsers without a local process (CDP URLs, shared context
+hosts) aren't sampled. Per-browser memory is exported as the
+browser_rss_bytes gauge.
+"""
+import asyncio
+import os
+from typing import Callable, Dict, Optional
+
+import psutil
+from browser_use import Browser
+
+from metrics import REGISTRY
+
+
+GOVERNOR_MAX_QUOTES = int(os.getenv("GOVERNOR_MAX_QUOTES", "20"))
+GOVERNOR_MAX_RSS_MB = float(os.getenv("GOVERNOR_MAX_RSS_MB", "1500"))
+GOVERNOR_HARD_RSS_MB = float(os.getenv("GOVERNOR_HARD_RSS_MB", "3000"))
+GOVERNOR_SAMPLE_INTERVAL = float(os.getenv("GOVERNOR_SAMPLE_INTERVAL", "10"))
+
+BROWSER_RSS = REGISTRY.gauge("browser_rss_bytes", "RSS of each browser's process tree", ["browser"])
+BROWSER_RECYCLES = REGISTRY.counter("browser_recycles_total", "Browsers killed by the governor", ["reason"])
+
+
+def browser_pid(browser: Browser) -> Optional[int]:
+    """PID of a locally launched Chromium, None for remote/CDP browsers"""
+    watchdog = getattr(browser, "_local_browser_watchdog", None)
+    return getattr(watchdog, "browser_pid", None)
+
+
+def process_tree_rss(pid: int) -> int:
+    """RSS in bytes of a process and all its descendants (renderers, GPU, utility)"""
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return total
+
+
+async def watch_memory(browser: Browser, on_limit: Callable[[int], None], interval: float = GOVERNOR_SAMPLE_INTERVAL,
+                       limit_mb: float = GOVERNOR_HARD_RSS_MB):
+    """Sample a started browser's RSS until cancelled; call on_limit(rss) once if it passes limit_mb"""
+    pid = browser_pid(browser)
+    if not pid:
+        return
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            # Walking the process tree is a few syscalls per renderer; keep it off the loop
+            rss = await asyncio.to_thread(process_tree_rss, pid)
+            BROWSER_RSS.set(rss, browser=pid)
+            if rss >= limit_mb * 1024 * 1024:
+                BROWSER_RECYCLES.inc(reason="hard_rss")
+                on_limit(rss)
+                return
+    finally:
+        BROWSER_RSS.remove(browser=pid)
+
+
+class BrowserGovernor:
+    """Tracks quotes served and memory per browser; decides when to recycle"""
+
+    def __init__(self, max_quotes: int = GOVERNOR_MAX_QUOTES, max_rss_mb: float = GOVERNOR_MAX_RSS_MB):
+        self.max_quotes = max_quotes
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._quotes: Dict[int, int] = {}
+
+    def sample(self, browser: Browser) -> int:
+        """Current RSS of the browser's process tree, also published as a gauge"""
+        pid = browser_pid(browser)
+        rss = process_tree_rss(pid) if pid else 0
+        if pid:
+            BROWSER_RSS.set(rss, browser=pid)
+        return rss
+
+    async def close_stale_tabs(self, browser: Browser) -> int:
+        """Close every tab except the focused one; returns how many were closed"""
+        focused = browser.get_focused_target()
+        pages = browser.get_page_targets()
+        keep = focused.target_id if focused else (pages[0].target_id if pages else None)
+        closed = 0
+        for target in pages:
+            if target.target_id != keep:
+                await browser.close_page(target.target_id)
+                closed += 1
+        return closed
+
+    async def after_quote(self, browser: Browser) -> Optional[str]:
+        """
+        Tidy a browser after a quote.
+
+        Returns:
+            None if it can serve another quote, otherwise why it should be recycled
+        """
+        key = id(browser)
+        self._quotes[key] = self._quotes.get(key, 0) + 1
+        try:
+            await self.close_stale_tabs(browser)
+        except Exception:
+            return self._recycle(browser, "tab_cleanup_failed")
+        if self._quotes[key] >= self.max_quotes:
+            return self._recycle(browser, "max_quotes")
+        if self.sample(browser) >= self.max_rss:
+            return self._recycle(browser, "max_rss")
+        return None
+
+    def forget(self, browser: Browser):
+        """Stop tracking a browser that is being killed"""
+        self._quotes.pop(id(browser), None)
+        pid = browser_pid(browser)
+        if pid:
+            BROWSER_RSS.remove(browser=pid)
+
+    def _recycle(self, browser: Browser, reason: str) -> str:
+        BROWSER_RECYCLES.inc(reason=reason)
+        self.forget(browser)
+        return reason
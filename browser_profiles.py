@@ -0,0 +1,231 @@
+"""
+Persistent per-insurer browser profiles with a warm HTTP cache
+
+Browser() used to start every quote from an empty profile, so portal
+bundles, assets and fonts were downloaded again each time from slow
+insurer servers. ProfileStore keeps a template profile per insurer that
+holds only the HTTP and compiled-script caches (no cookies or storage).
+Each browser gets its own clone of it:
+- Clones are copy-on-write (cp --reflink) where the filesystem supports it,
+  plain copies elsewhere. Concurrent Chromiums never share a cache
+  directory, and logins never leak between quotes.
+- The cache is capped at BROWSER_CACHE_MB (--disk-cache-size).
+- After a successful quote, a browser's cache replaces the template once
+  the template is older than BROWSER_CACHE_MAX_AGE (or missing). The swap
+  happens after Chromium exits, under a file lock.
+
+    python browser_profiles.py status
+    python browser_profiles.py reset [insurer]
+    python browser_profiles.py bench <url> [--insurer qualitas]    # cold vs warm page load
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+BROWSER_PROFILES = os.getenv("BROWSER_PROFILES", "1") == "1"
+PROFILE_DIR = Path(os.getenv("BROWSER_PROFILE_DIR", "output/profiles"))
+BROWSER_CACHE_MB = int(os.getenv("BROWSER_CACHE_MB", "512"))
+BROWSER_CACHE_MAX_AGE = float(os.getenv("BROWSER_CACHE_MAX_AGE", str(24 * 3600)))
+
+# Relative to the user data dir; everything else (cookies, storage) stays per browser
+CACHE_DIRS = ("Default/Cache", "Default/Code Cache")
+# Clones not in use by a running Chromium are swept after this long (crashed processes)
+ORPHAN_AGE = 600
+
+
+def _clone_tree(src: Path, dst: Path):
+    """Copy-on-write copy where the filesystem allows it, a plain copy otherwise"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        subprocess.run(["cp", "-a", "--reflink=auto", str(src), str(dst)], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        # No GNU cp (macOS) or it failed part-way
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst, symlinks=True)
+
+
+def _tree_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) if path.exists() else 0
+
+
+class ProfileStore:
+    """Template cache and per-browser clones for one insurer"""
+
+    def __init__(self, insurer: str, root: Path = PROFILE_DIR, cache_mb: int = BROWSER_CACHE_MB,
+                 max_age: float = BROWSER_CACHE_MAX_AGE):
+        self.insurer = insurer
+        self.root = Path(root) / insurer
+        self.template = self.root / "template"
+        self.clones = self.root / "clones"
+        self.cache_mb = cache_mb
+        self.max_age = max_age
+
+    @contextmanager
+    def _lock(self, exclusive: bool):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def clone(self, warm: bool = True) -> Path:
+        """New user data dir for one browser, seeded with the template's cache"""
+        self.sweep()
+        clone = self.clones / uuid.uuid4().hex[:12]
+        clone.mkdir(parents=True)
+        if warm:
+            with self._lock(exclusive=False):
+                for cache_dir in CACHE_DIRS:
+                    if (self.template / cache_dir).exists():
+                        try:
+                            _clone_tree(self.template / cache_dir, clone / cache_dir)
+                        except OSError:
+                            # A cold cache is only slower
+                            shutil.rmtree(clone / cache_dir, ignore_errors=True)
+        return clone
+
+    def browser_kwargs(self, clone: Path) -> dict:
+        return {"user_data_dir": str(clone), "args": [f"--disk-cache-size={self.cache_mb * 1024 * 1024}"]}
+
+    def stale(self) -> bool:
+        stamp = self.template / "published"
+        return not stamp.exists() or time.time() - stamp.stat().st_mtime > self.max_age
+
+    def publish(self, clone: Path, force: bool = False) -> bool:
+        """Make a closed browser's cache the template (when stale, or forced)"""
+        if not (force or self.stale()) or not any((clone / d).exists() for d in CACHE_DIRS):
+            return False
+        staged = self.root / f"template.new-{uuid.uuid4().hex[:8]}"
+        for cache_dir in CACHE_DIRS:
+            if (clone / cache_dir).exists():
+                _clone_tree(clone / cache_dir, staged / cache_dir)
+        (staged / "published").touch()
+        retired = self.root / f"template.old-{uuid.uuid4().hex[:8]}"
+        with self._lock(exclusive=True):
+            if self.template.exists():
+                self.template.rename(retired)
+            staged.rename(self.template)
+        shutil.rmtree(retired, ignore_errors=True)
+        return True
+
+    def release(self, clone: Path, publish: bool = False):
+        """Drop a clone once its Chromium has exited, publishing its cache first if asked"""
+        try:
+            if publish:
+                self.publish(clone)
+        finally:
+            shutil.rmtree(clone, ignore_errors=True)
+
+    def sweep(self):
+        """Remove clones left behind by crashed processes"""
+        if not self.clones.exists():
+            return
+        for clone in self.clones.iterdir():
+            in_use = os.path.lexists(clone / "SingletonLock")
+            if not in_use and time.time() - clone.stat().st_mtime > ORPHAN_AGE:
+                shutil.rmtree(clone, ignore_errors=True)
+
+    def reset(self):
+        """Forget the warm cache; running browsers keep their clones until they exit"""
+        with self._lock(exclusive=True):
+            shutil.rmtree(self.template, ignore_errors=True)
+
+    def status(self) -> dict:
+        stamp = self.template / "published"
+        return {
+            "insurer": self.insurer,
+            "template_mb": round(_tree_bytes(self.template) / 1024 / 1024, 1),
+            "template_age_h": round((time.time() - stamp.stat().st_mtime) / 3600, 1) if stamp.exists() else None,
+            "clones": len(list(self.clones.iterdir())) if self.clones.exists() else 0,
+            "cache_limit_mb": self.cache_mb,
+        }
+
+
+_PAGE_LOAD_JS = """() => {
+    const nav = performance.getEntriesByType('navigation')[0];
+    const resources = performance.getEntriesByType('resource');
+    return {
+        load_ms: Math.round(nav.loadEventEnd - nav.startTime),
+        transferred_kb: Math.round((nav.transferSize + resources.reduce((s, r) => s + r.transferSize, 0)) / 1024),
+        resources: resources.length,
+        from_cache: resources.filter(r => r.transferSize === 0 && r.decodedBodySize > 0).length,
+    };
+}"""
+
+
+async def _load_page(store: ProfileStore, clone: Path, url: str) -> dict:
+    from browser_use import Browser
+
+    browser = Browser(headless=True, **store.browser_kwargs(clone))
+    await browser.start()
+    try:
+        await browser.navigate_to(url)
+        page = await browser.must_get_current_page()
+        for _ in range(120):
+            if await page.evaluate("() => document.readyState") == "complete":
+                break
+            await asyncio.sleep(0.5)
+        return json.loads(await page.evaluate(_PAGE_LOAD_JS))
+    finally:
+        await browser.kill()
+
+
+async def bench(url: str, insurer: str) -> dict:
+    """Load url from an empty profile, publish that cache, then load it from a warm clone"""
+    store = ProfileStore(insurer)
+    cold_clone = store.clone(warm=False)
+    try:
+        cold = await _load_page(store, cold_clone, url)
+    finally:
+        store.publish(cold_clone, force=True)
+        store.release(cold_clone)
+    warm_clone = store.clone()
+    try:
+        warm = await _load_page(store, warm_clone, url)
+    finally:
+        store.release(warm_clone)
+    return {"cold": cold, "warm": warm}
+
+
+def _insurers(root: Path = PROFILE_DIR) -> list:
+    return sorted(p.name for p in root.iterdir() if p.is_dir()) if root.exists() else []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-insurer browser cache profiles")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="template size and age per insurer")
+    reset = subparsers.add_parser("reset", help="drop the warm cache")
+    reset.add_argument("insurer", nargs="?", help="default: every insurer")
+    bench_parser = subparsers.add_parser("bench", help="cold vs warm page load for a URL")
+    bench_parser.add_argument("url")
+    bench_parser.add_argument("--insurer", default="bench")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for insurer in _insurers():
+            print(ProfileStore(insurer).status())
+    elif args.command == "reset":
+        for insurer in [args.insurer] if args.insurer else _insurers():
+            ProfileStore(insurer).reset()
+            print(f"🧹 Cleared the {insurer} browser cache")
+    elif args.command == "bench":
+        result = asyncio.run(bench(args.url, args.insurer))
+        for state in ("cold", "warm"):
+            r = result[state]
+            print(f"⏱️  {state}: {r['load_ms']} ms, {r['transferred_kb']} KB over the network, "
+                  f"{r['from_cache']}/{r['resources']} resources from disk cache")
+        if result["cold"]["load_ms"]:
+            print(f"📉 Warm load takes {result['warm']['load_ms'] / result['cold']['load_ms']:.0%} of cold")
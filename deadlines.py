@@ -0,0 +1,157 @@
+"""
+Wall-clock deadlines and cancellation for quotes and phases
+
+Agent.run(max_steps=...) bounds steps, not time. Every phase runs under a
+per-insurer deadline (run_with_deadline), and every quote under a
+CancelScope that fires at the quote deadline or on cancel_quote(). Stopping
+is cooperative first: the running agent is asked to stop after its current
+step. If it hasn't stopped after CANCEL_GRACE seconds (a hung LLM call or
+page), the task is cancelled outright. Callers capture a diagnostic snapshot
+and always release the browser.
+
+cancel_quote() is thread-safe, so the Streamlit thread and the job layer
+can call it while the quote runs on another event loop.
+"""
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from failures import FailureClass, QuoteCancelled
+
+
+DEADLINE_SCALE = float(os.getenv("DEADLINE_SCALE", "1"))
+CANCEL_GRACE = float(os.getenv("CANCEL_GRACE", "15"))
+
+
+@dataclass(frozen=True)
+class Deadlines:
+    quote: float
+    phases: Dict[str, float] = field(default_factory=dict)
+
+    def for_quote(self) -> float:
+        return self.quote * DEADLINE_SCALE
+
+    def for_phase(self, phase: str) -> float:
+        return self.phases.get(phase, self.quote) * DEADLINE_SCALE
+
+
+# Seconds; DEADLINE_SCALE stretches them all (e.g. 2 for a slow network)
+DEADLINES = {
+    "qualitas": Deadlines(quote=600, phases={"navigation": 180, "select": 150, "completion": 240}),
+    "afirme": Deadlines(quote=900, phases={"navigation": 300, "vehicle": 480}),
+}
+
+
+class PhaseTimeout(TimeoutError):
+    """A phase that ran past its deadline (classified as portal_timeout, so it may be retried)"""
+
+    def __init__(self, phase: str, seconds: float):
+        super().__init__(f"{phase} timed out after {seconds:.0f}s")
+        self.phase = phase
+        self.seconds = seconds
+
+
+_scopes: Dict[str, "CancelScope"] = {}
+_scopes_lock = threading.Lock()
+
+
+class CancelScope:
+    """
+    Deadline and cancel handle for one quote; use as a context manager
+    inside the task that runs the quote.
+
+    run_phase registers its agent in scope.agent so a cancel can stop it
+    cooperatively.
+    """
+
+    def __init__(self, quote_id: str, deadline: Optional[float] = None):
+        self.quote_id = quote_id
+        self.deadline = deadline
+        self.failure: Optional[FailureClass] = None
+        self.agent = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timers = []
+
+    def __enter__(self) -> "CancelScope":
+        self._task = asyncio.current_task()
+        self._loop = self._task.get_loop()
+        if self.deadline:
+            self._timers.append(self._loop.call_later(self.deadline, self.cancel, FailureClass.DEADLINE_EXCEEDED))
+        with _scopes_lock:
+            _scopes[self.quote_id] = self
+        return self
+
+    def __exit__(self, *exc):
+        for timer in self._timers:
+            timer.cancel()
+        with _scopes_lock:
+            if _scopes.get(self.quote_id) is self:
+                del _scopes[self.quote_id]
+
+    @property
+    def cancelled(self) -> bool:
+        return self.failure is not None
+
+    def cancel(self, failure: FailureClass = FailureClass.CANCELLED):
+        """Stop the quote; must be called on the scope's loop (see cancel_quote)"""
+        if self.failure is not None:
+            return
+        self.failure = failure
+        if self.agent is not None:
+            self.agent.stop()
+            self._timers.append(self._loop.call_later(CANCEL_GRACE, self._task.cancel))
+        else:
+            # Between phases (waits, backoff) there is nothing to stop gracefully
+            self._task.cancel()
+
+    def check(self):
+        """Raise QuoteCancelled if the scope was cancelled"""
+        if self.failure is not None:
+            raise QuoteCancelled(self.quote_id, self.failure)
+
+    def error(self) -> QuoteCancelled:
+        return QuoteCancelled(self.quote_id, self.failure or FailureClass.CANCELLED)
+
+
+def scope_for(quote_id: str) -> Optional[CancelScope]:
+    with _scopes_lock:
+        return _scopes.get(quote_id)
+
+
+def cancel_quote(quote_id: str, failure: FailureClass = FailureClass.CANCELLED) -> bool:
+    """
+    Cancel a running quote from any thread.
+
+    Returns:
+        False if no quote with that id is running in this process
+    """
+    scope = scope_for(quote_id)
+    if scope is None or scope._loop is None:
+        return False
+    scope._loop.call_soon_threadsafe(scope.cancel, failure)
+    return True
+
+
+async def run_with_deadline(agent, phase: str, timeout: float, **run_kwargs):
+    """
+    agent.run(**run_kwargs) bounded by wall-clock time.
+
+    Raises:
+        PhaseTimeout: the agent was stopped (or cancelled after CANCEL_GRACE)
+            at the deadline
+    """
+    task = asyncio.ensure_future(agent.run(**run_kwargs))
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        if done:
+            return task.result()
+        agent.stop()
+        await asyncio.wait({task}, timeout=CANCEL_GRACE)
+        raise PhaseTimeout(phase, timeout)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,158 @@
+"""
+Failure taxonomy and phase-scoped retry policies
+
+classify() maps a failed phase (raised exception and/or agent history) to a
+FailureClass; RETRY_POLICIES says what to do about it: retry the same phase,
+log in again first, retry on the fallback model, or give up. Attempts are
+bounded and backed off, and every failure/retry is counted per class.
+"""
+import random
+import re
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+from metrics import REGISTRY
+
+
+class FailureClass(str, Enum):
+    LOGIN_REJECTED = "login_rejected"
+    SESSION_EXPIRED = "session_expired"
+    ELEMENT_NOT_FOUND = "element_not_found"
+    VEHICLE_NOT_IN_CATALOG = "vehicle_not_in_catalog"
+    PORTAL_TIMEOUT = "portal_timeout"
+    LLM_RATE_LIMIT = "llm_rate_limit"
+    STEP_BUDGET_EXHAUSTED = "step_budget_exhausted"
+    DEADLINE_EXCEEDED = "deadline_exceeded"
+    CANCELLED = "cancelled"
+    BROWSER_MEMORY = "browser_memory"
+    UNKNOWN = "unknown"
+
+
+class RetryAction(str, Enum):
+    RETRY_PHASE = "retry_phase"
+    RELOGIN = "relogin"
+    SWITCH_MODEL = "switch_model"
+    GIVE_UP = "give_up"
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    action: RetryAction
+    max_attempts: int = 0
+    base_delay: float = 2.0
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter, capped at max_delay"""
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+RETRY_POLICIES = {
+    # Bad credentials won't fix themselves; retrying risks locking the account
+    FailureClass.LOGIN_REJECTED: RetryPolicy(RetryAction.GIVE_UP),
+    FailureClass.SESSION_EXPIRED: RetryPolicy(RetryAction.RELOGIN, max_attempts=1),
+    FailureClass.ELEMENT_NOT_FOUND: RetryPolicy(RetryAction.RETRY_PHASE, max_attempts=2, base_delay=2),
+    FailureClass.VEHICLE_NOT_IN_CATALOG: RetryPolicy(RetryAction.GIVE_UP),
+    FailureClass.PORTAL_TIMEOUT: RetryPolicy(RetryAction.RETRY_PHASE, max_attempts=2, base_delay=5, max_delay=60),
+    FailureClass.LLM_RATE_LIMIT: RetryPolicy(RetryAction.SWITCH_MODEL, max_attempts=2, base_delay=1),
+    FailureClass.STEP_BUDGET_EXHAUSTED: RetryPolicy(RetryAction.RETRY_PHASE, max_attempts=1, base_delay=0),
+    # The quote's time is up or someone asked to stop; a retry would do neither
+    FailureClass.DEADLINE_EXCEEDED: RetryPolicy(RetryAction.GIVE_UP),
+    FailureClass.CANCELLED: RetryPolicy(RetryAction.GIVE_UP),
+    # The governor stopped a quote whose browser passed its hard memory ceiling
+    FailureClass.BROWSER_MEMORY: RetryPolicy(RetryAction.GIVE_UP),
+    FailureClass.UNKNOWN: RetryPolicy(RetryAction.RETRY_PHASE, max_attempts=1, base_delay=2),
+}
+
+# Checked in order against exception text, step errors and the agent's final message
+PATTERNS = [
+    (FailureClass.LLM_RATE_LIMIT, r"rate.?limit|\b429\b|too many requests|overloaded|quota"),
+    (FailureClass.LOGIN_REJECTED, r"contrase[ñn]a (incorrecta|inv[aá]lida)|usuario o contrase|invalid (credentials|password)|login (failed|rejected)|acceso denegado"),
+    (FailureClass.SESSION_EXPIRED, r"sesi[oó]n (expir|caduc|finaliz)|session (expired|timed out)|vuelva a iniciar"),
+    (FailureClass.VEHICLE_NOT_IN_CATALOG, r"(veh[ií]culo|vehicle|model).{0,40}(no (se )?encontr|not (found|available|listed)|no disponible)|no (hay )?resultados"),
+    (FailureClass.PORTAL_TIMEOUT, r"timed? ?out|timeout|took too long|net::err|page (did not|didn't) load|still loading"),
+    (FailureClass.ELEMENT_NOT_FOUND, r"element (with index \d+ )?(does not exist|not found|not available)|no element|could not (find|click)|selector"),
+]
+
+FAILURES = REGISTRY.counter("quote_failures_total", "Failed phase attempts by class", ["insurer", "phase", "failure"])
+RETRIES = REGISTRY.counter("quote_retries_total", "Retries issued by class and action", ["insurer", "phase", "failure", "action"])
+
+
+class PhaseFailure(Exception):
+    """A phase that failed after its retry policy was exhausted"""
+
+    def __init__(self, failure: FailureClass, phase: str, detail: str = ""):
+        super().__init__(f"{phase} failed ({failure.value}): {detail}" if detail else f"{phase} failed ({failure.value})")
+        self.failure = failure
+        self.phase = phase
+        self.detail = detail
+
+
+_STOPPED = {
+    FailureClass.DEADLINE_EXCEEDED: "timed out",
+    FailureClass.BROWSER_MEMORY: "was stopped: its browser passed the memory ceiling",
+}
+
+
+class QuoteCancelled(Exception):
+    """A quote stopped by its deadline, cancel_quote() or the browser memory governor"""
+
+    def __init__(self, quote_id: str, failure: FailureClass):
+        super().__init__(f"quote {quote_id} {_STOPPED.get(failure, 'was cancelled')}")
+        self.quote_id = quote_id
+        self.failure = failure
+
+
+def _match(text: str) -> Optional[FailureClass]:
+    for failure, pattern in PATTERNS:
+        if re.search(pattern, text, re.IGNORECASE):
+            return failure
+    return None
+
+
+def classify(error: Optional[BaseException] = None, history=None, max_steps: Optional[int] = None) -> Optional[FailureClass]:
+    """
+    Classify a phase outcome.
+
+    Args:
+        error: exception raised by the phase, if any
+        history: AgentHistoryList returned by Agent.run(), if any
+        max_steps: the phase's step budget, to detect budget exhaustion
+
+    Returns:
+        None when the phase succeeded, otherwise the best-matching FailureClass
+    """
+    if error is not None:
+        if isinstance(error, (PhaseFailure, QuoteCancelled)):
+            return error.failure
+        if type(error).__name__ == "ModelRateLimitError":
+            return FailureClass.LLM_RATE_LIMIT
+        if isinstance(error, TimeoutError):
+            return FailureClass.PORTAL_TIMEOUT
+        return _match(f"{type(error).__name__}: {error}") or FailureClass.UNKNOWN
+
+    if history is None:
+        return None
+    if history.is_done() and history.is_successful() is not False:
+        return None
+
+    # The agent's own explanation is the most specific signal, then the latest errors
+    texts = [history.final_result() or ""] + [e for e in reversed(history.errors()) if e]
+    for text in texts:
+        failure = _match(text)
+        if failure:
+            return failure
+    if not history.is_done() and max_steps and history.number_of_steps() >= max_steps:
+        return FailureClass.STEP_BUDGET_EXHAUSTED
+    return FailureClass.UNKNOWN
+
+
+def failure_detail(error: Optional[BaseException] = None, history=None) -> str:
+    """Short human-readable reason to go with a FailureClass"""
+    if error is not None:
+        return str(error)
+    if history is not None:
+        errors = [e for e in history.errors() if e]
+        return history.final_result() or (errors[-1] if errors else "")
+    return ""
@@ -0,0 +1,260 @@
+"""
+Batched form filling for cascading dropdown forms
+
+fill_form() takes a list of FormFields (label -> value, plus the fields each
+one depends on) and fills them directly through the page in dependency order.
+There is no agent loop and no fixed sleeps: after a parent is set, the
+dependent field is polled until its options are enabled and have changed.
+Values are matched to options exactly, then by unique containment. The LLM
+is asked only for values that still can't be resolved. A final pass reads
+every field back and checks it.
+
+Native <select>, text inputs and Angular Material / ARIA listboxes are
+supported. Whatever fails is listed in the FillReport so an agent can finish
+just those fields.
+"""
+import asyncio
+import json
+import os
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+FIELD_TIMEOUT = float(os.getenv("FORM_FIELD_TIMEOUT", "15"))
+POLL_INTERVAL = 0.2
+# A dependent whose options never change (same list for every parent) is accepted after this long
+SETTLE_TIMEOUT = 3.0
+
+# Value meaning "whatever the single available option is" (e.g. Uso)
+ONLY_OPTION = "__only_option__"
+
+
+@dataclass
+class FormField:
+    label: str
+    value: str
+    depends_on: Tuple[str, ...] = ()
+
+
+@dataclass
+class FillReport:
+    filled: Dict[str, str] = field(default_factory=dict)
+    resolved_by_llm: Dict[str, str] = field(default_factory=dict)
+    failed: Dict[str, str] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def remaining(self, fields: List[FormField]) -> List[FormField]:
+        return [f for f in fields if f.label in self.failed]
+
+
+class OptionChoice(BaseModel):
+    option: str
+
+
+# One entry point for every page-side operation: probe / open / set
+FORM_JS = r"""(op, label, value) => {
+  const norm = s => (s || "").normalize("NFD").replace(/[\u0300-\u036f]/g, "").replace(/[*:]/g, "").replace(/\s+/g, " ").trim().toLowerCase();
+  const want = norm(label);
+  const controls = "select, input:not([type=hidden]):not([type=checkbox]):not([type=radio]), textarea, mat-select, [role=combobox]";
+  const visible = el => !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+  const find = () => {
+    for (const lab of document.querySelectorAll("label, mat-label")) {
+      if (norm(lab.textContent) !== want) continue;
+      let el = lab.htmlFor ? document.getElementById(lab.htmlFor) : null;
+      el = el || lab.querySelector(controls);
+      const wrapper = lab.closest("mat-form-field") || lab.parentElement;
+      el = el || (wrapper && wrapper.querySelector(controls));
+      if (visible(el)) return el;
+    }
+    for (const el of document.querySelectorAll(controls)) {
+      const names = [el.getAttribute("aria-label"), el.getAttribute("placeholder"), el.getAttribute("name"), el.id];
+      if (visible(el) && names.some(n => norm(n) === want)) return el;
+    }
+    return null;
+  };
+  const el = find();
+  if (!el) return {found: false};
+  const kind = el.tagName === "SELECT" ? "select" : (["INPUT", "TEXTAREA"].includes(el.tagName) ? "text" : "listbox");
+  const enabled = !el.disabled && el.getAttribute("aria-disabled") !== "true";
+  const listOptions = () => kind === "select"
+    ? Array.from(el.options).filter(o => !o.disabled && o.value !== "").map(o => o.text.trim())
+    : Array.from(document.querySelectorAll("mat-option, [role=option]")).filter(visible).map(o => o.textContent.trim());
+  const display = () => kind === "select"
+    ? (el.selectedIndex >= 0 && el.options[el.selectedIndex].value !== "" ? el.options[el.selectedIndex].text.trim() : "")
+    : (kind === "text" ? el.value : el.textContent.trim());
+  const fire = target => ["input", "change", "blur"].forEach(t => target.dispatchEvent(new Event(t, {bubbles: true})));
+
+  if (op === "open" && kind === "listbox") el.click();
+  if (op === "set") {
+    if (kind === "select") {
+      const option = Array.from(el.options).find(o => o.text.trim() === value);
+      if (!option) return {found: true, error: "option not found"};
+      el.value = option.value;
+      fire(el);
+    } else if (kind === "text") {
+      el.focus();
+      const setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), "value").set;
+      setter.call(el, value);
+      fire(el);
+    } else {
+      const option = Array.from(document.querySelectorAll("mat-option, [role=option]")).find(o => visible(o) && o.textContent.trim() === value);
+      if (!option) return {found: true, error: "option not found"};
+      option.click();
+    }
+  }
+  return {found: true, kind, enabled, options: listOptions(), value: display()};
+}"""
+
+
+def _norm(text: str) -> str:
+    text = unicodedata.normalize("NFD", text or "")
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).lower().split())
+
+
+async def _call(page, op: str, label: str, value: str = "") -> dict:
+    return json.loads(await page.evaluate(FORM_JS, op, label, value) or "{}")
+
+
+def dependency_order(fields: List[FormField]) -> List[FormField]:
+    """Parents before dependents, otherwise in the given order"""
+    by_label = {f.label: f for f in fields}
+    ordered, seen = [], set()
+
+    def visit(f: FormField, path=()):
+        if f.label in seen:
+            return
+        if f.label in path:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + (f.label,))}")
+        for parent in f.depends_on:
+            if parent in by_label:
+                visit(by_label[parent], path + (f.label,))
+        seen.add(f.label)
+        ordered.append(f)
+
+    for f in fields:
+        visit(f)
+    return ordered
+
+
+def resolve(value: str, options: List[str]) -> Optional[str]:
+    """Exact option for a value, or None if it needs judgement"""
+    if value == ONLY_OPTION:
+        return options[0] if len(options) == 1 else None
+    wanted = _norm(value)
+    exact = [o for o in options if _norm(o) == wanted]
+    if exact:
+        return exact[0]
+    partial = [o for o in options if wanted in _norm(o) or (_norm(o) and _norm(o) in wanted)]
+    return partial[0] if len(partial) == 1 else None
+
+
+async def _ask_llm(llm, f: FormField, options: List[str]) -> Optional[str]:
+    from browser_use.llm.messages import UserMessage
+
+    wanted = "the only sensible option" if f.value == ONLY_OPTION else f'"{f.value}"'
+    prompt = (f'Form field "{f.label}" must be set to {wanted}. Pick the option that means the same thing, '
+              f"copied exactly from this list:\n" + "\n".join(f"- {o}" for o in options))
+    response = await llm.ainvoke([UserMessage(content=prompt)], output_format=OptionChoice)
+    choice = response.completion.option.strip()
+    return choice if choice in options else resolve(choice, options)
+
+
+async def _wait_ready(page, f: FormField, stale_options: Optional[List[str]], timeout: float) -> dict:
+    """Poll until the field is enabled with fresh options (a text field just needs to be enabled)"""
+    started = time.monotonic()
+    while True:
+        state = await _call(page, "probe", f.label)
+        elapsed = time.monotonic() - started
+        if state.get("found") and state["enabled"]:
+            if state["kind"] != "select":
+                return state
+            if state["options"] and (state["options"] != stale_options or elapsed >= SETTLE_TIMEOUT):
+                return state
+        if elapsed >= timeout:
+            return state
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def _listbox_options(page, f: FormField, timeout: float) -> dict:
+    """Open a custom dropdown and wait for its options to render"""
+    state = await _call(page, "open", f.label)
+    started = time.monotonic()
+    while not state.get("options") and time.monotonic() - started < timeout:
+        await asyncio.sleep(POLL_INTERVAL)
+        state = await _call(page, "probe", f.label)
+    return state
+
+
+async def fill_form(browser, fields: List[FormField], llm=None, timeout: float = FIELD_TIMEOUT) -> FillReport:
+    """
+    Fill a form in one pass.
+
+    Args:
+        browser: browser_use session with the form in its current tab
+        fields: values to set; depends_on names fields that must be set first
+        llm: chat model for values with no exact option (None = fail those)
+        timeout: per-field wait for the control and its options
+
+    Returns:
+        FillReport; report.failed lists the fields left for an agent
+    """
+    started = time.monotonic()
+    page = await browser.must_get_current_page()
+    report = FillReport()
+    ordered = dependency_order(fields)
+    dependents = {f.label: [d for d in ordered if f.label in d.depends_on] for f in ordered}
+    # Options each field showed before its parent changed, to tell fresh options from stale ones
+    stale: Dict[str, List[str]] = {}
+
+    for f in ordered:
+        blocked = [parent for parent in f.depends_on if parent in report.failed]
+        if blocked:
+            report.failed[f.label] = f"depends on {', '.join(blocked)}"
+            continue
+        state = await _wait_ready(page, f, stale.get(f.label), timeout)
+        if not state.get("found"):
+            report.failed[f.label] = "field not found"
+            continue
+        if not state["enabled"]:
+            report.failed[f.label] = "field stayed disabled"
+            continue
+
+        if state["kind"] == "text":
+            choice = f.value
+        else:
+            if state["kind"] == "listbox":
+                state = await _listbox_options(page, f, timeout)
+            choice = resolve(f.value, state.get("options", []))
+            if choice is None and llm is not None and state.get("options"):
+                choice = await _ask_llm(llm, f, state["options"])
+                if choice:
+                    report.resolved_by_llm[f.label] = choice
+            if choice is None:
+                report.failed[f.label] = f"no option matches {f.value!r}"
+                continue
+
+        for dependent in dependents[f.label]:
+            stale[dependent.label] = (await _call(page, "probe", dependent.label)).get("options")
+        result = await _call(page, "set", f.label, choice)
+        if result.get("error"):
+            report.failed[f.label] = result["error"]
+            continue
+        report.filled[f.label] = choice
+
+    # Verify everything at the end: a later field can reset an earlier one
+    for label, choice in list(report.filled.items()):
+        value = (await _call(page, "probe", label)).get("value", "")
+        if _norm(value) != _norm(choice):
+            report.failed[label] = f"reads back {value!r}, expected {choice!r}"
+            del report.filled[label]
+
+    report.seconds = round(time.monotonic() - started, 2)
+    return report
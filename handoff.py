@@ -0,0 +1,113 @@
+"""
+Phase handoff - carry a compact summary from one phase agent to the next
+
+Every phase starts a fresh Agent, which otherwise spends its first steps
+re-reading the page to work out where it is. PhaseHandoff.from_history()
+condenses the finished phase (tab and URL, elements it used, values it
+entered, what it achieved) and to_prompt() appends that to the next
+phase's task.
+
+Set PHASE_HANDOFF=0 to turn it off. Steps per phase are counted with the
+handoff on and off, so the saving can be read from the metrics or compared
+with `python trace_archive.py steps`. The comparison itself is still
+outstanding (see the README).
+"""
+import os
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from metrics import REGISTRY
+
+
+HANDOFF_ENABLED = os.getenv("PHASE_HANDOFF", "1") != "0"
+HANDOFF_MAX_ITEMS = 8
+
+# Actions whose text argument is a value typed/picked into the form
+VALUE_ACTIONS = ("input", "input_text", "select_dropdown", "select_dropdown_option")
+ELEMENT_ATTRIBUTES = ("id", "name", "placeholder", "aria-label", "title", "value")
+
+# phase_steps_sum / phase_steps_count per label set = mean steps per phase, with vs without handoff
+PHASE_STEPS = REGISTRY.histogram("phase_steps", "Agent steps per phase run", ["insurer", "phase", "model", "handoff"],
+                                 buckets=(1, 2, 3, 5, 8, 10, 15, 20, 30))
+
+
+@dataclass
+class PhaseHandoff:
+    phase: str
+    url: str = ""
+    title: str = ""
+    tabs: List[str] = field(default_factory=list)
+    achieved: str = ""
+    elements: List[str] = field(default_factory=list)
+    entered: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_history(cls, phase: str, history) -> "PhaseHandoff":
+        """Summarize a finished phase from its AgentHistoryList"""
+        handoff = cls(phase=phase)
+        if not history or not history.history:
+            return handoff
+        last = history.history[-1]
+        handoff.url = last.state.url or ""
+        handoff.title = last.state.title or ""
+        handoff.tabs = [f"{tab.title or tab.url} ({tab.target_id[-4:]})" for tab in last.state.tabs or []]
+        if history.is_done():
+            handoff.achieved = history.final_result() or ""
+        elif last.model_output:
+            handoff.achieved = last.model_output.memory or ""
+
+        for item in history.history:
+            if not item.model_output:
+                continue
+            elements = item.state.interacted_element or []
+            for n, action in enumerate(item.model_output.action):
+                name, params = next(iter(action.model_dump(exclude_none=True).items()), (None, None))
+                if not isinstance(params, dict) or "index" not in params:
+                    continue
+                element = elements[n] if n < len(elements) else None
+                described = f"[{params['index']}] {_describe(element)}"
+                if name in VALUE_ACTIONS and params.get("text"):
+                    handoff.entered.append(f"{described} = {params['text']!r}")
+                else:
+                    handoff.elements.append(f"{name} {described}")
+        handoff.elements = _dedupe(handoff.elements)[-HANDOFF_MAX_ITEMS:]
+        handoff.entered = _dedupe(handoff.entered)[-HANDOFF_MAX_ITEMS:]
+        return handoff
+
+    def to_prompt(self) -> str:
+        lines = [
+            "",
+            f"CONTEXT FROM THE PREVIOUS PHASE ({self.phase}) - the browser is already here, do not start over:",
+            f"- Current tab: {self.title} {self.url}".rstrip(),
+        ]
+        if len(self.tabs) > 1:
+            lines.append(f"- Open tabs: {'; '.join(self.tabs)}")
+        if self.achieved:
+            lines.append(f"- Achieved: {self.achieved}")
+        if self.entered:
+            lines.append("- Values already entered (do not re-enter): " + "; ".join(self.entered))
+        if self.elements:
+            lines.append("- Elements used (indices may have shifted, match by label): " + "; ".join(self.elements))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _describe(element) -> str:
+    if element is None:
+        return "?"
+    attributes = element.attributes or {}
+    label = ", ".join(f'{key}="{attributes[key]}"' for key in ELEMENT_ATTRIBUTES if attributes.get(key))
+    return f"<{element.node_name.lower()} {label}>" if label else f"<{element.node_name.lower()}>"
+
+
+def _dedupe(items: List[str]) -> List[str]:
+    return list(dict.fromkeys(items))
+
+
+def with_handoff(task: str, handoff: Optional[PhaseHandoff]) -> str:
+    """The phase task with the previous phase's summary appended, when enabled"""
+    if handoff is None or not HANDOFF_ENABLED:
+        return task
+    return task + handoff.to_prompt()
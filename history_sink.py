@@ -0,0 +1,129 @@
+"""
+Bounded-memory agent history for long single-agent runs
+
+Agent.run() keeps every step in agent.history until it returns. Screenshots
+already go to disk, but each step also holds the full state message (the
+serialized DOM sent to the model, often 20-100 KB), the interacted DOM
+elements and any extracted page content. A 100-step run holds megabytes,
+and several runs per process multiply that.
+
+HistorySink is an on_step_end hook. Each finished step (every one added
+since the previous call, if several) is appended to the run's trace
+(trace_archive.py: compressed record plus JPEG screenshot). Every step
+but the newest is then trimmed in memory: the state message and element
+details are dropped, the screenshot file is removed, and long extracted
+content is cut to a preview. The newest step stays whole because
+final_result(), structured_output and is_done() read it. If the trimmed
+summaries still pass HISTORY_MEMORY_MB, the oldest steps also lose their
+thinking and memory text, so memory stays flat however long the run is.
+
+load(step) reads a step's full payload back from the trace.
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+from trace_archive import TRACE_DIR, TraceReader, TraceWriter
+
+
+HISTORY_MEMORY_MB = float(os.getenv("HISTORY_MEMORY_MB", "8"))
+# Extracted content longer than this is trimmed to a preview once spilled
+PREVIEW_CHARS = 500
+SPILLED = " …[spilled to trace]"
+
+
+def _preview(text: Optional[str]) -> Optional[str]:
+    if text is None or len(text) <= PREVIEW_CHARS:
+        return text
+    return text[:PREVIEW_CHARS] + SPILLED
+
+
+def _resident_bytes(item) -> int:
+    """Rough size of what a history item keeps in memory"""
+    size = len(item.state_message or "") + len(item.state.url or "") + len(item.state.title or "")
+    if item.model_output is not None:
+        size += len(item.model_output.model_dump_json())
+    return size + sum(len(result.model_dump_json()) for result in item.result)
+
+
+class HistorySink:
+    """Spill an agent's steps to a trace as they finish; keep lightweight summaries in memory"""
+
+    def __init__(self, run_id: str, label: str = "agent", memory_mb: float = HISTORY_MEMORY_MB,
+                 trace_dir=TRACE_DIR):
+        self.run_id = run_id
+        self.label = label
+        self.memory_limit = memory_mb * 1024 * 1024
+        self.trace_dir = trace_dir
+        self.trace = TraceWriter(run_id, trace_dir)
+        self._records: List[int] = []      # history index -> trace record number
+        self._resident: Dict[int, int] = {}
+        self._compacted = 0
+        self._appended = 0
+
+    def agent_hooks(self) -> dict:
+        """on_step_end kwarg for Agent.run()"""
+        async def on_step_end(agent):
+            await self.spill(agent)
+        return {"on_step_end": on_step_end}
+
+    async def spill(self, agent):
+        history = agent.history.history
+        if len(history) <= len(self._records):
+            return
+        # Every item added since the last call, not just the newest: one callback can see several.
+        # Screenshot compression and the writes stay off the event loop.
+        await asyncio.to_thread(self._record, history[len(self._records):])
+
+        for index in range(len(history) - 1):
+            if index not in self._resident:
+                self._trim(history[index])
+                self._resident[index] = _resident_bytes(history[index])
+        self._enforce_ceiling(history)
+
+    def _record(self, items):
+        for item in items:
+            self.trace.record_item(item, self.label)
+            self._records.append(self._appended)
+            self._appended += 1
+
+    def _trim(self, item):
+        item.state_message = None
+        item.state.interacted_element = [None] * len(item.state.interacted_element)
+        if item.state.screenshot_path:
+            # The trace holds a compressed copy
+            try:
+                os.remove(item.state.screenshot_path)
+            except OSError:
+                pass
+            item.state.screenshot_path = None
+        for result in item.result:
+            result.extracted_content = _preview(result.extracted_content)
+
+    def _enforce_ceiling(self, history):
+        """Compact the oldest summaries further while the run is over its memory ceiling"""
+        while sum(self._resident.values()) > self.memory_limit and self._compacted < len(self._resident):
+            item = history[self._compacted]
+            if item.model_output is not None:
+                item.model_output.thinking = None
+                item.model_output.memory = SPILLED.strip()
+            for result in item.result:
+                result.extracted_content = SPILLED.strip() if result.extracted_content else None
+                result.long_term_memory = None
+            self._resident[self._compacted] = _resident_bytes(item)
+            self._compacted += 1
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self._resident.values())
+
+    def load(self, step: int, with_screenshot: bool = False) -> dict:
+        """
+        Full payload of history step `step` (0-based) as recorded in the trace:
+        dom (the state message), actions, model_output, results (untrimmed),
+        plus the JPEG screenshot when asked for.
+        """
+        return TraceReader(self.run_id, self.trace_dir).read(self._records[step], with_screenshot=with_screenshot)
+
+    def close(self):
+        self.trace.close()
@@ -0,0 +1,138 @@
+"""
+LLM-free idle waiting on slow portal loads
+
+Afirme pages take 5-30 s to load (afirme_steps_guide.txt), and an agent that
+looks at a spinner just spends a model call deciding to wait again. IdleWaiter
+hooks on_step_start: before the next step captures state and calls the model,
+it probes the page. While the page is visibly loading, it polls locally
+instead of spending a model call, up to IDLE_WAIT_CAP seconds. Loading means
+one of the insurer's loading overlays is up (a match for its selectors that
+is visible and either covers most of the viewport or sits under its centre,
+blocking clicks there), the document isn't complete, or the DOM digest is
+unchanged since the last step while network requests are still completing.
+A page that shows none of these is not held at all; an unchanged one costs
+a single extra probe.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from metrics import REGISTRY
+
+
+IDLE_WAIT_CAP = float(os.getenv("IDLE_WAIT_CAP", "45"))
+IDLE_POLL_INTERVAL = 0.5
+# Network counts as quiet once no request has finished for this long
+NETWORK_QUIET = 1.0
+
+# Loading overlays per insurer (CSS selectors): only each portal's own blocking
+# overlays, no generic class names a decorative element could carry
+SPINNER_SIGNATURES: Dict[str, List[str]] = {
+    # Angular Material portal: ngx-spinner's full-page overlay and spinners shown on a backdrop
+    "afirme": [".ngx-spinner-overlay", ".cdk-overlay-backdrop.loading", "mat-spinner", "mat-progress-spinner"],
+    # jQuery BlockUI and its ExtJS-style mask
+    "qualitas": [".blockUI.blockOverlay", ".blockUI.blockMsg", ".loading-mask"],
+}
+# Share of the viewport a match must cover to count as an overlay (unless it is under the centre)
+OVERLAY_COVERAGE = 0.5
+
+IDLE_WAITS = REGISTRY.counter("idle_waits_total", "Steps held back while the page was loading", ["insurer"])
+IDLE_SECONDS = REGISTRY.counter("idle_wait_seconds_total", "Seconds spent waiting locally instead of calling the model",
+                                ["insurer"])
+
+PROBE_JS = r"""(selectors, coverage) => {
+  const vw = window.innerWidth, vh = window.innerHeight;
+  const centre = document.elementFromPoint(vw / 2, vh / 2);
+  const blocking = el => {
+    const style = getComputedStyle(el);
+    if (style.display === "none" || style.visibility === "hidden" || Number(style.opacity) === 0) return false;
+    const r = el.getBoundingClientRect();
+    const w = Math.max(0, Math.min(r.right, vw) - Math.max(r.left, 0));
+    const h = Math.max(0, Math.min(r.bottom, vh) - Math.max(r.top, 0));
+    if (!w || !h) return false;
+    return w * h >= coverage * vw * vh || (!!centre && el.contains(centre));
+  };
+  const spinner = selectors.find(s => Array.from(document.querySelectorAll(s)).some(blocking)) || null;
+  const text = document.body ? document.body.innerText : "";
+  let hash = 5381;
+  for (let i = 0; i < text.length; i++) hash = ((hash << 5) + hash + text.charCodeAt(i)) | 0;
+  return {
+    digest: hash + ":" + document.getElementsByTagName("*").length,
+    spinner,
+    ready: document.readyState,
+    resources: performance.getEntriesByType("resource").length,
+  };
+}"""
+
+
+class IdleWaiter:
+    """Per-agent hooks that hold a step until the page stops loading"""
+
+    def __init__(self, insurer: str, cap: float = IDLE_WAIT_CAP):
+        self.insurer = insurer
+        self.cap = cap
+        self.selectors = SPINNER_SIGNATURES.get(insurer, [])
+        self._last_digest: Optional[str] = None
+
+    async def probe(self, page) -> Optional[dict]:
+        try:
+            return json.loads(await page.evaluate(PROBE_JS, self.selectors, OVERLAY_COVERAGE) or "null")
+        except Exception:
+            # Mid-navigation the context can vanish; let the agent step handle it
+            return None
+
+    def _loading(self, state: dict, network_busy: bool) -> bool:
+        if state["spinner"] or state["ready"] != "complete":
+            return True
+        return state["digest"] == self._last_digest and network_busy
+
+    async def wait_until_idle(self, browser) -> float:
+        """Block while the page is loading; returns seconds waited (0 if it wasn't)"""
+        page = await browser.get_current_page()
+        if page is None:
+            return 0.0
+        started = time.monotonic()
+        # Quiet until a request is seen finishing, so an idle page costs no wait at all
+        last_activity = started - NETWORK_QUIET
+        state = await self.probe(page)
+        if state is None:
+            return 0.0
+        resources = state["resources"]
+        waited = False
+        if state["digest"] == self._last_digest and not self._loading(state, False):
+            # The last action hasn't changed the page yet: look once for requests still finishing
+            await asyncio.sleep(IDLE_POLL_INTERVAL)
+            state = await self.probe(page)
+            if state is None:
+                return 0.0
+            if state["resources"] != resources:
+                resources, last_activity, waited = state["resources"], time.monotonic(), True
+        while self._loading(state, time.monotonic() - last_activity < NETWORK_QUIET):
+            if time.monotonic() - started >= self.cap:
+                break
+            waited = True
+            await asyncio.sleep(IDLE_POLL_INTERVAL)
+            state = await self.probe(page)
+            if state is None:
+                break
+            if state["resources"] != resources:
+                resources, last_activity = state["resources"], time.monotonic()
+        elapsed = time.monotonic() - started
+        if waited:
+            IDLE_WAITS.inc(insurer=self.insurer)
+            IDLE_SECONDS.inc(elapsed, insurer=self.insurer)
+        return elapsed if waited else 0.0
+
+    def agent_hooks(self) -> dict:
+        """on_step_start/on_step_end kwargs for Agent.run()"""
+        async def on_step_start(agent):
+            await self.wait_until_idle(agent.browser_session)
+
+        async def on_step_end(agent):
+            page = await agent.browser_session.get_current_page()
+            state = await self.probe(page) if page else None
+            self._last_digest = state["digest"] if state else None
+
+        return {"on_step_start": on_step_start, "on_step_end": on_step_end}
@@ -0,0 +1,215 @@
+"""
+Durable local job queue backed by SQLite
+
+Producers enqueue quote jobs; workers in any process lease them with a
+visibility timeout. A job whose worker dies (no heartbeat before the timeout
+runs out) becomes visible again and is redelivered, so delivery is
+at-least-once. Jobs that exhaust max_attempts stay in the table as 'dead'.
+
+cancel() drops a queued job, or flags a leased one as 'cancelling'; the
+worker holding it polls for that, stops the quote and the job ends as
+'cancelled'.
+
+Jobs whose payload has priority "interactive" are leased before batch jobs;
+a batch job older than SCHED_AGING seconds ranks with them (scheduler.py).
+
+Point QUEUE_DB at a shared file to let several hosts pull from one queue.
+"""
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from metrics import REGISTRY
+from scheduler import INTERACTIVE, SCHED_AGING
+
+
+QUEUE_DB = os.getenv("QUEUE_DB", "output/jobs.db")
+VISIBILITY_TIMEOUT = float(os.getenv("VISIBILITY_TIMEOUT", "900"))
+
+QUEUE_JOBS = REGISTRY.gauge("job_queue_jobs", "Jobs in the queue per status", ["status"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    visible_at REAL NOT NULL,
+    lease_owner TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, visible_at);
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    payload: dict
+    attempts: int
+    lease_owner: str
+
+
+class JobQueue:
+    """Every call opens its own connection, so one instance is safe to share across threads"""
+
+    def __init__(self, path: str = QUEUE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE in lease)
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def enqueue(self, payload: dict, max_attempts: int = 3, delay: float = 0) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (payload, max_attempts, visible_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False), max_attempts, now + delay, now, now),
+            )
+            return cursor.lastrowid
+
+    def lease(self, worker_id: str, visibility_timeout: float = VISIBILITY_TIMEOUT,
+              interactive_only: bool = False) -> Optional[Job]:
+        """
+        Claim the next visible job, or None if the queue is empty.
+
+        Interactive and aged batch jobs come first, oldest first within each
+        group. interactive_only leaves batch jobs for other workers (a worker
+        keeping its reserved slots free).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Leases that ran out of attempts while their worker was gone are buried here
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', updated_at = ? "
+                "WHERE status = 'leased' AND visible_at <= ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE status = 'cancelling' AND visible_at <= ?",
+                (now, now),
+            )
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM jobs "
+                "WHERE status IN ('queued', 'leased') AND visible_at <= ? "
+                "AND (? = 0 OR json_extract(payload, '$.priority') = ?) "
+                "ORDER BY CASE WHEN json_extract(payload, '$.priority') = ? OR created_at <= ? THEN 0 ELSE 1 END, id "
+                "LIMIT 1",
+                (now, interactive_only, INTERACTIVE, INTERACTIVE, now - SCHED_AGING),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, attempts = attempts + 1, "
+                "visible_at = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + visibility_timeout, now, row[0]),
+            )
+            conn.execute("COMMIT")
+            return Job(id=row[0], payload=json.loads(row[1]), attempts=row[2] + 1, lease_owner=worker_id)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job: Job, visibility_timeout: float = VISIBILITY_TIMEOUT) -> bool:
+        """Extend the lease; False means it was lost (expired and re-leased elsewhere)"""
+        return self._update_owned(job, "visible_at = ?", (time.time() + visibility_timeout,))
+
+    def complete(self, job: Job, result: dict) -> bool:
+        return self._update_owned(
+            job, "status = CASE WHEN status = 'cancelling' THEN 'cancelled' ELSE 'done' END, result = ?",
+            (json.dumps(result, default=str),),
+        )
+
+    def fail(self, job: Job, error: str, retry_delay: float = 30, retry: bool = True) -> bool:
+        """Release a job after an error; it is retried later unless out of attempts or retry is False"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN status = 'cancelling' THEN 'cancelled' "
+                "WHEN attempts >= max_attempts OR ? = 0 THEN 'dead' ELSE 'queued' END, "
+                "result = ?, visible_at = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status IN ('leased', 'cancelling')",
+                (retry, json.dumps({"error": error}), now + retry_delay, now, job.id, job.lease_owner),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, job: Job) -> bool:
+        """Hand a leased job back untouched (used when draining); does not count as an attempt"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN status = 'cancelling' THEN 'cancelled' ELSE 'queued' END, "
+                "attempts = attempts - 1, visible_at = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status IN ('leased', 'cancelling')",
+                (now, now, job.id, job.lease_owner),
+            )
+            return cursor.rowcount == 1
+
+    def _update_owned(self, job: Job, assignments: str, params: tuple) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status IN ('leased', 'cancelling')",
+                (*params, time.time(), job.id, job.lease_owner),
+            )
+            return cursor.rowcount == 1
+
+    def cancel(self, job_id: int) -> Optional[str]:
+        """
+        Cancel a job.
+
+        Returns:
+            the job's new status ('cancelled' or 'cancelling'), or None if it
+            was already finished or doesn't exist
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN status = 'leased' THEN 'cancelling' ELSE 'cancelled' END, "
+                "updated_at = ? WHERE id = ? AND status IN ('queued', 'leased') RETURNING status",
+                (now, job_id),
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def status(self, job_id: int) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def depth(self) -> dict:
+        """Job counts per status"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def record_depth(self):
+        """Metrics collector: refresh job_queue_jobs from the table"""
+        for status, count in self.depth().items():
+            QUEUE_JOBS.set(count, status=status)
@@ -0,0 +1,198 @@
+"""
+Hedged model requests to cut tail latency
+
+One slow completion stalls the whole agent step while the insurer session
+idles toward its timeout. HedgedChatModel wraps a primary and a secondary
+chat model (usually another provider). If the primary has not answered
+within its recent p90 latency, the same messages go to the secondary. The
+first valid response wins and the other request is cancelled.
+
+Hedging is opt-in (LLM_HEDGE=1, applied by quote_agent.build_llm). Extra
+spend is capped: at most LLM_HEDGE_MAX_RATIO of a model's recent calls may
+fire a hedge, and hedges take from the secondary provider's SCHEDULER
+budget like any other request. Hedge rate and estimated seconds saved go
+to metrics; stats() summarizes them per primary model.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from metrics import REGISTRY
+from scheduler import SCHEDULER
+
+
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))
+# Hedge delay bounds, and the delay used until a model has enough samples
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "20"))
+HEDGE_MIN_SAMPLES = 10
+# Share of recent calls allowed to hedge (the cap on extra spend)
+HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+HEDGE_WINDOW = 100
+
+CALLS = REGISTRY.counter("llm_hedge_calls_total", "Model calls through a hedged model", ["primary"])
+HEDGES = REGISTRY.counter("llm_hedges_total", "Hedge requests fired, by which response won",
+                          ["primary", "secondary", "winner"])
+HEDGES_CAPPED = REGISTRY.counter("llm_hedges_capped_total", "Hedges not fired because of the spend cap", ["primary"])
+SAVED = REGISTRY.counter("llm_hedge_saved_seconds_total", "Estimated seconds saved by hedges the secondary won",
+                         ["primary"])
+LATENCY = REGISTRY.histogram("llm_request_seconds", "Model response time", ["model"],
+                             buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120))
+
+
+class LatencyTracker:
+    """Recent response times per model"""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._samples: Dict[str, Deque[float]] = {}
+        # Only calls that actually finished; cancelled ones are lower bounds
+        self._completed: Dict[str, Deque[float]] = {}
+        self.window = window
+
+    def record(self, model: str, seconds: float, completed: bool = True):
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+        if completed:
+            self._completed.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, model: str, q: float) -> Optional[float]:
+        samples = sorted(self._samples.get(model, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def tail_mean(self, model: str, above: float) -> Optional[float]:
+        """Mean of recent completed calls slower than `above`"""
+        tail = [s for s in self._completed.get(model, ()) if s > above]
+        return sum(tail) / len(tail) if tail else None
+
+
+LATENCIES = LatencyTracker()
+
+
+class HedgedChatModel:
+    """
+    Chat model (browser_use BaseChatModel protocol) that races a secondary
+    when the primary is slower than its recent p90.
+
+    provider and model_name are the primary's, so the scheduler's step budget
+    and per-phase metrics see the model that normally answers. model is the
+    one that produced the latest response: browser_use books a response's
+    token usage under llm.model right after it returns, so a secondary win is
+    charged to the secondary.
+    """
+
+    _verified_api_keys = False
+
+    def __init__(self, primary, secondary, quantile: float = HEDGE_QUANTILE,
+                 max_ratio: float = HEDGE_MAX_RATIO, latencies: LatencyTracker = LATENCIES):
+        self.primary = primary
+        self.secondary = secondary
+        self._answered_by = primary
+        self.quantile = quantile
+        self.max_ratio = max_ratio
+        self.latencies = latencies
+        # Whether each recent call fired a hedge
+        self._recent: Deque[bool] = deque(maxlen=HEDGE_WINDOW)
+
+    @property
+    def provider(self) -> str:
+        return self.primary.provider
+
+    @property
+    def name(self) -> str:
+        return self.primary.name
+
+    @property
+    def model(self) -> str:
+        return self._answered_by.model
+
+    @property
+    def model_name(self) -> str:
+        return self.primary.model
+
+    def hedge_delay(self) -> float:
+        delay = self.latencies.quantile(self.primary.model, self.quantile)
+        return HEDGE_DEFAULT_DELAY if delay is None else max(delay, HEDGE_MIN_DELAY)
+
+    def _may_hedge(self) -> bool:
+        return sum(self._recent) + 1 <= self.max_ratio * (len(self._recent) + 1)
+
+    async def _invoke(self, llm, messages, output_format, kwargs, hedge: bool):
+        if hedge:
+            # The agent's step hook only took the primary's budget
+            await SCHEDULER.llm_request(llm.provider)
+        started = time.monotonic()
+        response = await llm.ainvoke(messages, output_format, **kwargs)
+        if response.completion is None:
+            raise ValueError(f"{llm.model} returned no completion")
+        elapsed = time.monotonic() - started
+        if not hedge:
+            # Hedges only fire when the primary is slow, often under load: keep them out of the delay estimate
+            self.latencies.record(llm.model, elapsed)
+        LATENCY.observe(elapsed, model=llm.model)
+        return response
+
+    async def ainvoke(self, messages, output_format=None, **kwargs):
+        CALLS.inc(primary=self.primary.model)
+        started = time.monotonic()
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._invoke(self.primary, messages, output_format, kwargs, hedge=False))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._may_hedge():
+                if not done:
+                    HEDGES_CAPPED.inc(primary=self.primary.model)
+                self._recent.append(False)
+                response = await primary
+                self._answered_by = self.primary
+                return response
+
+            self._recent.append(True)
+            hedge = asyncio.ensure_future(self._invoke(self.secondary, messages, output_format, kwargs, hedge=True))
+            tasks.add(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is None:
+                    continue
+                elapsed = time.monotonic() - started
+                if winner is hedge:
+                    # The primary never answered; count it at least this slow
+                    self.latencies.record(self.primary.model, elapsed, completed=False)
+                    tail = self.latencies.tail_mean(self.primary.model, delay)
+                    SAVED.inc(max(0.0, (tail or elapsed) - elapsed), primary=self.primary.model)
+                HEDGES.inc(primary=self.primary.model, secondary=self.secondary.model,
+                           winner="secondary" if winner is hedge else "primary")
+                self._answered_by = self.secondary if winner is hedge else self.primary
+                return winner.result()
+            # Both failed: surface the primary's error, which retry policies classify
+            HEDGES.inc(primary=self.primary.model, secondary=self.secondary.model, winner="none")
+            self._answered_by = self.primary
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+def stats() -> dict:
+    """Hedge rate, win split and estimated seconds saved per primary model"""
+    calls = CALLS.samples()
+    hedges = HEDGES.samples()
+    out = {}
+    for (primary,), count in calls.items():
+        fired = {winner: n for (p, _, winner), n in hedges.items() if p == primary}
+        out[primary] = {
+            "calls": int(count),
+            "hedge_rate": sum(fired.values()) / count if count else 0.0,
+            "secondary_wins": int(fired.get("secondary", 0)),
+            "capped": int(HEDGES_CAPPED.value(primary=primary)),
+            "saved_seconds": round(SAVED.value(primary=primary), 1),
+            "p90": LATENCIES.quantile(primary, 0.9),
+        }
+    return out
@@ -0,0 +1,224 @@
+"""
+In-process metrics for the quote pipeline
+
+Labelled counters, gauges and histograms that the pipeline updates as it runs;
+snapshot() returns the current values for tests, dashboards or logging.
+Updating one is a dict write under a lock, cheap enough for every step.
+
+render() produces the Prometheus text format, and serve() exposes it at
+http://localhost:<port>/metrics from a daemon thread (app.py and worker.py
+start it when METRICS_PORT is set). Values that are cheaper to read than to
+track, like live browsers or queue depth, come from collectors that run
+only when scraped.
+"""
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labels), 0)
+
+    def samples(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def expose(self) -> List[str]:
+        """Sample lines in the Prometheus text format"""
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(self.samples().items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down (memory, active browsers, queue depth)"""
+
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        """Drop a label set (e.g. a browser that was killed)"""
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class Histogram(Counter):
+    """Distribution of observed values (latencies, waits) in cumulative buckets"""
+
+    TYPE = "histogram"
+    DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._observations: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            # [count per bucket..., +Inf count, sum]
+            row = self._observations.setdefault(key, [0] * (len(self.buckets) + 2))
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+            self._values[key] = self._values.get(key, 0) + 1
+
+    def _cumulative(self, row: List[float]) -> Tuple[List[Tuple[float, int]], float]:
+        cumulative, total = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative, row[-1]
+
+    def buckets_for(self, **labels) -> Tuple[List[Tuple[float, int]], float]:
+        """Cumulative (upper bound, count) pairs ending with +Inf, and the sum"""
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            row = list(self._observations.get(key, [0] * (len(self.buckets) + 2)))
+        return self._cumulative(row)
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            rows = {key: list(row) for key, row in self._observations.items()}
+        lines = []
+        for key, row in sorted(rows.items()):
+            cumulative, total = self._cumulative(row)
+            for bound, count in cumulative:
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative[-1][1]}")
+        return lines
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile, None without observations"""
+        cumulative, _ = self.buckets_for(**labels)
+        count = cumulative[-1][1]
+        if not count:
+            return None
+        for bound, seen in cumulative:
+            if seen >= q * count:
+                return bound
+        return cumulative[-1][0]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Counter] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, help, labels)
+        return self._metrics[name]
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        if name not in self._metrics:
+            self._metrics[name] = Gauge(name, help, labels)
+        return self._metrics[name]
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, help, labels, buckets)
+        return self._metrics[name]
+
+    def add_collector(self, collect: Callable[[], None]):
+        """Run collect() before every snapshot/render, to refresh gauges that are sampled, not tracked"""
+        self._collectors.append(collect)
+
+    def collect(self):
+        for collect in list(self._collectors):
+            try:
+                collect()
+            except Exception:
+                # A broken collector must not take the whole scrape down
+                pass
+
+    def snapshot(self) -> Dict[str, Dict[Tuple[str, ...], float]]:
+        self.collect()
+        return {name: metric.samples() for name, metric in self._metrics.items()}
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format (0.0.4)"""
+        self.collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.TYPE}")
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def serve(port: int = METRICS_PORT, registry: Registry = REGISTRY, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve registry.render() at /metrics from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    print(REGISTRY.render(), end="")
@@ -0,0 +1,533 @@
+"""
+Learned portal state graph for shortest-path recovery
+
+An agent that lands somewhere unexpected (the wrong Afirme role, a login
+page after the session expired, a Qualitas wizard step it already passed)
+spends many steps finding its way back, or the phase fails. PortalGraph
+learns each insurer's portal from the step traces of successful phases
+(trace_archive.py):
+
+- A state is a URL pattern (ids and numbers masked, query dropped, hash
+  route kept) plus a fingerprint of the page structure: the tags and labels
+  of its interactive elements, without indices, values or anything
+  containing digits.
+- An edge holds the actions that led from one state to the next. Element
+  indices are replaced by the element's tag, label and ordinal, so they
+  can be bound again on a live page. Steps that didn't change the state
+  (typing into a form) are folded into the next edge.
+- The states where a phase ended successfully are its goals.
+
+An edge is replayed only once the same actions have been seen in
+GRAPH_MIN_RUNS runs, so typed values that change per vehicle never are.
+
+At runtime recover() identifies the live page, takes the shortest known
+path to the phase goal and replays it with plain tool calls, waiting for
+each expected state (and for loads, via IdleWaiter) before the next edge.
+It stops at the first surprise. agent_hooks() triggers it when the running
+agent moves away from the goal or stays on one state for STUCK_STEPS.
+quote_agent also calls it before retrying a phase, and replays the login
+instead of re-running the navigation agent when the session expires.
+
+    python portal_graph.py build [--insurer qualitas]   # learn from every archived trace
+    python portal_graph.py show [insurer]               # states, goals and steps to each goal
+"""
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
+import unicodedata
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from metrics import REGISTRY
+from trace_archive import TRACE_DIR, TraceReader, list_runs
+
+
+GRAPH_DIR = Path(os.getenv("PORTAL_GRAPH_DIR", "output/portal_graph"))
+PORTAL_GRAPH = os.getenv("PORTAL_GRAPH", "1") == "1"
+GRAPH_MIN_RUNS = int(os.getenv("GRAPH_MIN_RUNS", "2"))
+# Live pages matching a known state this closely (Jaccard over element labels) are taken as that state
+MATCH_THRESHOLD = 0.7
+# Agent steps on one state before agent_hooks() steps in, and replays allowed per phase run
+STUCK_STEPS = 3
+MAX_RECOVERIES = 2
+# Seconds to wait for a replayed edge to reach its state
+EDGE_TIMEOUT = float(os.getenv("GRAPH_EDGE_TIMEOUT", "30"))
+STATE_ELEMENTS = 80
+LEARNED_RUNS = 2000
+
+# Actions that only read the page; dropped from edges
+READ_ONLY = {"extract", "search_page", "find_elements", "find_text", "dropdown_options", "screenshot",
+             "read_file", "write_file", "replace_file", "done"}
+# Actions replayable as recorded (no element index, no tab id)
+PORTABLE = {"navigate", "go_back", "wait", "scroll", "send_keys", "search"}
+# Interactive elements that are data rather than structure (result rows, dropdown options)
+DATA_TAGS = {"option", "mat-option", "li", "td", "tr"}
+
+_ELEMENT = re.compile(r"^(\t*)(?:\|SHADOW\(\w+\)\|)?\*?(?:\|scroll element)?\[(\d+)\]<([\w:-]+)(.*?) ?/>")
+_ATTRIBUTE = re.compile(r"(?:^| )([\w-]+)=(.*?)(?= [\w-]+=|$)")
+_LABEL_ATTRIBUTES = ("aria-label", "placeholder", "name", "title", "alt")
+_MASKED_SEGMENT = re.compile(r"^(\d+|[0-9a-f]{8,}|[0-9a-f-]{36})$", re.IGNORECASE)
+
+RECOVERIES = REGISTRY.counter("graph_recoveries_total", "State graph replays by outcome", ["insurer", "phase", "outcome"])
+REPLAYED = REGISTRY.counter("graph_replayed_actions_total", "Actions replayed from the state graph", ["insurer", "phase"])
+
+
+def url_pattern(url: str) -> str:
+    """scheme://host/path#route with ids masked; the query is dropped"""
+    if not url or "://" not in url:
+        return url or ""
+    parts = urlsplit(url)
+    mask = lambda path: "/".join("*" if _MASKED_SEGMENT.match(s) else s for s in path.split("/"))
+    pattern = f"{parts.scheme}://{parts.netloc}{mask(parts.path)}"
+    route = parts.fragment.split("?")[0]
+    return f"{pattern}#{mask(route)}" if route else pattern
+
+
+def _norm(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())[:40]
+
+
+def _label(attributes: Dict[str, str], text: str) -> str:
+    """The element's most stable name; candidates with digits are generated ids or data"""
+    candidates = [attributes.get(key, "") for key in _LABEL_ATTRIBUTES] + [text, attributes.get("id", "")]
+    for candidate in candidates:
+        candidate = _norm(candidate)
+        if candidate and not any(c.isdigit() for c in candidate):
+            return candidate
+    return ""
+
+
+def parse_elements(dom: str) -> Dict[int, Tuple[str, str, int]]:
+    """index -> (tag, label, ordinal among elements with the same tag and label) from a serialized DOM"""
+    elements = {}
+    seen: Dict[Tuple[str, str], int] = {}
+    lines = (dom or "").splitlines()
+    for n, line in enumerate(lines):
+        match = _ELEMENT.match(line)
+        if not match:
+            continue
+        depth, index, tag, attribute_text = match.groups()
+        attributes = dict(_ATTRIBUTE.findall(attribute_text.strip()))
+        text = ""
+        if n + 1 < len(lines):
+            following = lines[n + 1]
+            stripped = following.lstrip("\t")
+            if len(following) - len(stripped) > len(depth) and not stripped.startswith(("[", "*[", "<", "|")):
+                text = stripped
+        key = (tag.lower(), _label(attributes, text))
+        elements[int(index)] = (*key, seen.get(key, 0))
+        seen[key] = seen.get(key, 0) + 1
+    return elements
+
+
+def structure(elements: Dict[int, Tuple[str, str, int]]) -> List[str]:
+    """The labelled, non-data elements of a page: what identifies it"""
+    return sorted({f"{tag}:{label}" for tag, label, _ in elements.values() if label and tag not in DATA_TAGS})
+
+
+def state_id(pattern: str, elements: List[str]) -> str:
+    return hashlib.sha1((pattern + "\n" + "\n".join(elements)).encode()).hexdigest()[:12]
+
+
+def _jaccard(a: List[str], b: List[str]) -> float:
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def portable_actions(record: dict, next_url: str) -> Optional[List[dict]]:
+    """
+    The executed actions of a trace step, with indices bound to element
+    descriptors. None when one of them can't be replayed on another run.
+    """
+    elements = parse_elements(record.get("dom", ""))
+    portable = []
+    # Actions past the results were never executed (an error or a page change ended the step)
+    for action, result in zip(record["actions"], record.get("results") or []):
+        if result.get("error"):
+            continue
+        name, params = next(iter(action.items()))
+        if name in READ_ONLY:
+            continue
+        params = dict(params or {})
+        if name == "switch":
+            # Tab ids differ per run; the tab is found again by the URL it showed
+            portable.append({"switch": {"url": url_pattern(next_url)}})
+        elif name in PORTABLE:
+            portable.append({name: params})
+        elif "index" in params and params["index"] in elements:
+            tag, label, ordinal = elements[params.pop("index")]
+            if not label:
+                return None
+            portable.append({name: {**params, "element": [tag, label, ordinal]}})
+        else:
+            # Coordinate clicks, uploads, evaluate, unknown elements
+            return None
+    return portable
+
+
+@dataclass
+class Recovery:
+    """Outcome of one recover() call"""
+    phase: str
+    reached: bool = False
+    start: Optional[str] = None
+    end: Optional[str] = None
+    url: str = ""
+    edges: int = 0
+    actions: int = 0
+    seconds: float = 0.0
+    reason: str = ""
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class _Graph:
+    states: Dict[str, dict] = field(default_factory=dict)
+    edges: Dict[str, dict] = field(default_factory=dict)
+    goals: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    # run id -> trace records already learned (warm session traces keep growing)
+    learned: Dict[str, int] = field(default_factory=dict)
+
+
+class PortalGraph:
+    """One insurer's learned states, transitions and phase goals"""
+
+    def __init__(self, insurer: str, root: Path = GRAPH_DIR, min_runs: int = GRAPH_MIN_RUNS):
+        self.insurer = insurer
+        self.path = Path(root) / f"{insurer}.json"
+        self.min_runs = min_runs
+        self.graph = _Graph()
+        self._mtime = None
+
+    # ---- persistence ----
+
+    @contextmanager
+    def _lock(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self) -> "PortalGraph":
+        """Reload from disk if another process saved since"""
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return self
+        if mtime != self._mtime:
+            self.graph = _Graph(**json.loads(self.path.read_text()))
+            self._mtime = mtime
+        return self
+
+    def _save(self):
+        staged = self.path.with_suffix(f".tmp-{os.getpid()}")
+        staged.write_text(json.dumps(asdict(self.graph), ensure_ascii=False))
+        staged.replace(self.path)
+        self._mtime = self.path.stat().st_mtime
+
+    # ---- learning ----
+
+    def learn_trace(self, run_id: str, trace_dir: Path = TRACE_DIR) -> int:
+        """Merge the successful phases of one archived run not learned yet; returns the phases learned"""
+        reader = TraceReader(run_id, trace_dir)
+        with self._lock():
+            self.load()
+            start, end = self.graph.learned.get(run_id, 0), len(reader)
+            if start >= end:
+                return 0
+            learned = 0
+            # An edge variant counts once per run, however often the agent repeated it
+            variants_seen = set()
+            for phase, steps in _successful_phases(reader.read(n) for n in range(start, end)):
+                self._learn_phase(phase, steps, variants_seen)
+                learned += 1
+            self.graph.learned.pop(run_id, None)
+            self.graph.learned[run_id] = end
+            while len(self.graph.learned) > LEARNED_RUNS:
+                self.graph.learned.pop(next(iter(self.graph.learned)))
+            self._save()
+        return learned
+
+    def _observe(self, url: str, dom: str) -> str:
+        pattern = url_pattern(url)
+        elements = structure(parse_elements(dom))
+        sid = state_id(pattern, elements)
+        state = self.graph.states.setdefault(sid, {"url": pattern, "elements": elements[:STATE_ELEMENTS], "seen": 0})
+        state["seen"] += 1
+        return sid
+
+    def _learn_phase(self, phase: str, steps: List[dict], variants_seen: set):
+        states = [self._observe(step.get("url"), step.get("dom", "")) for step in steps]
+        pending: Optional[List[dict]] = []
+        for n in range(len(steps) - 1):
+            actions = portable_actions(steps[n], steps[n + 1].get("url"))
+            pending = None if actions is None or pending is None else pending + actions
+            if states[n + 1] == states[n]:
+                continue
+            if pending:
+                edge = self.graph.edges.setdefault(f"{states[n]}>{states[n + 1]}",
+                                                   {"from": states[n], "to": states[n + 1], "variants": {}})
+                key = json.dumps(pending, sort_keys=True, ensure_ascii=False)
+                if (edge["to"], key) not in variants_seen:
+                    variants_seen.add((edge["to"], key))
+                    variant = edge["variants"].setdefault(key, {"actions": pending, "runs": 0})
+                    variant["runs"] += 1
+            pending = []
+        goals = self.graph.goals.setdefault(phase, {})
+        goals[states[-1]] = goals.get(states[-1], 0) + 1
+
+    # ---- queries ----
+
+    def identify(self, url: str, dom: str) -> Optional[str]:
+        """The known state a page is in: exact structure match, else the closest on the same URL pattern"""
+        pattern = url_pattern(url)
+        elements = structure(parse_elements(dom))
+        sid = state_id(pattern, elements)
+        if sid in self.graph.states:
+            return sid
+        scored = [(_jaccard(elements, state["elements"]), s) for s, state in self.graph.states.items()
+                  if state["url"] == pattern]
+        best = max(scored, default=(0.0, None))
+        return best[1] if best[0] >= MATCH_THRESHOLD else None
+
+    def _replayable(self, edge: dict) -> Optional[List[dict]]:
+        runs, actions = max(((v["runs"], v["actions"]) for v in edge["variants"].values()),
+                            default=(0, None), key=lambda v: v[0])
+        return actions if runs >= self.min_runs else None
+
+    def shortest_path(self, start: str, phase: str) -> Optional[List[Tuple[dict, List[dict]]]]:
+        """Fewest replayable actions from `start` to any goal of `phase`: [(edge, actions)], [] if already there"""
+        goals = self.graph.goals.get(phase, {})
+        if not goals:
+            return None
+        outgoing: Dict[str, List[Tuple[dict, List[dict]]]] = {}
+        for edge in self.graph.edges.values():
+            actions = self._replayable(edge)
+            if actions:
+                outgoing.setdefault(edge["from"], []).append((edge, actions))
+        best = {start: 0}
+        queue = [(0, start, [])]
+        while queue:
+            cost, state, path = heapq.heappop(queue)
+            if state in goals:
+                return path
+            if cost > best.get(state, cost):
+                continue
+            for edge, actions in outgoing.get(state, ()):
+                next_cost = cost + len(actions)
+                if next_cost < best.get(edge["to"], float("inf")):
+                    best[edge["to"]] = next_cost
+                    heapq.heappush(queue, (next_cost, edge["to"], path + [(edge, actions)]))
+        return None
+
+    def distance(self, start: Optional[str], phase: str) -> Optional[int]:
+        path = self.shortest_path(start, phase) if start else None
+        return None if path is None else sum(len(actions) for _, actions in path)
+
+    # ---- replay ----
+
+    async def _live_state(self, browser) -> Tuple[Optional[str], object]:
+        summary = await browser.get_browser_state_summary(include_screenshot=False)
+        dom = summary.dom_state.llm_representation() if summary.dom_state else ""
+        return self.identify(summary.url, dom), summary
+
+    async def _await_state(self, browser, expected: str, waiter) -> Tuple[Optional[str], object]:
+        deadline = time.monotonic() + EDGE_TIMEOUT
+        while True:
+            await waiter.wait_until_idle(browser)
+            state, summary = await self._live_state(browser)
+            if state == expected or time.monotonic() >= deadline:
+                return state, summary
+            await asyncio.sleep(0.5)
+
+    async def recover(self, browser, phase: str) -> Recovery:
+        """Replay the shortest known path from the live page to the goal of `phase`"""
+        from browser_use import Tools
+        from idle_wait import IdleWaiter
+
+        recovery = Recovery(phase=phase)
+        started = time.monotonic()
+        self.load()
+        waiter = IdleWaiter(self.insurer)
+        try:
+            await waiter.wait_until_idle(browser)
+            state, summary = await self._live_state(browser)
+            recovery.start = recovery.end = state
+            recovery.url = summary.url
+            path = self.shortest_path(state, phase) if state else None
+            if path is None:
+                recovery.reason = "unknown state" if state is None else "no replayable path to the goal"
+                return recovery
+
+            tools = Tools()
+            action_model = tools.registry.create_action_model()
+            for edge, actions in path:
+                for action in actions:
+                    bound = _bind(action, summary)
+                    if bound is None:
+                        recovery.reason = f"element not on the page: {action}"
+                        return recovery
+                    result = await tools.act(action_model.model_validate(bound), browser_session=browser)
+                    recovery.actions += 1
+                    REPLAYED.inc(insurer=self.insurer, phase=phase)
+                    if result.error:
+                        recovery.reason = result.error
+                        return recovery
+                    # Indices shift as the page reacts; bind the next action against a fresh DOM
+                    summary = await browser.get_browser_state_summary(include_screenshot=False)
+                state, summary = await self._await_state(browser, edge["to"], waiter)
+                recovery.end, recovery.url = state, summary.url
+                if state != edge["to"]:
+                    recovery.reason = "page did not reach the expected state"
+                    return recovery
+                recovery.edges += 1
+            recovery.reached = True
+            return recovery
+        except Exception as e:
+            # A surprise mid-replay; the agent takes over from wherever the page is
+            recovery.reason = repr(e)
+            return recovery
+        finally:
+            recovery.seconds = round(time.monotonic() - started, 3)
+            outcome = "reached" if recovery.reached else "no_path" if recovery.actions == 0 else "aborted"
+            RECOVERIES.inc(insurer=self.insurer, phase=phase, outcome=outcome)
+
+    def agent_hooks(self, phase: str, on_recovery: Optional[Callable[[Recovery], None]] = None) -> dict:
+        """
+        on_step_end kwarg for Agent.run(): replay toward the phase goal when
+        the agent moves farther from it, or stays on one state for STUCK_STEPS.
+        """
+        self.load()
+        progress = {"best": None, "state": None, "repeats": 0, "recoveries": 0}
+
+        async def on_step_end(agent):
+            if progress["recoveries"] >= MAX_RECOVERIES or not agent.history.history:
+                return
+            item = agent.history.history[-1]
+            state = self.identify(item.state.url, item.state_message or "")
+            distance = self.distance(state, phase)
+            progress["repeats"] = progress["repeats"] + 1 if state and state == progress["state"] else 1
+            progress["state"] = state
+            if distance is None or distance == 0:
+                return
+            best = progress["best"]
+            if best is None or distance < best:
+                progress["best"] = distance
+            if (best is not None and distance > best) or progress["repeats"] >= STUCK_STEPS:
+                progress["recoveries"] += 1
+                progress["repeats"] = 0
+                recovery = await self.recover(agent.browser_session, phase)
+                if on_recovery:
+                    on_recovery(recovery)
+
+        return {"on_step_end": on_step_end}
+
+    def summary(self) -> dict:
+        self.load()
+        phases = {}
+        for phase, goals in self.graph.goals.items():
+            reachable = {s: self.distance(s, phase) for s in self.graph.states}
+            phases[phase] = {"goals": len(goals), "states_with_path": sum(d is not None for d in reachable.values())}
+        replayable = sum(self._replayable(e) is not None for e in self.graph.edges.values())
+        return {"insurer": self.insurer, "states": len(self.graph.states), "edges": len(self.graph.edges),
+                "replayable_edges": replayable, "runs": len(self.graph.learned), "phases": phases}
+
+
+def _bind(action: dict, summary) -> Optional[dict]:
+    """A portable action made concrete for the live page (element index, tab id)"""
+    name, params = next(iter(action.items()))
+    params = dict(params)
+    if name == "switch":
+        tabs = summary.tabs or []
+        tab = next((t for t in reversed(tabs) if url_pattern(t.url) == params["url"]), tabs[-1] if tabs else None)
+        return {"switch": {"tab_id": tab.target_id[-4:]}} if tab else None
+    if "element" in params:
+        want = tuple(params.pop("element"))
+        elements = parse_elements(summary.dom_state.llm_representation() if summary.dom_state else "")
+        index = next((i for i, element in elements.items() if element == want), None)
+        if index is None:
+            return None
+        params["index"] = index
+    return {name: params}
+
+
+def _successful_phases(records) -> Iterator[Tuple[str, List[dict]]]:
+    """(phase, step records) for every phase run that finished done and wasn't classified as a failure"""
+    steps: List[dict] = []
+    finished: Optional[Tuple[str, List[dict]]] = None
+    for record in records:
+        if not record.get("note"):
+            if finished:
+                yield finished
+                finished = None
+            steps.append(record)
+            continue
+        if record.get("failure"):
+            # Right after a phase_end it means that phase didn't count; otherwise a phase raised mid-run
+            if finished and finished[0] != record.get("phase"):
+                yield finished
+            finished, steps = None, []
+            continue
+        if finished:
+            yield finished
+            finished = None
+        if record.get("recovery"):
+            # The replayed actions aren't agent steps; learn only from what follows
+            steps = []
+        if "steps" in record and record.get("phase"):
+            if record.get("done") and steps:
+                finished = (record["phase"], steps)
+            steps = []
+    if finished:
+        yield finished
+
+
+def _trace_insurer(run_id: str, trace_dir: Path = TRACE_DIR) -> Optional[str]:
+    reader = TraceReader(run_id, trace_dir)
+    first = reader.read(0) if len(reader) else {}
+    # Runs archived before traces recorded their insurer all came from quote_agent
+    return first.get("insurer", "qualitas") if first.get("note") else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Learned portal state graphs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="learn from every archived trace")
+    build.add_argument("--insurer", help="default: every insurer found in the traces")
+    show = subparsers.add_parser("show", help="graph summary per insurer")
+    show.add_argument("insurer", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        learned: Dict[str, int] = {}
+        for path in list_runs():
+            insurer = _trace_insurer(path.stem)
+            if insurer and (args.insurer is None or insurer == args.insurer):
+                learned[insurer] = learned.get(insurer, 0) + PortalGraph(insurer).learn_trace(path.stem)
+        for insurer, phases in sorted(learned.items()):
+            print(f"🗺️  {insurer}: learned {phases} successful phase runs")
+            print(json.dumps(PortalGraph(insurer).summary(), indent=2))
+    elif args.command == "show":
+        insurers = [args.insurer] if args.insurer else sorted(p.stem for p in GRAPH_DIR.glob("*.json"))
+        for insurer in insurers:
+            graph = PortalGraph(insurer).load()
+            print(json.dumps(graph.summary(), indent=2))
+            for sid, state in sorted(graph.graph.states.items(), key=lambda s: -s[1]["seen"]):
+                steps = {phase: graph.distance(sid, phase) for phase in graph.graph.goals}
+                print(f"  {sid} seen {state['seen']:>4}  {state['url']}  actions to goal: {steps}")
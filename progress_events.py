@@ -0,0 +1,213 @@
+"""
+Structured progress events for quote runs
+
+run_quote emits phase start/end, every agent step (actions, duration, token
+usage), waits and PDF capture on an EventStream. Consumers either iterate it
+(`async for event in EVENTS.subscribe()`), register a plain callback
+(add_listener, thread-safe), or read it as server-sent events (serve_sse;
+app.py and worker.py start it from a daemon thread when SSE_PORT is set).
+
+With nobody subscribed, emit() returns before building anything, so the
+instrumented hot path costs one attribute check per call.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+
+SSE_HOST = os.getenv("SSE_HOST", "127.0.0.1")
+SSE_PORT = int(os.getenv("SSE_PORT", "0"))
+SUBSCRIBER_BUFFER = 1000
+# /events, or /events/<quote_id>
+EVENTS_PATH = re.compile(r"/events(?:/([^/]+))?")
+
+
+@dataclass
+class ProgressEvent:
+    """One entry in the stream; `data` holds the type-specific fields"""
+    type: str
+    quote_id: str
+    phase: Optional[str] = None
+    ts: float = field(default_factory=time.time)
+    data: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_sse(self) -> str:
+        return f"event: {self.type}\ndata: {json.dumps(self.to_dict(), default=str)}\n\n"
+
+
+class EventStream:
+    """Fan-out of ProgressEvents to async subscribers and sync listeners"""
+
+    def __init__(self):
+        self._queues: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._listeners: List[Callable[[ProgressEvent], None]] = []
+
+    @property
+    def active(self) -> bool:
+        return bool(self._queues or self._listeners)
+
+    def emit(self, type: str, quote_id: str, phase: Optional[str] = None, **data):
+        if not self._queues and not self._listeners:
+            return
+        event = ProgressEvent(type=type, quote_id=quote_id, phase=phase, data=data)
+        # A broken consumer must never fail the quote that emits; it is dropped instead
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception:
+                self.remove_listener(listener)
+        for entry in list(self._queues):
+            loop, q = entry
+            try:
+                loop.call_soon_threadsafe(self._offer, q, event)
+            except RuntimeError:
+                # The subscriber's loop is closed (e.g. a Streamlit rerun); it will never read again
+                self._drop(entry)
+
+    @staticmethod
+    def _offer(q: asyncio.Queue, event: ProgressEvent):
+        # Slow subscribers lose the oldest events rather than blocking the run
+        if q.full():
+            q.get_nowait()
+        q.put_nowait(event)
+
+    def add_listener(self, listener: Callable[[ProgressEvent], None]):
+        """Register a sync callback; it runs on the emitting thread, must not block, and is removed if it raises"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[ProgressEvent], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def subscribe(self, quote_id: Optional[str] = None) -> AsyncIterator[ProgressEvent]:
+        """
+        Iterate events as they are emitted.
+
+        Args:
+            quote_id: only yield events for this quote, and stop after its quote_end
+        """
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_BUFFER))
+        self._queues.append(entry)
+        try:
+            while True:
+                event = await entry[1].get()
+                if quote_id and event.quote_id != quote_id:
+                    continue
+                yield event
+                if quote_id and event.type == "quote_end":
+                    return
+        finally:
+            self._drop(entry)
+
+    def _drop(self, entry: Tuple[asyncio.AbstractEventLoop, asyncio.Queue]):
+        if entry in self._queues:
+            self._queues.remove(entry)
+
+    async def sse(self, quote_id: Optional[str] = None) -> AsyncIterator[str]:
+        """subscribe() rendered as text/event-stream chunks"""
+        async for event in self.subscribe(quote_id):
+            yield event.to_sse()
+
+    def agent_hooks(self, quote_id: str, phase: str) -> dict:
+        """on_step_start/on_step_end kwargs for Agent.run() that emit step events"""
+        step_started = {}
+
+        async def on_step_start(agent):
+            if self.active:
+                step_started["t"] = time.monotonic()
+
+        async def on_step_end(agent):
+            if not self.active:
+                return
+            started = step_started.pop("t", None)
+            self.emit(
+                "step", quote_id, phase,
+                step=agent.state.n_steps - 1,  # already advanced when on_step_end runs
+                actions=_last_actions(agent),
+                duration=round(time.monotonic() - started, 3) if started else None,
+                tokens=_last_tokens(agent),
+                url=_last_url(agent),
+            )
+
+        return {"on_step_start": on_step_start, "on_step_end": on_step_end}
+
+
+def _last_item(agent):
+    history = getattr(agent.history, "history", None)
+    return history[-1] if history else None
+
+
+def _last_actions(agent) -> list:
+    item = _last_item(agent)
+    if not item or not item.model_output:
+        return []
+    return [action.model_dump(exclude_none=True) for action in item.model_output.action]
+
+
+def _last_tokens(agent) -> Optional[dict]:
+    usage_history = getattr(getattr(agent, "token_cost_service", None), "usage_history", None)
+    if not usage_history:
+        return None
+    usage = usage_history[-1].usage
+    return {"prompt": usage.prompt_tokens, "cached": usage.prompt_cached_tokens or 0,
+            "completion": usage.completion_tokens}
+
+
+def _last_url(agent) -> Optional[str]:
+    item = _last_item(agent)
+    return item.state.url if item and item.state else None
+
+
+# Process-wide stream; events carry quote_id so one stream serves every quote
+EVENTS = EventStream()
+
+
+async def serve_sse(stream: EventStream = EVENTS, host: str = SSE_HOST, port: int = SSE_PORT):
+    """
+    Minimal HTTP server exposing the stream as server-sent events.
+
+    GET /events streams everything; GET /events/<quote_id> follows one quote
+    until it ends.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode(errors="replace").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            path = request_line[1].split("?")[0] if len(request_line) > 1 else ""
+            match = EVENTS_PATH.fullmatch(path)
+            if not match:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                return
+            quote_id = match.group(1)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n"
+            )
+            await writer.drain()
+            async for chunk in stream.sse(quote_id):
+                writer.write(chunk.encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def start_sse(port: int = SSE_PORT, stream: EventStream = EVENTS, host: str = SSE_HOST) -> threading.Thread:
+    """Run serve_sse on its own event loop in a daemon thread (emit() reaches it from any loop)"""
+    thread = threading.Thread(target=asyncio.run, args=(serve_sse(stream, host, port),), name="sse", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,64 @@
+"""
+Provider prompt caching for the phase agents
+
+Each phase prompt is split into static instructions and a small per-quote
+task. The instructions go into the agent's system message, which browser-use
+already sends as a cached block. For Anthropic it is marked with
+cache_control. OpenAI caches any identical prefix over 1024 tokens on its
+own. Vehicle data, the zip code and phase handoffs stay in the task, after
+the cached prefix, so every step of every quote reuses the same prefix.
+
+record_usage() counts prompt, cache-read and cache-write tokens per phase
+so the cache hit ratio can be reported.
+"""
+from typing import NamedTuple, Optional
+
+from metrics import REGISTRY
+
+
+PROMPT_TOKENS = REGISTRY.counter("llm_prompt_tokens_total", "Prompt tokens sent", ["insurer", "phase", "model"])
+CACHED_TOKENS = REGISTRY.counter("llm_cached_tokens_total", "Prompt tokens served from the provider cache",
+                                 ["insurer", "phase", "model"])
+CACHE_WRITE_TOKENS = REGISTRY.counter("llm_cache_write_tokens_total", "Prompt tokens written to the provider cache",
+                                      ["insurer", "phase", "model"])
+
+
+class PhasePrompt(NamedTuple):
+    instructions: str  # static, identical for every quote -> cached system prefix
+    task: str          # per-quote values, sent after the prefix
+
+    def agent_kwargs(self) -> dict:
+        return {"task": self.task, "extend_system_message": self.instructions}
+
+
+def record_usage(agent, insurer: str, phase: str) -> dict:
+    """
+    Count one agent run's token usage.
+
+    Returns:
+        dict with prompt, cached and cache_write token totals and hit_ratio
+    """
+    totals = {"prompt": 0, "cached": 0, "cache_write": 0}
+    service = getattr(agent, "token_cost_service", None)
+    for entry in getattr(service, "usage_history", None) or []:
+        usage = entry.usage
+        cached = usage.prompt_cached_tokens or 0
+        written = usage.prompt_cache_creation_tokens or 0
+        PROMPT_TOKENS.inc(usage.prompt_tokens, insurer=insurer, phase=phase, model=entry.model)
+        CACHED_TOKENS.inc(cached, insurer=insurer, phase=phase, model=entry.model)
+        CACHE_WRITE_TOKENS.inc(written, insurer=insurer, phase=phase, model=entry.model)
+        totals["prompt"] += usage.prompt_tokens
+        totals["cached"] += cached
+        totals["cache_write"] += written
+    totals["hit_ratio"] = round(totals["cached"] / totals["prompt"], 3) if totals["prompt"] else None
+    return totals
+
+
+def hit_ratio(insurer: Optional[str] = None, phase: Optional[str] = None) -> Optional[float]:
+    """Share of prompt tokens served from cache since start, optionally for one insurer/phase"""
+    def total(counter) -> float:
+        return sum(value for (i, p, _), value in counter.samples().items()
+                   if (insurer is None or i == insurer) and (phase is None or p == phase))
+
+    prompt = total(PROMPT_TOKENS)
+    return total(CACHED_TOKENS) / prompt if prompt else None
@@ -3,10 +3,38 @@ Insurance Quote Agent - Parameterized version
 """
 import asyncio
 import os
+import shutil
+import time
+import uuid
+import weakref
+from functools import lru_cache
 from typing import Callable, Optional
+import anthropic
+import openai
 from dotenv import load_dotenv
 from browser_use import Agent, Browser, ChatAnthropic, ChatOpenAI
 
+from browser_contexts import CONTEXT_HOSTS, context_pool
+from browser_governor import watch_memory
+from browser_profiles import BROWSER_PROFILES, ProfileStore
+
+from deadlines import DEADLINES, CancelScope, PhaseTimeout, run_with_deadline, scope_for
+from failures import (FAILURES, RETRIES, RETRY_POLICIES, FailureClass, PhaseFailure, QuoteCancelled, RetryAction,
+                      classify, failure_detail)
+from handoff import HANDOFF_ENABLED, PHASE_STEPS, PhaseHandoff, with_handoff
+from idle_wait import IdleWaiter
+from llm_hedge import LLM_HEDGE, HedgedChatModel
+from metrics import REGISTRY
+from portal_graph import PORTAL_GRAPH, PortalGraph, Recovery
+from progress_events import EVENTS, EventStream
+from prompt_cache import PhasePrompt, record_usage
+from quote_cache import QUOTE_CACHE, QUOTE_CACHE_INTERACTIVE_TTL, QuoteCache
+from quote_store import QuoteStore, QuoteSummary
+from scheduler import INTERACTIVE, SCHEDULER
+from single_flight import SingleFlight, flight_key
+from trace_archive import TraceWriter
+from zip_index import lookup as lookup_zip
+
 
 load_dotenv()
 
@@ -15,11 +43,61 @@ NAVIGATION_MODEL = os.getenv("NAVIGATION_MODEL", "gpt-4.1-mini")
 SELECT_MODEL = os.getenv("SELECT_MODEL", "claude-sonnet-4-5-20250929")
 COMPLETION_MODEL = os.getenv("COMPLETION_MODEL", "gpt-4.1-mini")
 
+# Used when a phase hits a provider rate limit (switches to the other provider)
+FALLBACK_OPENAI_MODEL = os.getenv("FALLBACK_OPENAI_MODEL", "gpt-4.1-mini")
+FALLBACK_ANTHROPIC_MODEL = os.getenv("FALLBACK_ANTHROPIC_MODEL", "claude-sonnet-4-5-20250929")
+
+INSURER = "qualitas"
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
+
+# Step budget per phase
+PHASE_MAX_STEPS = {"navigation": 20, "select": 15, "completion": 20}
+
+# The navigation prompt ignores the vehicle; this placeholder lets run_navigation
+# reuse build_prompts() before any vehicle is known.
+NAVIGATION_VEHICLE = {"brand": "", "model": "", "year": ""}
+
+# Identical quotes running at the same time share one automation
+QUOTE_FLIGHTS = SingleFlight(INSURER)
+
+QUOTES = REGISTRY.counter("quotes_total", "Finished quotes by outcome", ["insurer", "status", "failure"])
+QUOTE_SECONDS = REGISTRY.histogram("quote_duration_seconds", "Wall-clock time per quote", ["insurer", "status"],
+                                   buckets=(30, 60, 120, 180, 240, 300, 450, 600, 900, 1200))
+PHASE_SECONDS = REGISTRY.histogram("phase_duration_seconds", "Wall-clock time per phase agent run",
+                                   ["insurer", "phase", "model"],
+                                   buckets=(5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 480))
+BROWSERS_ACTIVE = REGISTRY.gauge("browsers_active", "Browser sessions with a live CDP connection", ["insurer"])
+
+# Every session new_browser() handed out, counted when metrics are scraped
+_browsers = weakref.WeakValueDictionary()
+# Warm HTTP cache clone per browser, removed by kill_browser (or when the session is collected)
+PROFILES = ProfileStore(INSURER)
+PORTAL = PortalGraph(INSURER)
+_profile_clones = {}
+
+REGISTRY.add_collector(
+    lambda: BROWSERS_ACTIVE.set(sum(b.is_cdp_connected for b in list(_browsers.values())), insurer=INSURER)
+)
+
+
+@lru_cache(maxsize=1)
+def quote_store() -> QuoteStore:
+    """Shared normalized quote history, opened on first use (its calls each open a connection)"""
+    return QuoteStore()
+
 
 def build_prompts(vehicle_info: dict):
-    """Build prompts with vehicle info"""
+    """
+    Build the phase prompts for a vehicle.
+
+    Returns:
+        (navigation, select, completion) PhasePrompts. The instructions are the
+        same for every quote and are sent as the cached system prefix. Only the
+        task carries vehicle data (see prompt_cache.py).
+    """
 
-    navigation_prompt = """
+    navigation_prompt = PhasePrompt(
+        instructions="""
 Navigate to the vehicle selection form on Qualitas Seguros portal.
 
 STEPS:
@@ -39,38 +117,59 @@ IMPORTANT:
 - Wait 2-3 seconds after each action
 - NEW TAB opens after Cotizar - must switch_tab
 - Use scroll if needed
-"""
+""",
+        task="Navigate to the Qualitas vehicle search box following the navigation steps in your instructions.",
+    )
+
+    # Zone resolved offline by zip_index, so the pick doesn't depend on the LLM's guess
+    zone = vehicle_info.get('zone')
+    if zone:
+        zone_line = f'"{zone}" (same colonia/municipio, ignore accents and case)'
+    else:
+        zone_line = "the one depicted in the zip code"
 
     # Extract base model name (first word/alphanumeric part of model)
     base_model = vehicle_info['model'].split()[0] if ' ' in vehicle_info['model'] else vehicle_info['model']
 
-    select_prompt = f"""
-Type "{vehicle_info['brand']} {base_model} {vehicle_info['year']}" in the vehicle search box.
+    select_prompt = PhasePrompt(
+        instructions="""
+Select the requested vehicle and zone on the Qualitas vehicle search form.
+
+Type the requested search text in the vehicle search box.
 Wait 2 seconds for the dropdown suggestions to appear.
 
-From the dropdown list, select the vehicle that BEST matches these specifications:
-- Brand: {vehicle_info['brand']}
-- Model: {vehicle_info['model']}
-- Year: {vehicle_info['year']}
-- Engine: {vehicle_info.get('engine', 'L4 2.0T')}
-- Doors: {vehicle_info.get('doors', '5 puertas')}
+From the dropdown list, select the vehicle that BEST matches the requested
+brand, model, year, engine and doors.
 
 SELECTION CRITERIA:
-- Prioritize: Year {vehicle_info['year']}, semantic matching
+- Prioritize the requested year, semantic matching
 - The exact wording may differ (e.g., "180 CP" means 180hp)
 - Focus on semantic matching, not exact string matching
 - Use click_element action to select the best match
 
 - Scroll down to see the zip code text field.
-- Add the zip code: {vehicle_info.get('zip_code', '05100')}
-- Use the click_element action to select the zone depicted in the zip code. It should be a single option in a dropdown.
+- Add the requested zip code.
+- Use the click_element action to select the requested zone. It should be a single option in a dropdown.
 
 - Use the click_element action to select the "siguiente" button.
 
 STOP after selecting the vehicle.
-"""
+""",
+        task=f"""
+Select this vehicle:
+- Search text: "{vehicle_info['brand']} {base_model} {vehicle_info['year']}"
+- Brand: {vehicle_info['brand']}
+- Model: {vehicle_info['model']}
+- Year: {vehicle_info['year']}
+- Engine: {vehicle_info.get('engine', 'L4 2.0T')}
+- Doors: {vehicle_info.get('doors', '5 puertas')}
+- Zip code: {vehicle_info.get('zip_code', '05100')}
+- Zone: {zone_line}
+""",
+    )
 
-    completion_prompt = """
+    completion_prompt = PhasePrompt(
+        instructions="""
 Complete the insurance quote form and download PDF.
 
 STEPS:
@@ -80,79 +179,460 @@ STEPS:
 4. Don't select any coverage options, use click_element to select "siguiente"
 5. Use scroll action to scroll down 2 pages to locate "imprimir" button
 6. Use click_element action to select "imprimir" - opens new tab with PDF
+7. Finish with done, reporting the total premium (prima total), the deductible
+   of each coverage and the coverage names shown in the quote summary
 
 IMPORTANT:
 - Use scroll action explicitly between each major step
 - Wait 2-3 seconds after scrolling before clicking
 - Scroll 2 pages = enough to see full form sections
-"""
+""",
+        task="Complete the quote form, print the PDF and report the quote values as described in your instructions.",
+    )
 
     return navigation_prompt, select_prompt, completion_prompt
 
 
-async def run_quote(vehicle_info: dict, progress_callback: Optional[Callable] = None):
+async def new_browser() -> Browser:
+    """Browser session that survives between phase agents (not started yet)"""
+    if CONTEXT_HOSTS:
+        # An isolated context on a shared Chromium (browser_contexts.py); no profile clone
+        browser = context_pool().browser(downloads_path=OUTPUT_DIR)
+        _browsers[id(browser)] = browser
+        return browser
+    if not BROWSER_PROFILES:
+        browser = Browser(keep_alive=True, downloads_path=OUTPUT_DIR)
+        _browsers[id(browser)] = browser
+        return browser
+    # Copying the warm cache (up to BROWSER_CACHE_MB) must not stall the loop
+    clone = await asyncio.to_thread(PROFILES.clone)
+    browser = Browser(keep_alive=True, downloads_path=OUTPUT_DIR, **PROFILES.browser_kwargs(clone))
+    _browsers[id(browser)] = browser
+    _profile_clones[id(browser)] = (clone, weakref.finalize(browser, shutil.rmtree, clone, True))
+    return browser
+
+
+async def kill_browser(browser: Browser, success: bool = False):
+    """
+    Kill a browser and drop its profile clone. After a successful quote its
+    cache may refresh the insurer's warm template (see browser_profiles.py).
+    """
+    await browser.kill()
+    entry = _profile_clones.pop(id(browser), None)
+    if entry:
+        clone, cleanup = entry
+        cleanup.detach()
+        await asyncio.to_thread(PROFILES.release, clone, success)
+
+
+async def start_browser() -> Browser:
+    browser = await new_browser()
+    try:
+        await browser.start()
+    except BaseException:
+        # Also when cancelled mid-launch: Chromium may already be running
+        await kill_browser(browser)
+        raise
+    return browser
+
+
+def merge_hooks(*hook_sets: dict) -> dict:
+    """Combine several on_step_start/on_step_end dicts into one pair of hooks"""
+    merged = {}
+    for name in ("on_step_start", "on_step_end"):
+        hooks = [hook_set[name] for hook_set in hook_sets if hook_set and name in hook_set]
+        if hooks:
+            async def run_all(agent, hooks=hooks):
+                for hook in hooks:
+                    await hook(agent)
+            merged[name] = run_all
+    return merged
+
+
+async def run_phase(quote_id: str, phase: str, agent: Agent, events: EventStream = EVENTS,
+                    trace: Optional[TraceWriter] = None, handoff: bool = False):
+    """
+    Run one phase agent with its step budget and deadline, emitting phase and step events.
+
+    Raises:
+        PhaseTimeout: the phase ran past its deadline
+        QuoteCancelled: the quote was cancelled while the agent ran
+    """
+    max_steps = PHASE_MAX_STEPS[phase]
+    deadline = DEADLINES[INSURER].for_phase(phase)
+    events.emit("phase_start", quote_id, phase, max_steps=max_steps, deadline=deadline)
+    started = time.monotonic()
+    # Idle waiting first, so a spinner never costs a model call or counts as step time
+    # then the provider budget, right before the model call
+    # then, once the step is traced, a replay toward the phase goal if the agent is lost
+    recover = PORTAL.agent_hooks(phase, lambda r: note_recovery(quote_id, r, events, trace)) if PORTAL_GRAPH else None
+    hooks = merge_hooks(IdleWaiter(INSURER).agent_hooks(), SCHEDULER.agent_hooks(),
+                        events.agent_hooks(quote_id, phase), trace.agent_hooks(phase) if trace else None, recover)
+    # Lets cancel_quote() stop this agent after its current step
+    scope = scope_for(quote_id)
+    if scope:
+        scope.agent = agent
+    try:
+        history = await run_with_deadline(agent, phase, deadline, max_steps=max_steps, **hooks)
+    finally:
+        if scope:
+            scope.agent = None
+    if scope:
+        scope.check()
+    tokens = record_usage(agent, INSURER, phase)
+    model = getattr(agent.llm, "model_name", "")
+    PHASE_SECONDS.observe(time.monotonic() - started, insurer=INSURER, phase=phase, model=model)
+    PHASE_STEPS.observe(history.number_of_steps(), insurer=INSURER, phase=phase, model=model, handoff=handoff)
+    events.emit(
+        "phase_end", quote_id, phase,
+        steps=history.number_of_steps(),
+        done=history.is_done(),
+        duration=round(time.monotonic() - started, 3),
+        tokens=tokens,
+    )
+    if trace:
+        trace.note(phase=phase, steps=history.number_of_steps(), done=history.is_done(), handoff=handoff,
+                   tokens=tokens, errors=[e for e in history.errors() if e])
+    return history
+
+
+def note_recovery(quote_id: str, recovery: Recovery, events: EventStream = EVENTS,
+                  trace: Optional[TraceWriter] = None):
+    events.emit("recovery", quote_id, recovery.phase, **recovery.to_dict())
+    if trace:
+        trace.note(recovery=recovery.to_dict())
+
+
+async def learn_portal(run_id: str):
+    """Add a finished run's successful phases to the portal graph"""
+    if not PORTAL_GRAPH:
+        return
+    try:
+        await asyncio.to_thread(PORTAL.learn_trace, run_id)
+    except Exception:
+        # A damaged trace only means one run less to learn from
+        pass
+
+
+async def wait(quote_id: str, phase: str, seconds: float, events: EventStream = EVENTS):
+    """Fixed settle time between phases, visible in the event stream"""
+    events.emit("wait", quote_id, phase, seconds=seconds)
+    await asyncio.sleep(seconds)
+
+
+# One keep-alive HTTP client per event loop and provider, shared by every chat
+# model on it. The SDK clients are otherwise rebuilt per call and reconnect
+# (TLS) every step.
+_http_clients = weakref.WeakKeyDictionary()
+
+
+def _http_client(provider: str):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    clients = _http_clients.setdefault(loop, {})
+    if provider not in clients:
+        sdk = anthropic if provider == "anthropic" else openai
+        clients[provider] = sdk.DefaultAsyncHttpxClient()
+    return clients[provider]
+
+
+def _openai(model: str) -> ChatOpenAI:
+    return ChatOpenAI(model=model, http_client=_http_client("openai"))
+
+
+def _anthropic(model: str) -> ChatAnthropic:
+    return ChatAnthropic(model=model, http_client=_http_client("anthropic"))
+
+
+def _phase_llm(phase: str, fallback: bool):
+    if phase == "select":
+        return _openai(FALLBACK_OPENAI_MODEL) if fallback else _anthropic(SELECT_MODEL)
+    model = NAVIGATION_MODEL if phase == "navigation" else COMPLETION_MODEL
+    return _anthropic(FALLBACK_ANTHROPIC_MODEL) if fallback else _openai(model)
+
+
+def build_llm(phase: str, fallback: bool = False):
+    """
+    Chat model for a phase; fallback swaps to the other provider.
+
+    With LLM_HEDGE=1 the primary is hedged against the fallback model (not
+    once already on the fallback, which means the primary is rate limited).
+    """
+    llm = _phase_llm(phase, fallback)
+    if LLM_HEDGE and not fallback:
+        return HedgedChatModel(llm, _phase_llm(phase, True))
+    return llm
+
+
+async def run_phase_with_retries(quote_id: str, phase: str, prompt: PhasePrompt, browser: Browser,
+                                 events: EventStream = EVENTS, trace: Optional[TraceWriter] = None,
+                                 handoff: Optional[PhaseHandoff] = None, **agent_kwargs):
+    """
+    Run a phase, classify any failure and apply its retry policy.
+
+    Retries stay scoped to the failed phase: the same phase is re-run (after
+    logging in again for expired sessions, or on the fallback model for rate
+    limits) instead of restarting the whole quote. Before a retry the page is
+    brought back onto the known path to the phase goal (portal_graph.py);
+    an expired session is logged in again by replaying the navigation path
+    when the graph knows it. handoff, the previous phase's summary, is
+    appended to the task so the agent doesn't re-orient.
+
+    Raises:
+        PhaseFailure: when the policy says give up or attempts are exhausted
+    """
+    attempt = 0
+    fallback = False
+    while True:
+        error = history = None
+        try:
+            # Static instructions first (cached prefix), per-quote task and handoff after
+            agent = Agent(task=with_handoff(prompt.task, handoff), extend_system_message=prompt.instructions,
+                          browser_session=browser, llm=build_llm(phase, fallback), **agent_kwargs)
+            history = await run_phase(quote_id, phase, agent, events, trace,
+                                      handoff=handoff is not None and HANDOFF_ENABLED)
+        except QuoteCancelled:
+            raise
+        except Exception as e:
+            error = e
+            if isinstance(e, PhaseTimeout) and trace:
+                await trace.snapshot(browser, "phase_timeout", phase)
+
+        failure = classify(error, history, PHASE_MAX_STEPS[phase])
+        if failure is None:
+            return history
+
+        policy = RETRY_POLICIES[failure]
+        detail = failure_detail(error, history)
+        FAILURES.inc(insurer=INSURER, phase=phase, failure=failure.value)
+        events.emit("failure", quote_id, phase, failure=failure.value, attempt=attempt,
+                    action=policy.action.value, detail=detail)
+        if trace:
+            trace.note(phase=phase, failure=failure.value, attempt=attempt, action=policy.action.value, detail=detail)
+        if policy.action == RetryAction.GIVE_UP or attempt >= policy.max_attempts:
+            raise PhaseFailure(failure, phase, detail)
+
+        RETRIES.inc(insurer=INSURER, phase=phase, failure=failure.value, action=policy.action.value)
+        await wait(quote_id, phase, policy.delay(attempt), events)
+        recovery = None
+        if PORTAL_GRAPH and policy.action in (RetryAction.RETRY_PHASE, RetryAction.RELOGIN):
+            recovery = await PORTAL.recover(browser, "navigation" if policy.action == RetryAction.RELOGIN else phase)
+            note_recovery(quote_id, recovery, events, trace)
+        if policy.action == RetryAction.RELOGIN and phase != "navigation":
+            if recovery and recovery.reached:
+                handoff = PhaseHandoff(phase="navigation", url=recovery.url,
+                                       achieved="Logged in again; the vehicle search box is open")
+            else:
+                handoff = PhaseHandoff.from_history("navigation", await run_navigation(browser, quote_id, events, trace))
+        elif policy.action == RetryAction.SWITCH_MODEL:
+            fallback = True
+        attempt += 1
+
+
+async def run_navigation(browser: Browser, quote_id: str = "warmup", events: EventStream = EVENTS,
+                         trace: Optional[TraceWriter] = None):
+    """
+    Phase 1: log in and reach the vehicle search box.
+
+    Nothing here depends on the vehicle, so it can run before the user submits
+    the form (see warm_sessions.py).
+
+    Returns:
+        the navigation agent's history, for PhaseHandoff.from_history()
+    """
+    nav_prompt, _, _ = build_prompts(NAVIGATION_VEHICLE)
+    history = await run_phase_with_retries(quote_id, "navigation", nav_prompt, browser, events, trace)
+    await wait(quote_id, "navigation", 2, events)
+    return history
+
+
+async def run_quote(vehicle_info: dict, progress_callback: Optional[Callable] = None,
+                    browser: Optional[Browser] = None, quote_id: Optional[str] = None,
+                    events: EventStream = EVENTS, keep_browser: bool = False,
+                    handoff: Optional[PhaseHandoff] = None, priority: str = INTERACTIVE, use_cache: bool = True):
     """
     Run insurance quote automation
 
     Args:
         vehicle_info: dict with keys: brand, model, year, engine (optional), doors (optional), zip_code (optional)
         progress_callback: function(phase: int, message: str) for progress updates
+        browser: optional session already parked on the vehicle search box by
+            run_navigation(). Phase 1 is skipped when given. The session is
+            killed when the quote finishes unless keep_browser is set.
+        quote_id: id carried by every event of this run (generated if omitted),
+            also the handle for deadlines.cancel_quote()
+        events: stream receiving fine-grained progress events
+        keep_browser: leave a passed-in browser open so the caller can reuse it
+            (see browser_governor.py)
+        handoff: summary of the navigation that prepared a passed-in browser
+        priority: scheduler class (scheduler.INTERACTIVE or BATCH) for the
+            browser slot and the model request budget
+        use_cache: serve a fresh off-peak precomputed result for the same
+            quote key (quote_cache.py); False always runs the portal
 
     Returns:
-        dict with status and any error messages
+        dict with status, quote_id and any error messages; errors also carry
+        the FailureClass value under "failure". A quote that joined an
+        identical one already in flight (single_flight.py) gets a copy of its
+        result with "coalesced_with" set to that quote's id. A cached result
+        has "cached_from" (the quote that produced it), "cached_at" and
+        "cache_age_s".
     """
-    def update_progress(phase: int, message: str):
+    quote_id = quote_id or uuid.uuid4().hex[:12]
+
+    # Reject unknown zips before spending any browser or LLM time
+    zone = lookup_zip(vehicle_info.get("zip_code", "05100"))
+    if zone is None:
+        message = f"Unknown zip code: {vehicle_info.get('zip_code')}"
+        if progress_callback:
+            progress_callback(-1, f"Error: {message}")
+        if browser is not None and not keep_browser:
+            await kill_browser(browser)
+        return {"status": "error", "quote_id": quote_id, "message": message}
+    vehicle_info = {**vehicle_info, "zip_code": zone.zip_code}
+    if zone.municipio:
+        vehicle_info["zone"] = zone.describe()
+
+    key = flight_key(INSURER, vehicle_info)
+    use_cache = use_cache and QUOTE_CACHE
+    max_age = QUOTE_CACHE_INTERACTIVE_TTL if priority == INTERACTIVE else None
+    cached = (await asyncio.to_thread(lambda: QuoteCache().lookup(INSURER, key, vehicle_info, max_age))
+              if use_cache else None)
+    if cached:
+        if browser is not None and not keep_browser:
+            await kill_browser(browser)
         if progress_callback:
-            progress_callback(phase, message)
+            progress_callback(4, "Quote served from cache")
+        events.emit("quote_end", quote_id, status="success", cached=True)
+        QUOTES.inc(insurer=INSURER, status="cached", failure="")
+        return {**cached, "quote_id": quote_id, "cached_from": cached["quote_id"]}
 
-    try:
-        update_progress(0, "Building prompts...")
-        nav_prompt, select_prompt, completion_prompt = build_prompts(vehicle_info)
+    if browser is not None and not keep_browser and QUOTE_FLIGHTS.leader(key):
+        # This quote will only wait for the one in flight; its session isn't needed
+        await kill_browser(browser)
+        browser = None
 
-        update_progress(0, "Starting browser...")
-        browser = Browser(keep_alive=True)
-        await browser.start()
+    async def scheduled(progress: Callable):
+        async with SCHEDULER.slot(priority, on_wait=lambda: progress(0, "Waiting for a free browser slot...")):
+            return await _run_quote(vehicle_info, progress, browser, quote_id, events, keep_browser, handoff)
 
-        try:
-            # Phase 1: Navigation (OpenAI)
-            update_progress(1, "Navigating to quote form...")
-            nav_agent = Agent(
-                task=nav_prompt,
-                browser_session=browser,
-                llm=ChatOpenAI(model=NAVIGATION_MODEL)
-            )
-            await nav_agent.run(max_steps=20)
-            await asyncio.sleep(2)
-
-            # Phase 2: Select (Claude Sonnet - type and select vehicle)
-            update_progress(2, "Selecting vehicle...")
-            select_agent = Agent(
-                task=select_prompt,
-                browser_session=browser,
-                llm=ChatAnthropic(model=SELECT_MODEL)
-            )
-            await select_agent.run(max_steps=15)
-            await asyncio.sleep(2)
-
-            # Phase 3: Complete (OpenAI)
-            update_progress(3, "Completing quote form...")
-            completion_agent = Agent(
-                task=completion_prompt,
-                browser_session=browser,
-                llm=ChatOpenAI(model=COMPLETION_MODEL)
-            )
-            await completion_agent.run(max_steps=20)
-
-            update_progress(4, "Quote completed successfully!")
-
-            # Keep browser open briefly
-            await asyncio.sleep(10)
-
-            return {"status": "success", "message": "Quote generated successfully"}
-
-        finally:
-            await browser.kill()
+    return await QUOTE_FLIGHTS.do(key, quote_id, progress_callback, scheduled)
 
-    except Exception as e:
+
+async def _run_quote(vehicle_info: dict, progress_callback: Optional[Callable], browser: Optional[Browser],
+                     quote_id: str, events: EventStream, keep_browser: bool, handoff: Optional[PhaseHandoff]):
+    """run_quote() for a validated vehicle_info, without coalescing"""
+
+    def update_progress(phase: int, message: str):
+        progress_callback(phase, message)
+
+    events.emit("quote_start", quote_id, vehicle=vehicle_info, prewarmed=browser is not None)
+    trace = TraceWriter(quote_id)
+    trace.note(insurer=INSURER, vehicle=vehicle_info, prewarmed=browser is not None)
+    # Quote deadline; cancel_quote(quote_id) stops it early
+    scope = CancelScope(quote_id, DEADLINES[INSURER].for_quote())
+    started = time.monotonic()
+
+    def finished(status: str, failure: str = ""):
+        QUOTES.inc(insurer=INSURER, status=status, failure=failure)
+        QUOTE_SECONDS.observe(time.monotonic() - started, insurer=INSURER, status=status)
+
+    def fail(e: Exception):
+        failure = classify(e)
+        finished("error", failure.value)
         update_progress(-1, f"Error: {str(e)}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        events.emit("quote_end", quote_id, status="error", error=str(e), failure=failure.value)
+        trace.note(status="error", error=str(e), failure=failure.value)
+        return {"status": "error", "quote_id": quote_id, "message": str(e), "failure": failure.value}
+
+    try:
+        with scope:
+            update_progress(0, "Building prompts...")
+            _, select_prompt, completion_prompt = build_prompts(vehicle_info)
+
+            prewarmed = browser is not None
+            succeeded = False
+            memory_watch = None
+            if not prewarmed:
+                browser = await new_browser()
+
+            try:
+                if not prewarmed:
+                    # Inside the try so a cancel during startup still kills Chromium
+                    update_progress(0, "Starting browser...")
+                    await browser.start()
+                memory_watch = asyncio.ensure_future(
+                    watch_memory(browser, lambda rss: scope.cancel(FailureClass.BROWSER_MEMORY)))
+                # A reused browser still lists the PDFs of its earlier quotes
+                downloads_before = len(getattr(browser, "downloaded_files", None) or [])
+
+                # Phase 1: Navigation (OpenAI)
+                if prewarmed:
+                    update_progress(1, "Using prepared session...")
+                else:
+                    update_progress(1, "Navigating to quote form...")
+                    handoff = PhaseHandoff.from_history("navigation", await run_navigation(browser, quote_id, events, trace))
+
+                # Phase 2: Select (Claude Sonnet - type and select vehicle)
+                update_progress(2, "Selecting vehicle...")
+                history = await run_phase_with_retries(quote_id, "select", select_prompt, browser, events, trace,
+                                                       handoff=handoff)
+                await wait(quote_id, "select", 2, events)
+
+                # Phase 3: Complete (OpenAI)
+                update_progress(3, "Completing quote form...")
+                history = await run_phase_with_retries(quote_id, "completion", completion_prompt, browser, events, trace,
+                                                       handoff=PhaseHandoff.from_history("select", history),
+                                                       output_model_schema=QuoteSummary)
+                pdf_paths = [str(path) for path in (getattr(browser, "downloaded_files", None) or [])[downloads_before:]]
+                for pdf_path in pdf_paths:
+                    events.emit("pdf", quote_id, "completion", path=pdf_path)
+
+                # Persist the normalized quote so comparisons don't need a rerun
+                summary = history.structured_output
+                await asyncio.to_thread(lambda: quote_store().add(
+                    INSURER, vehicle_info, summary, pdf_path=pdf_paths[-1] if pdf_paths else None, quote_id=quote_id))
+
+                update_progress(4, "Quote completed successfully!")
+                events.emit("quote_end", quote_id, status="success")
+                finished("success")
+                succeeded = True
+                trace.note(status="success", premium=summary.premium if summary else None, pdf=pdf_paths)
+                await learn_portal(quote_id)
+
+                if not (prewarmed and keep_browser):
+                    # Keep browser open briefly
+                    await asyncio.sleep(10)
+
+                return {
+                    "status": "success",
+                    "quote_id": quote_id,
+                    "message": "Quote generated successfully",
+                    "premium": summary.premium if summary else None,
+                }
+
+            except (asyncio.CancelledError, QuoteCancelled):
+                if scope.cancelled:
+                    await trace.snapshot(browser, scope.failure.value)
+                raise
+
+            finally:
+                if memory_watch:
+                    memory_watch.cancel()
+                if not (prewarmed and keep_browser):
+                    await kill_browser(browser, success=succeeded)
+
+    except asyncio.CancelledError:
+        if not scope.cancelled:
+            # Cancelled by our caller (e.g. worker shutdown), not by the deadline/cancel API
+            raise
+        asyncio.current_task().uncancel()
+        return fail(scope.error())
+
+    except Exception as e:
+        return fail(e)
+
+    finally:
+        trace.close()
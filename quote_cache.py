@@ -0,0 +1,302 @@
+"""
+Quote cache with off-peak pre-warming for high-demand vehicles
+
+Demand clusters around a few brand/model/year/zip combinations, and every
+one of them used to be quoted on demand at peak hours, when portals are
+slowest and provider rate limits tightest. QuoteCache keeps, per
+normalized quote key (single_flight.flight_key: insurer, vehicle, zip,
+engine, doors):
+
+- demand: a request score that halves every DEMAND_HALF_LIFE days, plus
+  request and cache hit counts;
+- the latest result CacheWarmer precomputed for it, valid for
+  QUOTE_CACHE_TTL hours.
+
+run_quote() counts demand for every quote and serves a precomputed result
+without a browser only while it is fresh: within QUOTE_CACHE_TTL for batch
+quotes and QUOTE_CACHE_INTERACTIVE_TTL for interactive ones. Quotes run on
+demand are never cached, and a served result carries its age (cached_at,
+cache_age_s) so the UI can show it. use_cache=False skips the lookup.
+CacheWarmer re-quotes the QUOTE_CACHE_TOP_N most requested keys whose
+result would expire before the next off-peak window. It does that during OFFPEAK_WINDOW (local time,
+e.g. 01:00-06:00) as batch work: at most QUOTE_CACHE_WARM_BROWSERS at
+once, at most QUOTE_CACHE_WARM_MAX quotes per window, and behind the
+scheduler's interactive reserve and provider budgets. Nothing new starts
+once the window closes.
+
+    python quote_cache.py warm [--once]      # run every night (or just this window)
+    python quote_cache.py stats              # hit rate, top keys and freshness
+    python quote_cache.py clear
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from metrics import REGISTRY
+
+
+QUOTE_CACHE = os.getenv("QUOTE_CACHE", "1") == "1"
+QUOTE_CACHE_DB = os.getenv("QUOTE_CACHE_DB", "output/quote_cache.db")
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", "24")) * 3600
+# Oldest precomputed quote an interactive (broker) request is served
+QUOTE_CACHE_INTERACTIVE_TTL = float(os.getenv("QUOTE_CACHE_INTERACTIVE_TTL", "4")) * 3600
+DEMAND_HALF_LIFE = float(os.getenv("DEMAND_HALF_LIFE", "7")) * 86400
+OFFPEAK_WINDOW = os.getenv("OFFPEAK_WINDOW", "01:00-06:00")
+TOP_N = int(os.getenv("QUOTE_CACHE_TOP_N", "20"))
+WARM_BROWSERS = int(os.getenv("QUOTE_CACHE_WARM_BROWSERS", "1"))
+# Quotes per window: the cap on model spend
+WARM_MAX_QUOTES = int(os.getenv("QUOTE_CACHE_WARM_MAX", "40"))
+
+# Fields that define a quote request; anything else (zone) is derived by run_quote
+VEHICLE_FIELDS = ("brand", "model", "year", "zip_code", "engine", "doors")
+
+LOOKUPS = REGISTRY.counter("quote_cache_lookups_total", "Quote cache lookups by outcome", ["insurer", "outcome"])
+WARMED = REGISTRY.counter("quote_cache_warmed_total", "Quotes precomputed off-peak by status", ["insurer", "status"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS demand (
+    key TEXT PRIMARY KEY,
+    insurer TEXT NOT NULL,
+    vehicle TEXT NOT NULL,
+    score REAL NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    warmed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS demand_top ON demand (insurer, score);
+"""
+
+
+def parse_window(window: str = OFFPEAK_WINDOW) -> Tuple[int, int]:
+    """'HH:MM-HH:MM' -> (start, end) in minutes after midnight; may wrap past midnight"""
+    start, end = (int(h) * 60 + int(m) for h, m in (part.strip().split(":") for part in window.split("-")))
+    return start, end
+
+
+def in_window(now: datetime, window: str = OFFPEAK_WINDOW) -> bool:
+    start, end = parse_window(window)
+    minute = now.hour * 60 + now.minute
+    return start <= minute < end if start <= end else minute >= start or minute < end
+
+
+def next_window_start(now: datetime, window: str = OFFPEAK_WINDOW) -> datetime:
+    """The next time the window opens, strictly after now"""
+    start, _ = parse_window(window)
+    opening = now.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+    return opening if opening > now else opening + timedelta(days=1)
+
+
+def window_end(now: datetime, window: str = OFFPEAK_WINDOW) -> datetime:
+    """When the window that is open at `now` closes"""
+    _, end = parse_window(window)
+    closing = now.replace(hour=end // 60, minute=end % 60, second=0, microsecond=0)
+    return closing if closing > now else closing + timedelta(days=1)
+
+
+class QuoteCache:
+    """Demand and cached results in one SQLite file; every call opens its own connection"""
+
+    def __init__(self, path: str = QUOTE_CACHE_DB, ttl: float = QUOTE_CACHE_TTL,
+                 half_life: float = DEMAND_HALF_LIFE):
+        self.path = path
+        self.ttl = ttl
+        self.half_life = half_life
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _decayed(self, score: float, last_seen: float, now: float) -> float:
+        return score * 0.5 ** ((now - last_seen) / self.half_life)
+
+    def lookup(self, insurer: str, key: str, vehicle_info: dict, max_age: Optional[float] = None) -> Optional[dict]:
+        """
+        Count a request for key and return its precomputed result if still
+        fresh, and no older than max_age seconds when given.
+        """
+        now = time.time()
+        vehicle = json.dumps({f: vehicle_info[f] for f in VEHICLE_FIELDS if vehicle_info.get(f)}, ensure_ascii=False)
+        with self._connect() as conn:
+            row = conn.execute("SELECT result, created_at, expires_at FROM results WHERE key = ? AND warmed = 1",
+                               (key,)).fetchone()
+            hit = (row is not None and row["expires_at"] > now
+                   and (max_age is None or now - row["created_at"] <= max_age))
+            demand = conn.execute("SELECT score, last_seen FROM demand WHERE key = ?", (key,)).fetchone()
+            score = (self._decayed(demand["score"], demand["last_seen"], now) if demand else 0.0) + 1
+            conn.execute(
+                "INSERT INTO demand (key, insurer, vehicle, score, requests, hits, last_seen) VALUES (?, ?, ?, ?, 1, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET vehicle = excluded.vehicle, score = excluded.score,"
+                " requests = requests + 1, hits = hits + excluded.hits, last_seen = excluded.last_seen",
+                (key, insurer, vehicle, score, int(hit), now),
+            )
+        LOOKUPS.inc(insurer=insurer, outcome="hit" if hit else "expired" if row else "miss")
+        if not hit:
+            return None
+        return {**json.loads(row["result"]), "cached_at": row["created_at"], "cache_age_s": round(now - row["created_at"])}
+
+    def store(self, key: str, result: dict, warmed: bool = False):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, result, created_at, expires_at, warmed) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(result, default=str, ensure_ascii=False), now, now + self.ttl, int(warmed)),
+            )
+
+    def due(self, insurer: str, refresh_before: float, top_n: int = TOP_N) -> List[Tuple[str, dict]]:
+        """
+        (key, vehicle_info) of the top_n most requested keys whose result is
+        missing or expires before refresh_before, most requested first.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT d.key, d.vehicle, d.score, d.last_seen, r.expires_at FROM demand d"
+                " LEFT JOIN results r ON r.key = d.key AND r.warmed = 1 WHERE d.insurer = ?", (insurer,),
+            ).fetchall()
+        ranked = sorted(rows, key=lambda r: self._decayed(r["score"], r["last_seen"], now), reverse=True)[:top_n]
+        return [(r["key"], json.loads(r["vehicle"])) for r in ranked
+                if r["expires_at"] is None or r["expires_at"] < refresh_before]
+
+    def stats(self, insurer: Optional[str] = None, top_n: int = TOP_N) -> dict:
+        """Hit rate overall and for the top keys, with each top key's freshness"""
+        now = time.time()
+        sql = ("SELECT d.*, r.created_at, r.expires_at, r.warmed FROM demand d"
+               " LEFT JOIN results r ON r.key = d.key AND r.warmed = 1"
+               + (" WHERE d.insurer = ?" if insurer else ""))
+        with self._connect() as conn:
+            rows = conn.execute(sql, (insurer,) if insurer else ()).fetchall()
+        ranked = sorted(rows, key=lambda r: self._decayed(r["score"], r["last_seen"], now), reverse=True)
+        top = ranked[:top_n]
+        rate = lambda rs: sum(r["hits"] for r in rs) / max(1, sum(r["requests"] for r in rs))
+        return {
+            "keys": len(rows),
+            "requests": sum(r["requests"] for r in rows),
+            "hit_rate": round(rate(rows), 3),
+            "top_hit_rate": round(rate(top), 3),
+            # Share of all requests that went to the top keys: the ceiling warming can reach
+            "top_share": round(sum(r["requests"] for r in top) / max(1, sum(r["requests"] for r in rows)), 3),
+            "top": [
+                {
+                    "key": r["key"],
+                    "demand": round(self._decayed(r["score"], r["last_seen"], now), 2),
+                    "requests": r["requests"],
+                    "hits": r["hits"],
+                    "fresh_for_h": round((r["expires_at"] - now) / 3600, 1) if r["expires_at"] and r["expires_at"] > now else None,
+                    "warmed": bool(r["warmed"]),
+                }
+                for r in top
+            ],
+        }
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+
+
+class CacheWarmer:
+    """Precomputes the most requested quotes during the off-peak window"""
+
+    def __init__(self, cache: Optional[QuoteCache] = None, window: str = OFFPEAK_WINDOW, top_n: int = TOP_N,
+                 browsers: int = WARM_BROWSERS, max_quotes: int = WARM_MAX_QUOTES):
+        self.cache = cache or QuoteCache()
+        self.window = window
+        self.top_n = top_n
+        self.browsers = browsers
+        self.max_quotes = max_quotes
+
+    async def run_window(self) -> dict:
+        """Warm due keys until they're done, the quote cap is hit or the window closes"""
+        # Imported lazily so `stats` doesn't pay for browser_use
+        from quote_agent import INSURER, run_quote
+        from scheduler import BATCH
+
+        closes = window_end(datetime.now(), self.window)
+        # Anything expiring before the next window would be missed at peak
+        refresh_before = next_window_start(closes, self.window).timestamp()
+        due = self.cache.due(INSURER, refresh_before, self.top_n)[:self.max_quotes]
+        gate = asyncio.Semaphore(self.browsers)
+        outcome = {"due": len(due), "warmed": 0, "failed": 0, "skipped": 0}
+
+        async def warm(key: str, vehicle_info: dict):
+            async with gate:
+                if datetime.now() >= closes:
+                    outcome["skipped"] += 1
+                    return
+                result = await run_quote(vehicle_info, quote_id=f"cache-{uuid.uuid4().hex[:8]}", priority=BATCH,
+                                         use_cache=False)
+                status = "success" if result.get("status") == "success" else "error"
+                if status == "success":
+                    await asyncio.to_thread(self.cache.store, key, result, True)
+                WARMED.inc(insurer=INSURER, status=status)
+                outcome["warmed" if status == "success" else "failed"] += 1
+
+        await asyncio.gather(*(warm(key, vehicle_info) for key, vehicle_info in due))
+        return outcome
+
+    async def serve(self, once: bool = False):
+        """Sleep until each window opens and warm during it"""
+        from browser_contexts import close_context_pool
+
+        try:
+            await self._serve(once)
+        finally:
+            await close_context_pool()
+
+    async def _serve(self, once: bool):
+        while True:
+            now = datetime.now()
+            if not in_window(now, self.window):
+                if once:
+                    print(f"💤 Outside the off-peak window ({self.window})")
+                    return
+                opens = next_window_start(now, self.window)
+                print(f"💤 Next warming window opens at {opens:%Y-%m-%d %H:%M}")
+                await asyncio.sleep((opens - now).total_seconds())
+                continue
+            print(f"🔥 Warming the top {self.top_n} quote keys until {window_end(now, self.window):%H:%M}")
+            outcome = await self.run_window()
+            print(f"✅ {outcome['warmed']} warmed, {outcome['failed']} failed, {outcome['skipped']} left for the next "
+                  f"window ({outcome['due']} were due); hit rate so far {self.cache.stats()['hit_rate']:.0%}")
+            if once:
+                return
+            # Don't rescan the same window
+            await asyncio.sleep(max(0.0, (window_end(datetime.now(), self.window) - datetime.now()).total_seconds()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quote cache and off-peak warming")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    warm = subparsers.add_parser("warm", help="precompute the most requested quotes during the off-peak window")
+    warm.add_argument("--once", action="store_true", help="warm the current window only, then exit")
+    warm.add_argument("--top", type=int, default=TOP_N)
+    warm.add_argument("--browsers", type=int, default=WARM_BROWSERS)
+    stats = subparsers.add_parser("stats", help="hit rate, top keys and freshness")
+    stats.add_argument("--insurer")
+    subparsers.add_parser("clear", help="drop every cached result (demand is kept)")
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        asyncio.run(CacheWarmer(top_n=args.top, browsers=args.browsers).serve(once=args.once))
+    elif args.command == "stats":
+        print(json.dumps(QuoteCache().stats(args.insurer), indent=2, ensure_ascii=False))
+    elif args.command == "clear":
+        QuoteCache().clear()
+        print("🧹 Cleared cached quotes")
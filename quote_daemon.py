@@ -0,0 +1,293 @@
+"""
+Resident quote daemon with a thin client
+
+Every script or cron-driven batch command pays for Python startup, the
+browser_use and LLM SDK imports (seconds), and a cold Chromium plus portal
+login before its first step. The daemon pays that once. It keeps the
+modules imported, --warm logged-in browsers ready (WarmSessionPool) and
+keep-alive model connections, and takes quotes on a Unix socket.
+
+A warm session is started at launch and again after each quote that used
+it. One left unused for WARM_IDLE_TIMEOUT is closed and not replaced until
+quotes come back, so an idle daemon doesn't pay for a navigation run every
+few minutes:
+
+    python quote_daemon.py serve [--warm 2]
+    python quote_daemon.py quote AUDI "Q3 S LINE SPORT BACK" 2020 05100 [--priority batch] [--events]
+    python quote_daemon.py status
+    python quote_daemon.py cancel <quote_id>
+
+The client imports nothing beyond the standard library and starts in
+milliseconds. It streams the quote's progress, prints the result and exits
+non-zero if the quote failed; interrupting it cancels the quote.
+
+Protocol: the client sends one JSON request line and reads JSON lines back
+("accepted" with the quote id, "progress", "event", then "result" or
+"error").
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import uuid
+from typing import Dict, Iterator
+
+
+DAEMON_SOCKET = os.getenv("QUOTE_DAEMON_SOCKET", "output/quote_daemon.sock")
+DAEMON_WARM = int(os.getenv("QUOTE_DAEMON_WARM", "1"))
+# How often warm sessions used by finished quotes are started again
+REWARM_INTERVAL = 5
+
+# Kept literal so the client doesn't import scheduler.py
+PRIORITIES = ("interactive", "batch")
+REQUIRED_FIELDS = ("brand", "model", "year")
+
+
+class QuoteDaemon:
+    """Quote requests from socket clients, run on a WarmSessionPool"""
+
+    def __init__(self, warm: int = DAEMON_WARM):
+        # The imports the client never pays for
+        from progress_events import EVENTS
+        from warm_sessions import WarmSessionPool
+
+        self.events = EVENTS
+        self.pool = WarmSessionPool(max_sessions=max(warm, 1))
+        self.warm_keys = [f"daemon-{i}" for i in range(warm)]
+        # Keys to warm on the next rewarm(); expired sessions are not rewarmed
+        self._pending = set(self.warm_keys)
+        self._next_key = 0
+        self.running: Dict[str, dict] = {}
+
+    def rewarm(self):
+        """Start sessions for the warm keys used since the last call"""
+        pending, self._pending = self._pending, set()
+        for session_key in pending:
+            self.pool.prewarm(session_key)
+
+    def _session_key(self) -> str:
+        if not self.warm_keys:
+            return f"daemon-cold-{uuid.uuid4().hex[:8]}"
+        # A key whose session is already taken makes the quote start cold
+        session_key = self.warm_keys[self._next_key % len(self.warm_keys)]
+        self._next_key += 1
+        return session_key
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline() or b"{}")
+            op = request.get("op")
+            if op == "quote":
+                await self._quote(request, reader, writer)
+            elif op == "status":
+                await _send(writer, {"type": "status", "running": self.running, **self.pool.stats()})
+            elif op == "cancel":
+                await _send(writer, {"type": "cancel", "ok": self.pool.cancel(request.get("quote_id", ""))})
+            else:
+                await _send(writer, {"type": "error", "error": f"unknown op {op!r}"})
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _quote(self, request: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        quote_id = request.get("quote_id") or uuid.uuid4().hex[:12]
+        vehicle_info = request.get("vehicle_info")
+        missing = [field for field in REQUIRED_FIELDS if not isinstance(vehicle_info, dict) or not vehicle_info.get(field)]
+        if missing:
+            await _send(writer, {"type": "error", "quote_id": quote_id,
+                                 "error": f"vehicle_info needs {', '.join(missing)}"})
+            return
+        if request.get("priority", "interactive") not in PRIORITIES:
+            await _send(writer, {"type": "error", "quote_id": quote_id,
+                                 "error": f"unknown priority {request['priority']!r}"})
+            return
+        loop = asyncio.get_running_loop()
+        out: asyncio.Queue = asyncio.Queue()
+
+        def progress(phase, message):
+            # Called on the pool thread
+            loop.call_soon_threadsafe(out.put_nowait, {"type": "progress", "phase": phase, "message": message})
+
+        async def forward_events():
+            async for event in self.events.subscribe(quote_id):
+                out.put_nowait({"type": "event", "event": event.to_dict()})
+
+        forwarder = asyncio.ensure_future(forward_events()) if request.get("events") else None
+        # Let the subscription register before the quote can emit anything
+        await asyncio.sleep(0)
+        self.running[quote_id] = vehicle_info
+        await _send(writer, {"type": "accepted", "quote_id": quote_id})
+        session_key = self._session_key()
+        result = asyncio.wrap_future(self.pool.submit(session_key, vehicle_info, progress, quote_id=quote_id,
+                                                      priority=request.get("priority", "interactive")))
+        # EOF means the client went away
+        hangup = asyncio.ensure_future(reader.read())
+        try:
+            while True:
+                getter = asyncio.ensure_future(out.get())
+                done, _ = await asyncio.wait({getter, result, hangup}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    await _send(writer, getter.result())
+                    continue
+                getter.cancel()
+                if hangup in done:
+                    self.pool.cancel(quote_id)
+                    return
+                break
+            if forwarder:
+                # quote_end was emitted before run_quote returned; let it through
+                await asyncio.wait({forwarder}, timeout=1)
+            while not out.empty():
+                await _send(writer, out.get_nowait())
+            if result.cancelled():
+                # Cancelled while it was still waiting for its warm session
+                await _send(writer, {"type": "error", "quote_id": quote_id, "error": "cancelled"})
+            elif result.exception():
+                await _send(writer, {"type": "error", "quote_id": quote_id, "error": repr(result.exception())})
+            else:
+                await _send(writer, {"type": "result", "quote_id": quote_id, "result": result.result()})
+        except ConnectionError:
+            self.pool.cancel(quote_id)
+        finally:
+            self.running.pop(quote_id, None)
+            if session_key in self.warm_keys:
+                # The session is taken by now; warm a new one for the next quote
+                self._pending.add(session_key)
+            hangup.cancel()
+            if forwarder:
+                forwarder.cancel()
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict):
+    writer.write((json.dumps(message, default=str) + "\n").encode())
+    await writer.drain()
+
+
+def _daemon_running(path: str) -> bool:
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+async def serve(path: str = DAEMON_SOCKET, warm: int = DAEMON_WARM):
+    """Run the daemon until SIGTERM/SIGINT"""
+    if os.path.exists(path):
+        if _daemon_running(path):
+            print(f"❌ A quote daemon is already listening on {path}")
+            return
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    from zip_index import ensure_index
+
+    await asyncio.to_thread(ensure_index)
+    daemon = QuoteDaemon(warm)
+    server = await asyncio.start_unix_server(daemon.handle, path)
+    os.chmod(path, 0o600)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f"🟢 Quote daemon listening on {path} ({warm} warm sessions)")
+    try:
+        while not stop.is_set():
+            daemon.rewarm()
+            try:
+                await asyncio.wait_for(stop.wait(), REWARM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        server.close()
+        for quote_id in list(daemon.running):
+            daemon.pool.cancel(quote_id)
+        await asyncio.to_thread(daemon.pool.shutdown)
+        if os.path.exists(path):
+            os.unlink(path)
+        print("👋 Quote daemon stopped")
+
+
+def request(payload: dict, path: str = DAEMON_SOCKET) -> Iterator[dict]:
+    """Send one request to the daemon and yield its replies"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        raise ConnectionError(f"no quote daemon on {path} (start it with: python quote_daemon.py serve)")
+    with client, client.makefile("r", encoding="utf-8") as replies:
+        client.sendall((json.dumps(payload) + "\n").encode())
+        for line in replies:
+            yield json.loads(line)
+
+
+def _print_quote(replies: Iterator[dict], show_events: bool) -> int:
+    for reply in replies:
+        if reply["type"] == "accepted":
+            print(f"📨 Quote {reply['quote_id']} accepted")
+        elif reply["type"] == "progress":
+            print(f"⏳ [{reply['phase']}] {reply['message']}")
+        elif reply["type"] == "event":
+            if show_events:
+                print(json.dumps(reply["event"], default=str))
+        elif reply["type"] == "result":
+            result = reply["result"]
+            print(json.dumps(result, indent=2, default=str))
+            return 0 if result.get("status") == "success" else 1
+        else:
+            print(f"❌ {reply.get('error')}")
+            return 1
+    print("❌ Daemon closed the connection before the quote finished")
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident quote daemon and client")
+    parser.add_argument("--socket", default=DAEMON_SOCKET)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="run the daemon")
+    serve_parser.add_argument("--warm", type=int, default=DAEMON_WARM, help="logged-in browsers kept ready")
+    quote = subparsers.add_parser("quote", help="run a quote on the daemon and stream its progress")
+    quote.add_argument("brand")
+    quote.add_argument("model")
+    quote.add_argument("year")
+    quote.add_argument("zip_code", nargs="?", default="05100")
+    quote.add_argument("--priority", choices=PRIORITIES, default="interactive")
+    quote.add_argument("--events", action="store_true", help="also print every structured progress event")
+    subparsers.add_parser("status", help="warm sessions, running quotes and scheduler queues")
+    cancel = subparsers.add_parser("cancel", help="cancel a running quote")
+    cancel.add_argument("quote_id")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(args.socket, args.warm))
+        sys.exit(0)
+
+    try:
+        if args.command == "quote":
+            vehicle_info = {"brand": args.brand.upper(), "model": args.model.upper(),
+                            "year": args.year, "zip_code": args.zip_code}
+            payload = {"op": "quote", "vehicle_info": vehicle_info, "priority": args.priority, "events": args.events}
+            sys.exit(_print_quote(request(payload, args.socket), args.events))
+        elif args.command == "status":
+            for reply in request({"op": "status"}, args.socket):
+                print(json.dumps(reply, indent=2, default=str))
+        elif args.command == "cancel":
+            for reply in request({"op": "cancel", "quote_id": args.quote_id}, args.socket):
+                print(f"🛑 Quote {args.quote_id} cancelled" if reply.get("ok") else f"Quote {args.quote_id} is not running")
+    except ConnectionError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    except KeyboardInterrupt:
+        # Closing the socket makes the daemon cancel the quote
+        print("🛑 Cancelled")
+        sys.exit(130)
@@ -0,0 +1,125 @@
+"""
+Quote store - normalized quote records in an indexed SQLite file
+
+Every finished automation run is saved here (insurer, vehicle key, zip,
+premium, deductibles, coverages, PDF path), so "cheapest insurer for this
+vehicle/zip" and price history are index lookups instead of browser reruns.
+"""
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+QUOTE_DB = os.getenv("QUOTE_DB", "output/quotes.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    quote_id TEXT,
+    insurer TEXT NOT NULL,
+    vehicle_key TEXT NOT NULL,
+    zip_code TEXT NOT NULL,
+    premium REAL,
+    currency TEXT DEFAULT 'MXN',
+    deductibles TEXT DEFAULT '{}',
+    coverages TEXT DEFAULT '[]',
+    pdf_path TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS quotes_latest ON quotes (vehicle_key, zip_code, insurer, created_at);
+CREATE INDEX IF NOT EXISTS quotes_cheapest ON quotes (vehicle_key, zip_code, premium);
+"""
+
+
+class QuoteSummary(BaseModel):
+    """What the final agent reads off the insurer's quote page, same shape for every insurer"""
+    premium: Optional[float] = Field(None, description="Total annual premium (prima total) as a number, no currency symbols")
+    currency: str = Field("MXN", description="Currency code of the premium")
+    deductibles: Dict[str, str] = Field(default_factory=dict, description="Deductible per coverage, e.g. {'Daños materiales': '5%'}")
+    coverages: List[str] = Field(default_factory=list, description="Names of the coverages included in the quote")
+
+
+def vehicle_key(vehicle_info: dict) -> str:
+    """Normalized BRAND|MODEL|YEAR key: upper case, no accents, single spaces"""
+    parts = []
+    for name in ("brand", "model", "year"):
+        value = unicodedata.normalize("NFKD", str(vehicle_info.get(name, "")))
+        value = "".join(c for c in value if not unicodedata.combining(c))
+        parts.append(re.sub(r"\s+", " ", value).strip().upper())
+    return "|".join(parts)
+
+
+class QuoteStore:
+    """Thin wrapper over the quotes table; every call opens its own connection"""
+
+    def __init__(self, path: str = QUOTE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add(self, insurer: str, vehicle_info: dict, summary: Optional[QuoteSummary] = None,
+            pdf_path: Optional[str] = None, quote_id: Optional[str] = None) -> int:
+        """Save one quote; returns its row id"""
+        summary = summary or QuoteSummary()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO quotes (quote_id, insurer, vehicle_key, zip_code, premium, currency,"
+                " deductibles, coverages, pdf_path, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    quote_id, insurer.lower(), vehicle_key(vehicle_info),
+                    str(vehicle_info.get("zip_code", "")), summary.premium, summary.currency,
+                    json.dumps(summary.deductibles, ensure_ascii=False),
+                    json.dumps(summary.coverages, ensure_ascii=False),
+                    pdf_path, time.time(),
+                ),
+            )
+            return cursor.lastrowid
+
+    def comparison(self, key: str, zip_code: str) -> List[dict]:
+        """Latest priced quote per insurer for this vehicle/zip, cheapest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT q.* FROM quotes q JOIN ("
+                "  SELECT insurer, MAX(created_at) AS created_at FROM quotes"
+                "  WHERE vehicle_key = ? AND zip_code = ? AND premium IS NOT NULL GROUP BY insurer"
+                ") latest USING (insurer, created_at)"
+                " WHERE q.vehicle_key = ? AND q.zip_code = ? ORDER BY q.premium",
+                (key, zip_code, key, zip_code),
+            ).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def cheapest(self, key: str, zip_code: str) -> Optional[dict]:
+        """Insurer with the lowest current premium for this vehicle/zip"""
+        rows = self.comparison(key, zip_code)
+        return rows[0] if rows else None
+
+    def price_history(self, key: str, zip_code: str, insurer: Optional[str] = None) -> List[dict]:
+        """All priced quotes for this vehicle/zip, oldest first"""
+        sql = "SELECT * FROM quotes WHERE vehicle_key = ? AND zip_code = ? AND premium IS NOT NULL"
+        params = [key, zip_code]
+        if insurer:
+            sql += " AND insurer = ?"
+            params.append(insurer.lower())
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY created_at", params).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+
+def _row_to_dict(row: sqlite3.Row) -> dict:
+    record = dict(row)
+    record["deductibles"] = json.loads(record["deductibles"] or "{}")
+    record["coverages"] = json.loads(record["coverages"] or "[]")
+    return record
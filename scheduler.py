@@ -0,0 +1,283 @@
+"""
+Priority scheduling of quotes onto browser slots and the LLM rate budget
+
+Interactive quotes (a broker waiting at app.py) and batch quotes (worker.py
+jobs from a spreadsheet) compete for the same browsers and provider limits.
+run_quote() takes a browser slot from SCHEDULER before it touches a browser.
+Every agent step takes one request from its provider's budget before it
+calls the model. Waiters for either resource share it by class weight:
+
+- Start-time fair queueing. Every grant costs its class 1 / weight of
+  virtual time, and the waiter with the earliest virtual start goes first,
+  so while both classes are queued interactive gets SCHED_INTERACTIVE_WEIGHT
+  grants for every SCHED_BATCH_WEIGHT batch ones (8:1 by default). A class
+  that was idle restarts at the current virtual time instead of banking
+  credit, and a lone class gets everything.
+- SCHED_INTERACTIVE_RESERVED slots are never handed to batch work. Quotes
+  take minutes and can't be preempted, so without a reserve a broker would
+  queue behind the whole spreadsheet.
+
+Queue waits per class go to the scheduler_wait_seconds histogram; stats()
+reports their p95.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+PRIORITY_WEIGHTS = {
+    INTERACTIVE: float(os.getenv("SCHED_INTERACTIVE_WEIGHT", "8")),
+    BATCH: float(os.getenv("SCHED_BATCH_WEIGHT", "1")),
+}
+SCHED_SLOTS = int(os.getenv("SCHED_SLOTS", "4"))
+SCHED_INTERACTIVE_RESERVED = int(os.getenv("SCHED_INTERACTIVE_RESERVED", "1"))
+# Batch jobs older than this lease with interactive ones (job_queue.py)
+SCHED_AGING = float(os.getenv("SCHED_AGING", "120"))
+
+# Model requests per minute per provider (0 = unlimited)
+LLM_RPM = {
+    "openai": int(os.getenv("OPENAI_RPM", "0")),
+    "anthropic": int(os.getenv("ANTHROPIC_RPM", "0")),
+}
+
+QUEUE_WAIT = REGISTRY.histogram("scheduler_wait_seconds", "Time spent queued for a browser slot or LLM budget",
+                                ["priority", "resource"])
+QUEUED = REGISTRY.gauge("scheduler_queued", "Waiters queued per priority class", ["priority", "resource"])
+
+# Priority of the quote running in this task; agent step hooks read it
+_priority: ContextVar[str] = ContextVar("quote_priority", default=INTERACTIVE)
+
+
+@dataclass
+class _Waiter:
+    priority: str
+    start: float  # virtual start time
+    future: asyncio.Future
+
+
+class _Gate:
+    """Waiters for one resource, shared by class weight; subclasses say what's available"""
+
+    def __init__(self, resource: str):
+        self.resource = resource
+        self.waiters: List[_Waiter] = []
+        self.vtime = 0.0
+        # Virtual finish time of each class's latest grant or waiter
+        self.finish: Dict[str, float] = {}
+
+    def _tag(self, priority: str) -> float:
+        """Virtual start for one more grant of this class"""
+        start = max(self.vtime, self.finish.get(priority, 0.0))
+        self.finish[priority] = start + 1 / PRIORITY_WEIGHTS.get(priority, 1.0)
+        return start
+
+    def _grantable(self, priority: str) -> bool:
+        raise NotImplementedError
+
+    def _take(self, priority: str):
+        raise NotImplementedError
+
+    def _stalled(self):
+        """Waiters are left that nothing can serve yet; only a release wakes them by default"""
+
+    async def acquire(self, priority: str, on_wait: Optional[Callable] = None) -> float:
+        """Wait for the resource; returns seconds queued"""
+        started = time.monotonic()
+        if not self.waiters and self._grantable(priority):
+            self.vtime = self._tag(priority)
+            self._take(priority)
+            QUEUE_WAIT.observe(0, priority=priority, resource=self.resource)
+            return 0.0
+        if on_wait:
+            on_wait()
+        waiter = _Waiter(priority, self._tag(priority), asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        QUEUED.inc(priority=priority, resource=self.resource)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we were cancelled: hand it on
+                self._give_back(priority)
+            raise
+        finally:
+            QUEUED.dec(priority=priority, resource=self.resource)
+        waited = time.monotonic() - started
+        QUEUE_WAIT.observe(waited, priority=priority, resource=self.resource)
+        return waited
+
+    def _give_back(self, priority: str):
+        pass
+
+    def _dispatch(self):
+        while self.waiters:
+            ready = [w for w in self.waiters if self._grantable(w.priority)]
+            if not ready:
+                break
+            best = min(ready, key=lambda w: w.start)
+            self.waiters.remove(best)
+            self.vtime = max(self.vtime, best.start)
+            self._take(best.priority)
+            best.future.set_result(None)
+        if self.waiters:
+            self._stalled()
+
+
+class SlotGate(_Gate):
+    """Concurrent quotes (browsers), with slots reserved for interactive work"""
+
+    def __init__(self, slots: int, reserved: int):
+        super().__init__("browser")
+        self.slots = slots
+        self.reserved = min(reserved, max(slots - 1, 0))
+        self.in_use: Dict[str, int] = {}
+
+    def _grantable(self, priority: str) -> bool:
+        busy = sum(self.in_use.values())
+        limit = self.slots if priority == INTERACTIVE else self.slots - self.reserved
+        return busy < limit
+
+    def _take(self, priority: str):
+        self.in_use[priority] = self.in_use.get(priority, 0) + 1
+
+    def release(self, priority: str):
+        self.in_use[priority] -= 1
+        self._dispatch()
+
+    _give_back = release
+
+
+class RateGate(_Gate):
+    """Token bucket of model requests per minute for one provider"""
+
+    def __init__(self, provider: str, per_minute: int):
+        super().__init__(f"llm:{provider}")
+        self.rate = per_minute / 60
+        # A minute's worth can go out in a burst at most
+        self.capacity = max(per_minute, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._refill_scheduled = False
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _grantable(self, priority: str) -> bool:
+        self._refill()
+        return self.tokens >= 1
+
+    def _take(self, priority: str):
+        self.tokens -= 1
+
+    def _stalled(self):
+        # Wake up when the next token has dripped in
+        if not self._refill_scheduled:
+            self._refill_scheduled = True
+            asyncio.get_running_loop().call_later((1 - self.tokens) / self.rate, self._refilled)
+
+    def _refilled(self):
+        self._refill_scheduled = False
+        self._dispatch()
+
+
+class QuoteScheduler:
+    """
+    Browser slots and provider budgets for every quote on an event loop.
+
+    State is kept per loop (the warm-session pool and each worker process
+    run their own); configure() sizes the slots for the current process.
+    """
+
+    def __init__(self, slots: int = SCHED_SLOTS, reserved: int = SCHED_INTERACTIVE_RESERVED,
+                 rpm: Optional[Dict[str, int]] = None):
+        self.slots = slots
+        self.reserved = reserved
+        self.rpm = dict(LLM_RPM if rpm is None else rpm)
+        self._gates: Dict[Tuple[asyncio.AbstractEventLoop, str], _Gate] = {}
+
+    def configure(self, slots: Optional[int] = None, reserved: Optional[int] = None):
+        """Resize before any quote runs (e.g. a worker with --browsers N)"""
+        if slots is not None:
+            self.slots = slots
+        if reserved is not None:
+            self.reserved = reserved
+        self._gates.clear()
+
+    def _slot_gate(self) -> SlotGate:
+        key = (asyncio.get_running_loop(), "browser")
+        if key not in self._gates:
+            self._gates[key] = SlotGate(self.slots, self.reserved)
+        return self._gates[key]
+
+    def _rate_gate(self, provider: str) -> Optional[RateGate]:
+        if not self.rpm.get(provider):
+            return None
+        key = (asyncio.get_running_loop(), f"llm:{provider}")
+        if key not in self._gates:
+            self._gates[key] = RateGate(provider, self.rpm[provider])
+        return self._gates[key]
+
+    @asynccontextmanager
+    async def slot(self, priority: str = INTERACTIVE, on_wait: Optional[Callable] = None):
+        """
+        Hold a browser slot for one quote.
+
+        Args:
+            priority: INTERACTIVE or BATCH; also applied to the quote's model calls
+            on_wait: called once if the quote has to queue (e.g. a progress message)
+        """
+        gate = self._slot_gate()
+        await gate.acquire(priority, on_wait)
+        token = _priority.set(priority)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+            gate.release(priority)
+
+    async def llm_request(self, provider: str, priority: Optional[str] = None) -> float:
+        """Take one request from the provider's budget; returns seconds waited"""
+        gate = self._rate_gate(provider)
+        if gate is None:
+            return 0.0
+        return await gate.acquire(priority or _priority.get())
+
+    def agent_hooks(self) -> dict:
+        """on_step_start kwarg for Agent.run(): wait for budget before each model call"""
+        async def on_step_start(agent):
+            await self.llm_request(agent.llm.provider)
+
+        return {"on_step_start": on_step_start}
+
+    def stats(self) -> dict:
+        """Slots in use, queue depth and p95 wait (seconds) per class"""
+        in_use: Dict[str, int] = {}
+        for gate in self._gates.values():
+            if isinstance(gate, SlotGate):
+                for priority, count in gate.in_use.items():
+                    in_use[priority] = in_use.get(priority, 0) + count
+        return {
+            priority: {
+                "running": in_use.get(priority, 0),
+                "queued": int(QUEUED.value(priority=priority, resource="browser")),
+                "p95_wait": QUEUE_WAIT.quantile(0.95, priority=priority, resource="browser"),
+            }
+            for priority in PRIORITY_WEIGHTS
+        }
+
+
+SCHEDULER = QuoteScheduler()
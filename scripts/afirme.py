@@ -5,15 +5,39 @@ Two-agent architecture for navigating and filling insurance forms
 
 import asyncio
 import os
+import sys
+import time
+from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 from browser_use import Agent, Browser, ChatOpenAI
 
+# Shared modules live at the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from browser_profiles import ProfileStore
+from deadlines import DEADLINES, CancelScope, run_with_deadline
+from failures import QuoteCancelled
+from form_fill import ONLY_OPTION, FillReport, FormField, fill_form
+from idle_wait import IdleWaiter
+from portal_graph import PORTAL_GRAPH, PortalGraph
+from prompt_cache import PhasePrompt, record_usage
+from quote_store import QuoteStore, QuoteSummary
+from trace_archive import TraceWriter
+
 load_dotenv()
 
 # Model configuration - Easy to change for testing different models
 NAVIGATION_MODEL = os.getenv("NAVIGATION_MODEL", "gpt-4.1-mini")  # Simpler model for navigation
 FORM_FILLING_MODEL = os.getenv("FORM_FILLING_MODEL", "gpt-4.1-mini")  # More powerful model for form understanding
 
+# Vehicle used in VEHICLE_AGENT_PROMPT, recorded with the stored quote
+AFIRME_VEHICLE = {
+    "brand": "General Motors",
+    "model": "Chevrolet Brew Activa",
+    "year": "2022",
+    "zip_code": "11000",
+}
+
 # Alternative model options to try:
 # OpenAI: "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "gpt-3.5-turbo"
 # Anthropic: "claude-3-opus", "claude-3-sonnet", "claude-3-haiku"
@@ -66,20 +90,12 @@ CONTEXT:
 
 YOUR TASK:
 1. Analyze the current form to understand its structure
-2. Fill the form with this vehicle information:
-   - Product Type: SP
-   - Policy Duration: Anual (Annual)
-   - Vehicle Make: General Motors
-   - Vehicle Model: Chevrolet Brew
-   - Sub-model: Activa
-   - Year: 2022
-   - Policy Type: Auto Individual
-   - Usage: Select the only available option
-   - Postal Code: 11000
-
+2. Fill the form with the vehicle information from the request
 3. Handle any dynamic behavior (waiting for dropdowns to load, auto-population)
 4. After filling all fields, click "SIGUIENTE" to proceed
 5. On the final page, click "IMPRIMIR" to generate the PDF quote
+6. Finish with done, reporting the total premium (prima total), the deductible
+   of each coverage and the coverage names shown in the quote
 
 CRITICAL RULES:
 - OBSERVE how the form behaves - some selections trigger other fields to populate
@@ -90,18 +106,113 @@ CRITICAL RULES:
 SUCCESS: PDF quote is generated and ready for download
 """
 
+# Per-quote values, kept out of the prompts above so those stay a cached prefix
+VEHICLE_DATA = """
+Fill the form with this vehicle information:
+- Product Type: SP
+- Policy Duration: Anual (Annual)
+- Vehicle Make: General Motors
+- Vehicle Model: Chevrolet Brew
+- Sub-model: Activa
+- Year: 2022
+- Policy Type: Auto Individual
+- Usage: Select the only available option
+- Postal Code: 11000
+"""
+
+# The same values as VEHICLE_DATA, in the form's dependency order, for fill_form()
+AFIRME_FIELDS = [
+    FormField("Producto", "SP"),
+    FormField("Tipo Vigencia", "Anual"),
+    FormField("Marca", "General Motors"),
+    FormField("Vehículo", "Chevrolet Brew", depends_on=("Marca",)),
+    FormField("Submarca", "Activa", depends_on=("Vehículo",)),
+    FormField("Año", "2022", depends_on=("Submarca",)),
+    FormField("Código Postal", "11000"),
+    FormField("Tipo Póliza", "Auto Individual"),
+    FormField("Uso", ONLY_OPTION, depends_on=("Tipo Póliza",)),
+]
+
+
+def phase_hooks(phase: str, trace: TraceWriter, graph: PortalGraph) -> dict:
+    """Idle waiting, the step trace the portal graph learns from, and graph recovery (e.g. from the wrong role)"""
+    idle = IdleWaiter("afirme").agent_hooks()
+    traced = trace.agent_hooks(phase)
+    recover = graph.agent_hooks(phase, lambda r: print(f"🗺️  Replayed {r.actions} known actions toward the {phase} goal: "
+                                                       f"{'reached' if r.reached else r.reason}"))
+
+    async def on_step_end(agent):
+        await idle["on_step_end"](agent)
+        await traced["on_step_end"](agent)
+        if PORTAL_GRAPH:
+            await recover["on_step_end"](agent)
+
+    return {"on_step_start": idle["on_step_start"], "on_step_end": on_step_end}
+
+
+async def run_agent(agent: Agent, phase: str, max_steps: int, scope: Optional[CancelScope], trace: TraceWriter,
+                    graph: PortalGraph):
+    """Run one phase agent within its deadline; the quote's scope can stop it after its current step"""
+    if scope:
+        scope.agent = agent
+    try:
+        result = await run_with_deadline(agent, phase, DEADLINES["afirme"].for_phase(phase), max_steps=max_steps,
+                                         **phase_hooks(phase, trace, graph))
+    finally:
+        if scope:
+            scope.agent = None
+    if scope:
+        scope.check()
+    return result
+
+
+def vehicle_task(report: FillReport) -> str:
+    """What's left for the vehicle agent after the direct fill"""
+    filled = "\n".join(f"- {label}: {value}" for label, value in report.filled.items())
+    if report.ok:
+        return f"""
+The vehicle form is already filled and verified:
+{filled}
+
+Do not change any field. Go straight to step 4: click "SIGUIENTE", then "IMPRIMIR", then report the quote values.
+"""
+    remaining = "\n".join(f"- {f.label}: {'the only available option' if f.value == ONLY_OPTION else f.value} ({report.failed[f.label]})"
+                          for f in report.remaining(AFIRME_FIELDS))
+    return f"""
+These fields are already filled and verified, do not change them:
+{filled or '- (none)'}
+
+Fill only these fields:
+{remaining}
+"""
+
+
+# Static prompts go into the system message (cached by the provider), the task stays small
+NAVIGATION_PHASE = PhasePrompt(MAIN_AGENT_PROMPT, "Reach the Afirme vehicle information form as described in your instructions.")
+VEHICLE_PHASE = PhasePrompt(VEHICLE_AGENT_PROMPT, VEHICLE_DATA)
+
 
-async def main():
+async def main(scope: Optional[CancelScope] = None):
     """
     Main function that orchestrates the two-agent flow for Afirme insurance quote
+
+    scope, when given, gets each running agent so its deadline stops the agent
+    gracefully (QuoteCancelled) instead of cancelling it mid-step.
     """
     print("🚀 Starting Afirme Insurance Quote Automation")
     print("=" * 60)
     print(f"📊 Models: Navigation={NAVIGATION_MODEL}, Form={FORM_FILLING_MODEL}")
     print("=" * 60)
 
-    # Initialize browser with keep_alive to maintain session between agents
-    browser = Browser(keep_alive=True)
+    # Initialize browser with keep_alive to maintain session between agents,
+    # on a clone of the warm Afirme cache (SPA bundle, assets, fonts)
+    profiles = ProfileStore("afirme")
+    profile = profiles.clone()
+    browser = Browser(keep_alive=True, downloads_path="output", **profiles.browser_kwargs(profile))
+    succeeded = False
+    graph = PortalGraph("afirme")
+    trace = TraceWriter(f"afirme-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    trace.note(insurer="afirme", vehicle=AFIRME_VEHICLE)
 
     try:
         # Start the browser session
@@ -114,51 +225,99 @@ async def main():
         print("Agent will: Login → Select Role → Navigate → Find Form")
 
         nav_agent = Agent(
-            task=MAIN_AGENT_PROMPT,
+            **NAVIGATION_PHASE.agent_kwargs(),
             browser_session=browser,
             llm=ChatOpenAI(model=NAVIGATION_MODEL)
         )
 
-        # Run navigation agent with sufficient steps for slow page loads
-        result = await nav_agent.run(max_steps=15)
+        # Run navigation agent with sufficient steps for slow page loads, bounded in time
+        result = await run_agent(nav_agent, "navigation", 15, scope, trace, graph)
+        print(f"🧮 Navigation prompt cache: {record_usage(nav_agent, 'afirme', 'navigation')}")
+        trace.note(phase="navigation", steps=result.number_of_steps(), done=result.is_done())
+        if not result.is_done() and PORTAL_GRAPH:
+            # Out of steps somewhere known: replay the rest of the way instead of giving up
+            recovery = await graph.recover(browser, "navigation")
+            trace.note(recovery=recovery.to_dict())
+            print(f"🗺️  Navigation recovery: {'reached the form' if recovery.reached else recovery.reason}")
 
         print("\n✅ Navigation completed - Vehicle form reached")
         print("-" * 60)
 
-        # Small delay to ensure form is fully loaded
-        await asyncio.sleep(3)
+        # Phase 2a: fill the cascading fields directly, waiting on each dependent's options
+        print("🧩 Phase 2a: Filling vehicle fields directly")
+        report = await fill_form(browser, AFIRME_FIELDS, llm=ChatOpenAI(model=FORM_FILLING_MODEL))
+        print(f"   {len(report.filled)}/{len(AFIRME_FIELDS)} fields in {report.seconds}s"
+              f"{f', LLM resolved {list(report.resolved_by_llm)}' if report.resolved_by_llm else ''}")
+        for label, reason in report.failed.items():
+            print(f"   ⚠️ {label}: {reason}")
 
-        # Phase 2: Vehicle Data Agent
-        print("📝 Phase 2: Filling Vehicle Information")
-        print("Agent will: Analyze form → Fill data → Submit → Get quote")
+        # Phase 2b: Vehicle Data Agent
+        print("📝 Phase 2b: Submitting the quote form")
+        print("Agent will: Fill anything left → Submit → Get quote")
 
         vehicle_agent = Agent(
-            task=VEHICLE_AGENT_PROMPT,
+            **PhasePrompt(VEHICLE_PHASE.instructions, vehicle_task(report)).agent_kwargs(),
             browser_session=browser,
-            llm=ChatOpenAI(model=FORM_FILLING_MODEL)
+            llm=ChatOpenAI(model=FORM_FILLING_MODEL),
+            output_model_schema=QuoteSummary
         )
 
         # Run vehicle data agent to complete the form
-        result = await vehicle_agent.run(max_steps=20)
+        result = await run_agent(vehicle_agent, "vehicle", 20, scope, trace, graph)
+        print(f"🧮 Vehicle prompt cache: {record_usage(vehicle_agent, 'afirme', 'vehicle')}")
+        trace.note(phase="vehicle", steps=result.number_of_steps(), done=result.is_done())
+
+        # Save the normalized quote next to the Qualitas ones
+        pdf_paths = browser.downloaded_files
+        await asyncio.to_thread(lambda: QuoteStore().add("afirme", AFIRME_VEHICLE, result.structured_output,
+                                                         pdf_path=pdf_paths[-1] if pdf_paths else None))
+        print(f"💾 Quote saved: {result.structured_output}")
 
         print("\n✅ Vehicle form completed - Quote generated")
         print("=" * 60)
         print("🎉 SUCCESS: Insurance quote process completed!")
+        succeeded = True
+        if PORTAL_GRAPH:
+            learned = graph.learn_trace(trace.run_id)
+            print(f"🗺️  Portal graph learned {learned} phases from this run")
 
         # Keep browser open for 10 seconds to review results
         print("\n⏰ Browser will remain open for 10 seconds...")
         await asyncio.sleep(10)
 
+    except QuoteCancelled as e:
+        trace.note(status="error", error=str(e), failure=e.failure.value)
+        raise
+
     except Exception as e:
         print(f"\n❌ Error occurred: {str(e)}")
         print("Please check the browser window for current state")
+        trace.note(status="error", error=str(e))
 
     finally:
         # Clean up browser session
+        trace.close()
         await browser.kill()
+        profiles.release(profile, publish=succeeded)
         print("\n🔒 Browser session closed")
 
 
+async def main_with_deadline():
+    """main() bounded by Afirme's quote deadline; the browser is still killed by main()'s finally"""
+    scope = CancelScope("afirme", DEADLINES["afirme"].for_quote())
+    try:
+        with scope:
+            await main(scope)
+    except QuoteCancelled as e:
+        # The running agent was stopped after its step
+        print(f"\n⏱️ Quote stopped: {e}")
+    except asyncio.CancelledError:
+        # Stopped between agents, or an agent didn't stop within the grace period
+        if not scope.cancelled:
+            raise
+        print(f"\n⏱️ Quote stopped: {scope.error()}")
+
+
 if __name__ == "__main__":
     # Run the main async function
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main_with_deadline())
\ No newline at end of file
@@ -3,9 +3,16 @@
 
 import asyncio
 import os
+import sys
+import time
+from pathlib import Path
+
 from browser_use import Agent, ChatOpenAI
 from dotenv import load_dotenv
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from history_sink import HistorySink
+
 # Load API keys from .env
 load_dotenv()
 
@@ -39,12 +46,17 @@ async def main():
         llm=ChatOpenAI(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
     )
 
-    # Run the automation
-    result = await agent.run(max_steps=100)
+    # Run the automation; steps spill to a trace so memory stays flat over 100 steps
+    sink = HistorySink(f"geico-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}", label="geico")
+    try:
+        result = await agent.run(max_steps=100, **sink.agent_hooks())
+    finally:
+        sink.close()
 
     print("-" * 50)
     print("Automation complete!")
-    print(f"Result: {result}")
+    print(f"Result: {result.final_result()}")
+    print(f"Step details: python trace_archive.py show {sink.run_id}")
 
     return result
 
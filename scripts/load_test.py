@@ -0,0 +1,449 @@
+"""
+Load test - capacity curve for the quote serving stack
+
+Simulated brokers submit quotes concurrently while concurrency ramps up level
+by level. Each level reports throughput, latency percentiles, event-loop lag,
+CPU, memory and live browsers. The table (and a JSON copy under
+output/load/) is the capacity curve to size hosts from.
+
+Nothing leaves the machine:
+- Real Chromium sessions run the real run_quote pipeline (phases, retries,
+  scheduler, idle waits, traces).
+- The agents browse a local stand-in portal. Its pages show a spinner for
+  --page-delay ms, like the insurer portals do.
+- The phase LLMs are replaced by FakeChatModel. It answers after a
+  log-normal delay (median per provider, scaled by --llm-scale) with a
+  plausible number of steps per phase, and can inject rate-limit errors.
+- Quotes, traces, downloads, browser profiles and the learned portal graph
+  go to a scratch directory; the quote cache is off.
+
+Targets:
+    --target quote   run_quote() directly on this event loop
+    --target pool    WarmSessionPool.submit(), the path the Streamlit app uses
+    --sse            each broker also follows its quote over the SSE endpoint
+
+    python scripts/load_test.py --levels 1,2,4,8 --quotes 8 --llm-scale 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+REPORT_DIR = ROOT / "output" / "load"
+
+# Keep load-test quotes, traces and downloads out of the real stores; set
+# before the shared modules read their configuration
+SCRATCH = Path(tempfile.mkdtemp(prefix="quote-load-"))
+os.environ["QUOTE_DB"] = str(SCRATCH / "quotes.db")
+os.environ["TRACE_DIR"] = str(SCRATCH / "traces")
+os.environ["OUTPUT_DIR"] = str(SCRATCH / "downloads")
+# Repeated vehicles would be served from the cache and the curve would
+# measure SQLite, and fake premiums must never reach real users
+os.environ["QUOTE_CACHE"] = "0"
+# Stand-in portal pages (127.0.0.1) must not become the insurer's portal graph
+os.environ["PORTAL_GRAPH_DIR"] = str(SCRATCH / "portal_graph")
+# ...nor its cached assets the insurer's warm browser template
+os.environ["BROWSER_PROFILE_DIR"] = str(SCRATCH / "profiles")
+
+# Shared modules live at the repo root
+sys.path.insert(0, str(ROOT))
+import psutil
+from browser_use.llm.exceptions import ModelRateLimitError
+from browser_use.llm.views import ChatInvokeCompletion, ChatInvokeUsage
+
+import quote_agent
+from browser_contexts import close_context_pool
+from browser_governor import process_tree_rss
+from metrics import REGISTRY
+from progress_events import serve_sse
+from scheduler import BATCH, INTERACTIVE, SCHEDULER
+
+# Median model latency (seconds) per provider; log-normal around it
+LLM_MEDIAN = {"openai": 2.5, "anthropic": 4.0}
+LLM_SIGMA = 0.45
+# Steps an agent takes per phase on the real portal (inclusive range)
+PHASE_STEPS = {"navigation": (5, 9), "select": (2, 5), "completion": (4, 8)}
+
+VEHICLES = [
+    ("AUDI", "Q3 S LINE SPORT BACK"), ("NISSAN", "VERSA ADVANCE"), ("VOLKSWAGEN", "JETTA COMFORTLINE"),
+    ("CHEVROLET", "AVEO LS"), ("TOYOTA", "RAV4 XLE"), ("MAZDA", "CX-5 i SPORT"), ("KIA", "RIO LX"),
+    ("HONDA", "CIVIC TOURING"),
+]
+ZIP_CODES = ["05100", "11000", "03100", "44100", "64000"]
+
+
+# --- stand-in portal ---------------------------------------------------------
+
+PAGE = """<!doctype html><html><head><title>{title}</title></head><body>
+<div class="spinner" style="position:fixed;inset:0;background:#fff">Cargando...</div>
+<h1>{title}</h1>
+<form>
+  <label for="search">Buscar vehículo</label><input id="search" name="search">
+  <label for="year">Modelo</label><select id="year"><option>2020</option><option>2021</option></select>
+  <button type="button">Siguiente</button>
+</form>
+<p id="premium">{premium}</p>
+<script>setTimeout(() => document.querySelector(".spinner").remove(), {delay});</script>
+</body></html>"""
+
+
+def start_portal(page_delay_ms: int) -> ThreadingHTTPServer:
+    """Serve /navigation, /select and /completion pages on a free local port"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            phase = self.path.strip("/").split("?")[0]
+            if phase not in PHASE_STEPS:
+                self.send_error(404)
+                return
+            premium = "Prima total: $12,345.67 MXN" if phase == "completion" else ""
+            body = PAGE.format(title=f"Portal de prueba - {phase}", premium=premium, delay=page_delay_ms).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="stand-in-portal", daemon=True).start()
+    return server
+
+
+# --- fake LLM ----------------------------------------------------------------
+
+class FakeChatModel:
+    """
+    Chat model with realistic latency that walks the stand-in portal:
+    navigate to the phase's page, wait a few steps, then finish.
+    """
+
+    _verified_api_keys = True
+
+    def __init__(self, phase: str, provider: str, portal_url: str, scale: float, error_rate: float,
+                 rng: random.Random):
+        self.phase = phase
+        self._provider = provider
+        self.model = f"fake-{provider}"
+        self.portal_url = portal_url
+        self.scale = scale
+        self.error_rate = error_rate
+        self.rng = rng
+        self.steps = rng.randint(*PHASE_STEPS[phase])
+        self.calls = 0
+
+    @property
+    def provider(self) -> str:
+        return self._provider
+
+    @property
+    def name(self) -> str:
+        return self.model
+
+    @property
+    def model_name(self) -> str:
+        return self.model
+
+    def _action(self) -> dict:
+        if self.calls == 1:
+            return {"navigate": {"url": f"{self.portal_url}/{self.phase}", "new_tab": False}}
+        if self.calls < self.steps:
+            return {"wait": {"seconds": 1}}
+        return {"done": {"success": True, "text": f"{self.phase} complete",
+                         "data": {"premium": round(self.rng.uniform(8000, 25000), 2), "currency": "MXN",
+                                  "deductibles": {"Daños materiales": "5%"}, "coverages": ["Responsabilidad civil"]}}}
+
+    def _parse(self, output_format, action: dict):
+        reply = {"thinking": None, "evaluation_previous_goal": "Success", "memory": "", "next_goal": "",
+                 "action": [action]}
+        try:
+            return output_format.model_validate(reply)
+        except Exception:
+            if "done" not in action:
+                raise
+            # Unstructured done (no output_model_schema): text and success only
+            done = {k: v for k, v in action["done"].items() if k != "data"}
+            return output_format.model_validate({**reply, "action": [{"done": done}]})
+
+    async def ainvoke(self, messages, output_format=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.scale * self.rng.lognormvariate(0, LLM_SIGMA) * LLM_MEDIAN[self._provider])
+        if self.rng.random() < self.error_rate:
+            raise ModelRateLimitError(message="simulated rate limit", model=self.model)
+        prompt = 6000 + self.rng.randint(0, 3000)
+        usage = ChatInvokeUsage(prompt_tokens=prompt, prompt_cached_tokens=int(prompt * 0.8) if self.calls > 1 else 0,
+                                prompt_cache_creation_tokens=None, prompt_image_tokens=None,
+                                completion_tokens=150, total_tokens=prompt + 150)
+        completion = "ok" if output_format is None else self._parse(output_format, self._action())
+        return ChatInvokeCompletion(completion=completion, usage=usage)
+
+
+def install_fake_llm(portal_url: str, scale: float, error_rate: float, seed: int):
+    """Route quote_agent's phase models to FakeChatModel"""
+    rng = random.Random(seed)
+
+    def build_llm(phase: str, fallback: bool = False):
+        provider = "anthropic" if (phase == "select") != fallback else "openai"
+        return FakeChatModel(phase, provider, portal_url, scale, error_rate, rng)
+
+    quote_agent.build_llm = build_llm
+
+
+# --- samplers ----------------------------------------------------------------
+
+async def sample_loop_lag(samples: list, interval: float = 0.05):
+    """How late the loop wakes a sleeping task: the delay every quote on it sees"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+class ResourceSampler(threading.Thread):
+    """CPU and RSS of this process and its children (Chromium), live browsers"""
+
+    def __init__(self, interval: float = 1.0):
+        super().__init__(name="load-sampler", daemon=True)
+        self.interval = interval
+        self.root = psutil.Process()
+        self.samples = []
+        self._processes = {}
+        self._done = threading.Event()
+
+    def _cpu(self) -> float:
+        total = 0.0
+        for process in [self.root] + self.root.children(recursive=True):
+            # cpu_percent() measures since the previous call on the same object
+            tracked = self._processes.setdefault(process.pid, process)
+            try:
+                total += tracked.cpu_percent()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                self._processes.pop(process.pid, None)
+        return total
+
+    def run(self):
+        self._cpu()
+        while not self._done.wait(self.interval):
+            REGISTRY.collect()
+            self.samples.append({
+                "cpu": self._cpu(),
+                "rss": process_tree_rss(self.root.pid),
+                "browsers": quote_agent.BROWSERS_ACTIVE.value(insurer=quote_agent.INSURER),
+            })
+
+    def stop(self) -> list:
+        self._done.set()
+        self.join()
+        return self.samples
+
+
+# --- brokers -----------------------------------------------------------------
+
+async def follow_sse(port: int, quote_id: str, stats: dict):
+    """Read the quote's event stream until it ends, like a browser tab would"""
+    started = time.monotonic()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(f"GET /events/{quote_id} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await writer.drain()
+        while line := await reader.readline():
+            if line.startswith(b"event: "):
+                stats["sse_events"] += 1
+                if stats["first_event"].get(quote_id) is None:
+                    stats["first_event"][quote_id] = time.monotonic() - started
+                if line.strip() == b"event: quote_end":
+                    break
+    finally:
+        writer.close()
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_level(submit, concurrency: int, quotes: int, args, rng: random.Random, lag_loop) -> dict:
+    """concurrency brokers share `quotes` quotes, each submitting its next one as soon as the last returns"""
+    results = []
+    stats = {"sse_events": 0, "first_event": {}}
+    remaining = quotes
+    lag = []
+    lag_task = asyncio.run_coroutine_threadsafe(sample_loop_lag(lag), lag_loop)
+    sampler = ResourceSampler()
+    sampler.start()
+
+    async def broker(index: int):
+        nonlocal remaining
+        priority = BATCH if index < round(concurrency * args.batch_share) else INTERACTIVE
+        while remaining > 0:
+            remaining -= 1
+            brand, model = VEHICLES[0] if args.same_vehicle else rng.choice(VEHICLES)
+            vehicle = {"brand": brand, "model": model, "year": str(rng.randint(2016, 2024)),
+                       "zip_code": rng.choice(ZIP_CODES)}
+            quote_id = f"load-{uuid.uuid4().hex[:8]}"
+            follow = asyncio.create_task(follow_sse(args.sse_port, quote_id, stats)) if args.sse else None
+            started = time.monotonic()
+            try:
+                result = await submit(vehicle, quote_id, priority)
+            except Exception as e:
+                result = {"status": "error", "message": repr(e)}
+            results.append({"priority": priority, "seconds": time.monotonic() - started,
+                            "status": result.get("status"), "failure": result.get("failure"),
+                            "coalesced": bool(result.get("coalesced_with"))})
+            if follow:
+                try:
+                    await asyncio.wait_for(follow, 5)
+                except (asyncio.TimeoutError, OSError):
+                    follow.cancel()
+            if args.think:
+                await asyncio.sleep(rng.expovariate(1 / args.think))
+
+    started = time.monotonic()
+    await asyncio.gather(*(broker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+    lag_task.cancel()
+    resources = sampler.stop()
+
+    ok = [r["seconds"] for r in results if r["status"] == "success"]
+    row = {
+        "concurrency": concurrency,
+        "quotes": len(results),
+        "errors": sum(r["status"] != "success" for r in results),
+        "coalesced": sum(r["coalesced"] for r in results),
+        "throughput_per_min": round(len(ok) / elapsed * 60, 2),
+        "p50": percentile(ok, 0.5), "p95": percentile(ok, 0.95), "p99": percentile(ok, 0.99),
+        "loop_lag_p99_ms": round(percentile(lag, 0.99) * 1000, 1) if lag else None,
+        "loop_lag_max_ms": round(max(lag) * 1000, 1) if lag else None,
+        "cpu_avg": round(statistics.mean(s["cpu"] for s in resources), 1) if resources else None,
+        "cpu_max": round(max(s["cpu"] for s in resources), 1) if resources else None,
+        "rss_peak_mb": round(max(s["rss"] for s in resources) / 2 ** 20) if resources else None,
+        "browsers_peak": max(s["browsers"] for s in resources) if resources else None,
+        "failures": sorted({r["failure"] for r in results if r["failure"]}),
+    }
+    for priority in (INTERACTIVE, BATCH):
+        waits = [r["seconds"] for r in results if r["priority"] == priority and r["status"] == "success"]
+        if waits:
+            row[f"p95_{priority}"] = percentile(waits, 0.95)
+    if args.sse:
+        row["sse_events"] = stats["sse_events"]
+        row["sse_first_event_p95"] = percentile(list(stats["first_event"].values()), 0.95)
+    return row
+
+
+def print_row(row: dict):
+    def fmt(value, spec=".1f"):
+        return "-" if value is None else format(value, spec)
+
+    print(f"{row['concurrency']:>5} {row['quotes']:>6} {row['errors']:>5} {row['throughput_per_min']:>9.2f} "
+          f"{fmt(row['p50']):>7} {fmt(row['p95']):>7} {fmt(row['p99']):>7} "
+          f"{fmt(row['loop_lag_p99_ms']):>8} {fmt(row['loop_lag_max_ms']):>8} "
+          f"{fmt(row['cpu_avg']):>7} {fmt(row['cpu_max']):>7} {fmt(row['rss_peak_mb'], 'd'):>7} "
+          f"{fmt(row['browsers_peak'], '.0f'):>5}")
+
+
+def capacity(rows: list, slo: float, max_error_rate: float, max_lag_ms: float):
+    """Highest concurrency that kept p95, errors and loop lag within bounds"""
+    best = None
+    for row in rows:
+        if (row["p95"] is not None and row["p95"] <= slo and row["errors"] <= max_error_rate * row["quotes"]
+                and (row["loop_lag_p99_ms"] or 0) <= max_lag_ms):
+            best = row
+    return best
+
+
+async def main(args):
+    portal = start_portal(args.page_delay)
+    portal_url = f"http://127.0.0.1:{portal.server_address[1]}"
+    install_fake_llm(portal_url, args.llm_scale, args.llm_error_rate, args.seed)
+    levels = [int(level) for level in args.levels.split(",")]
+    # The scheduler would otherwise cap the curve at SCHED_SLOTS
+    SCHEDULER.configure(slots=args.slots or max(levels))
+    rng = random.Random(args.seed)
+
+    sse_server = None
+    if args.sse:
+        sse_server = asyncio.create_task(serve_sse(port=args.sse_port))
+
+    if args.target == "pool":
+        from warm_sessions import WarmSessionPool
+
+        pool = WarmSessionPool(max_sessions=max(levels))
+        lag_loop = pool._loop
+
+        async def submit(vehicle, quote_id, priority):
+            # Each quote gets its own session, as with one broker per browser tab
+            session_key = uuid.uuid4().hex
+            pool.prewarm(session_key)
+            return await asyncio.wrap_future(pool.submit(session_key, vehicle, quote_id=quote_id, priority=priority))
+    else:
+        lag_loop = asyncio.get_running_loop()
+
+        async def submit(vehicle, quote_id, priority):
+            return await quote_agent.run_quote(vehicle, quote_id=quote_id, priority=priority)
+
+    print(f"🚦 Load test: target={args.target} levels={levels} quotes/level={args.quotes} "
+          f"llm-scale={args.llm_scale} portal={portal_url}")
+    print(f"{'conc':>5} {'quotes':>6} {'errs':>5} {'quotes/m':>9} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'lag99ms':>8} {'lagmaxms':>8} {'cpu%':>7} {'cpu%max':>7} {'rss MB':>7} {'brws':>5}")
+    rows = []
+    for level in levels:
+        row = await run_level(submit, level, max(args.quotes, level), args, rng, lag_loop)
+        rows.append(row)
+        print_row(row)
+
+    if sse_server:
+        sse_server.cancel()
+    if args.target == "pool":
+        await asyncio.to_thread(pool.shutdown)
+    else:
+        await close_context_pool()
+    portal.shutdown()
+
+    best = capacity(rows, args.slo, args.max_error_rate, args.max_lag_ms)
+    if best:
+        print(f"\n✅ Capacity: {best['concurrency']} concurrent quotes per host "
+              f"({best['throughput_per_min']} quotes/min, p95 {best['p95']:.0f}s, "
+              f"{best['rss_peak_mb']} MB peak)")
+    else:
+        print(f"\n❌ No level met p95 <= {args.slo}s with <= {args.max_error_rate:.0%} errors")
+
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    report = REPORT_DIR / f"capacity-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    report.write_text(json.dumps({"args": vars(args), "levels": rows,
+                                  "capacity": best["concurrency"] if best else None}, indent=2))
+    print(f"📄 {report}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ramp concurrent quotes and report a capacity curve")
+    parser.add_argument("--target", choices=["quote", "pool"], default="quote")
+    parser.add_argument("--levels", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--quotes", type=int, default=8, help="quotes per level (at least one per broker)")
+    parser.add_argument("--think", type=float, default=0, help="mean seconds a broker pauses between quotes")
+    parser.add_argument("--batch-share", type=float, default=0, help="fraction of brokers submitting batch quotes")
+    parser.add_argument("--same-vehicle", action="store_true", help="everyone quotes the same car (coalescing)")
+    parser.add_argument("--llm-scale", type=float, default=1.0, help="multiplier on model latency (0.1 = fast)")
+    parser.add_argument("--llm-error-rate", type=float, default=0, help="share of model calls that rate-limit")
+    parser.add_argument("--page-delay", type=int, default=1500, help="ms the stand-in pages show a spinner")
+    parser.add_argument("--slots", type=int, default=0, help="scheduler browser slots (default: highest level)")
+    parser.add_argument("--sse", action="store_true", help="follow every quote over the SSE endpoint")
+    parser.add_argument("--sse-port", type=int, default=8766)
+    parser.add_argument("--slo", type=float, default=240, help="p95 seconds a level must stay under")
+    parser.add_argument("--max-error-rate", type=float, default=0.05)
+    parser.add_argument("--max-lag-ms", type=float, default=250, help="event-loop lag p99 a level must stay under")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(main(parser.parse_args()))
@@ -5,9 +5,15 @@ Four-phase automation using Gemini models
 
 import asyncio
 import os
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 from browser_use import Agent, Browser, ChatGoogle
 
+# Shared modules live at the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from prompt_cache import PhasePrompt, record_usage
+
 load_dotenv()
 
 # Model configuration - Gemini models
@@ -41,7 +47,7 @@ IMPORTANT:
 
 # Phase 2A: Extract Dropdown Options
 EXTRACT_OPTIONS_PROMPT = """
-Type "AUDI Q3 2020" in the vehicle search box.
+Type the search text from the request in the vehicle search box.
 Wait 2 seconds for the dropdown suggestions to appear.
 Use extract_page_content action to get ALL visible dropdown options.
 Return the complete list of available vehicles shown.
@@ -51,20 +57,15 @@ STOP after extracting the list.
 
 # Phase 2B: Semantic Vehicle Selection
 SELECT_VEHICLE_PROMPT = """
-From the dropdown list, select the vehicle that BEST matches these specifications:
-- Brand: AUDI
-- Model: Q3 S LINE SPORT BACK
-- Year: 2020
-- Engine: L4 2.0T (approximately 180 horsepower, 2.0 liter)
-- Doors: 5 puertas
+From the dropdown list, select the vehicle that BEST matches the specifications in the request.
 
 SELECTION CRITERIA:
-- Prioritize: Year 2020, engine size ~2.0L, horsepower ~180hp
+- Prioritize: the requested year, then engine size and horsepower
 - The exact wording may differ (e.g., "180 CP" means 180hp)
 - Focus on semantic matching, not exact string matching
 - Use click_element action to select the best match
 
-- Add the zip code of the city you are in (05100)
+- Add the zip code from the request
 - Use the click_element action to select the zone depicted in the zip code. It should be a single option in a dropdown.
 
 - Use the click_element action to select the "siguiente" button.
@@ -91,6 +92,25 @@ IMPORTANT:
 """
 
 
+# Per-quote values, kept out of the prompts above so those stay a cached prefix
+SEARCH_TEXT = "AUDI Q3 2020"
+VEHICLE_DATA = """
+Vehicle to select:
+- Brand: AUDI
+- Model: Q3 S LINE SPORT BACK
+- Year: 2020
+- Engine: L4 2.0T (approximately 180 horsepower, 2.0 liter)
+- Doors: 5 puertas
+- Zip code: 05100
+"""
+
+# Static prompts go into the system message (cached by the provider), the task stays small
+NAVIGATION_PHASE = PhasePrompt(NAVIGATION_PROMPT, "Reach the Qualitas vehicle search box as described in your instructions.")
+EXTRACT_PHASE = PhasePrompt(EXTRACT_OPTIONS_PROMPT, f'Search text: "{SEARCH_TEXT}"')
+SELECT_PHASE = PhasePrompt(SELECT_VEHICLE_PROMPT, VEHICLE_DATA)
+COMPLETION_PHASE = PhasePrompt(COMPLETION_PROMPT, "Finish the quote and download the PDF as described in your instructions.")
+
+
 async def main():
     """
     Four-phase automation for Qualitas insurance quote using Gemini models
@@ -115,11 +135,12 @@ async def main():
         # Phase 1: Navigation Agent
         print("📍 Phase 1: Navigation to Vehicle Search")
         nav_agent = Agent(
-            task=NAVIGATION_PROMPT,
+            **NAVIGATION_PHASE.agent_kwargs(),
             browser_session=browser,
             llm=ChatGoogle(model=NAVIGATION_MODEL)
         )
         await nav_agent.run(max_steps=20)
+        print(f"🧮 Navigation prompt cache: {record_usage(nav_agent, 'qualitas', 'navigation')}")
         print("✅ Phase 1 complete - Reached vehicle search box")
         await asyncio.sleep(2)
         print("-" * 60)
@@ -127,11 +148,12 @@ async def main():
         # Phase 2A: Extract Dropdown Options
         print("📋 Phase 2A: Extract Vehicle Options from Dropdown")
         extract_agent = Agent(
-            task=EXTRACT_OPTIONS_PROMPT,
+            **EXTRACT_PHASE.agent_kwargs(),
             browser_session=browser,
             llm=ChatGoogle(model=EXTRACT_MODEL)
         )
         await extract_agent.run(max_steps=10)
+        print(f"🧮 Extract prompt cache: {record_usage(extract_agent, 'qualitas', 'extract')}")
         print("✅ Phase 2A complete - Options extracted")
         await asyncio.sleep(2)
         print("-" * 60)
@@ -139,11 +161,12 @@ async def main():
         # Phase 2B: Semantic Vehicle Selection
         print("🎯 Phase 2B: Select Best Matching Vehicle")
         select_agent = Agent(
-            task=SELECT_VEHICLE_PROMPT,
+            **SELECT_PHASE.agent_kwargs(),
             browser_session=browser,
             llm=ChatGoogle(model=SELECT_MODEL)
         )
         await select_agent.run(max_steps=10)
+        print(f"🧮 Select prompt cache: {record_usage(select_agent, 'qualitas', 'select')}")
         print("✅ Phase 2B complete - Vehicle selected")
         await asyncio.sleep(2)
         print("-" * 60)
@@ -151,11 +174,12 @@ async def main():
         # Phase 3: Completion Agent
         print("📝 Phase 3: Form Completion & PDF Download")
         completion_agent = Agent(
-            task=COMPLETION_PROMPT,
+            **COMPLETION_PHASE.agent_kwargs(),
             browser_session=browser,
             llm=ChatGoogle(model=COMPLETION_MODEL)
         )
         await completion_agent.run(max_steps=20)
+        print(f"🧮 Completion prompt cache: {record_usage(completion_agent, 'qualitas', 'completion')}")
         print("✅ Phase 3 complete - PDF downloaded")
         print("-" * 60)
 
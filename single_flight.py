@@ -0,0 +1,138 @@
+"""
+Single-flight coalescing for identical in-flight quotes
+
+Two brokers quoting the same vehicle and zip at once, or a Streamlit rerun
+resubmitting the form, would otherwise run two full browser automations.
+run_quote() asks QUOTE_FLIGHTS first. If an identical quote (same insurer,
+vehicle, engine, doors, zip) is already running on this event loop, the
+caller attaches to it instead of starting another. It gets the leader's
+progress callbacks, its progress events re-emitted under the caller's own
+quote_id, and a copy of its result. quotes_coalesced_total counts how many
+requests were attached.
+"""
+import asyncio
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+from progress_events import EVENTS, EventStream, ProgressEvent
+from quote_store import vehicle_key
+from zip_index import normalize_zip
+
+
+COALESCED = REGISTRY.counter("quotes_coalesced_total", "Quote requests attached to an identical in-flight quote",
+                             ["insurer"])
+
+
+def _norm(text: str) -> str:
+    text = unicodedata.normalize("NFD", str(text or ""))
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).upper().split())
+
+
+def flight_key(insurer: str, vehicle_info: dict) -> str:
+    """Everything that changes the quote's outcome, normalized"""
+    zip_code = vehicle_info.get("zip_code", "05100")
+    return "|".join([
+        insurer,
+        vehicle_key(vehicle_info),
+        normalize_zip(zip_code) or _norm(zip_code),
+        _norm(vehicle_info.get("engine")),
+        _norm(vehicle_info.get("doors")),
+    ])
+
+
+@dataclass
+class Flight:
+    leader_id: str
+    result: asyncio.Future
+    callbacks: List[Callable] = field(default_factory=list)
+    followers: List[str] = field(default_factory=list)
+
+    def progress(self, phase: int, message: str):
+        for callback in list(self.callbacks):
+            callback(phase, message)
+
+
+class SingleFlight:
+    """In-flight quotes by key, per event loop (futures can't cross loops)"""
+
+    def __init__(self, insurer: str, events: EventStream = EVENTS):
+        self.insurer = insurer
+        self.events = events
+        self._flights: Dict[Tuple[asyncio.AbstractEventLoop, str], Flight] = {}
+
+    def leader(self, key: str) -> Optional[str]:
+        flight = self._flights.get((asyncio.get_running_loop(), key))
+        return flight.leader_id if flight else None
+
+    async def do(self, key: str, quote_id: str, progress_callback: Optional[Callable],
+                 run: Callable[[Callable], Awaitable[dict]]) -> dict:
+        """
+        Run `run(progress)` unless an identical quote is in flight; then wait for it.
+
+        run receives a progress function that fans out to every attached caller.
+        """
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get((loop, key))
+        if flight is not None:
+            result = await self._attach(flight, quote_id, progress_callback)
+            if result is not None:
+                return result
+            # The leader was cancelled by its own caller; this request still wants a quote
+            return await self.do(key, quote_id, progress_callback, run)
+
+        flight = Flight(leader_id=quote_id, result=loop.create_future())
+        if progress_callback:
+            flight.callbacks.append(progress_callback)
+        self._flights[(loop, key)] = flight
+        forward = self._forwarder(flight)
+        self.events.add_listener(forward)
+        try:
+            result = await run(flight.progress)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                flight.result.cancel()
+            else:
+                flight.result.set_exception(e)
+            raise
+        else:
+            flight.result.set_result(result)
+            return result
+        finally:
+            del self._flights[(loop, key)]
+            self.events.remove_listener(forward)
+            # Followers may not be waiting any more; don't warn about an unread exception
+            if flight.result.done() and not flight.result.cancelled():
+                flight.result.exception()
+
+    async def _attach(self, flight: Flight, quote_id: str, progress_callback: Optional[Callable]) -> Optional[dict]:
+        """Wait for the leader; None if it was cancelled (by its caller, not a failure of the quote)"""
+        COALESCED.inc(insurer=self.insurer)
+        self.events.emit("coalesced", quote_id, leader=flight.leader_id)
+        if progress_callback:
+            flight.callbacks.append(progress_callback)
+        flight.followers.append(quote_id)
+        try:
+            # shield: a follower giving up must not cancel the leader
+            result = await asyncio.shield(flight.result)
+        except asyncio.CancelledError:
+            if flight.result.cancelled():
+                return None
+            raise
+        finally:
+            flight.followers.remove(quote_id)
+            if progress_callback in flight.callbacks:
+                flight.callbacks.remove(progress_callback)
+        if result.get("failure") == "cancelled":
+            return None
+        return {**result, "quote_id": quote_id, "coalesced_with": flight.leader_id}
+
+    def _forwarder(self, flight: Flight) -> Callable[[ProgressEvent], None]:
+        """Re-emit the leader's events under each follower's quote_id"""
+        def forward(event: ProgressEvent):
+            if event.quote_id != flight.leader_id:
+                return
+            for follower in list(flight.followers):
+                self.events.emit(event.type, follower, event.phase, **event.data)
+        return forward
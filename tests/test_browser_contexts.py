@@ -0,0 +1,35 @@
+import json
+
+from browser_contexts import _Relay
+
+
+def _relay() -> _Relay:
+    relay = _Relay("ctx-a")
+    relay.sessions.add("ours")
+    return relay
+
+
+def test_events_route_on_the_top_level_session_id():
+    relay = _relay()
+    ours = json.dumps({"method": "Page.loadEventFired", "params": {"timestamp": 1}, "sessionId": "ours"})
+    theirs = json.dumps({"method": "Page.loadEventFired", "params": {"timestamp": 1}, "sessionId": "theirs"})
+    assert relay.inbound(ours) == ours
+    assert relay.inbound(theirs) is None
+
+
+def test_session_id_far_from_the_end_is_still_found():
+    relay = _relay()
+    event = json.dumps({"sessionId": "theirs", "method": "Runtime.consoleAPICalled",
+                        "params": {"args": [{"value": "x" * 10_000}]}})
+    assert relay.inbound(event) is None
+
+
+def test_session_id_text_inside_a_payload_is_not_routed_on():
+    relay = _relay()
+    # Browser-level event whose payload tail mentions our session
+    event = json.dumps({"method": "Runtime.consoleAPICalled", "params": {"text": '"sessionId":"ours"'}})
+    assert relay.inbound(event) == event
+    # Another context's page event whose payload mentions ours
+    leak = json.dumps({"method": "Runtime.consoleAPICalled", "params": {"text": '"sessionId":"ours"'},
+                       "sessionId": "theirs"})
+    assert relay.inbound(leak) is None
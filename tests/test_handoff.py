@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from handoff import PhaseHandoff
+
+
+class _Action:
+    def __init__(self, **action):
+        self.action = action
+
+    def model_dump(self, exclude_none: bool = True) -> dict:
+        return self.action
+
+
+def _item(url: str, actions: list, elements: list, memory: str = ""):
+    state = SimpleNamespace(url=url, title="Cotizador", tabs=[], interacted_element=elements)
+    return SimpleNamespace(state=state, model_output=SimpleNamespace(action=actions, memory=memory))
+
+
+def _element(tag: str, **attributes):
+    return SimpleNamespace(node_name=tag.upper(), attributes=attributes)
+
+
+def test_from_history_keeps_values_and_elements():
+    history = SimpleNamespace(
+        history=[
+            _item("https://portal/login", [_Action(input_text={"index": 3, "text": "AUDI"}),
+                                           _Action(click_element_by_index={"index": 7})],
+                  [_element("input", name="marca"), _element("button", id="buscar")]),
+            _item("https://portal/search", [_Action(scroll={"down": True})], [], memory="On the search form"),
+        ],
+        is_done=lambda: False,
+    )
+    handoff = PhaseHandoff.from_history("navigation", history)
+    assert handoff.url == "https://portal/search"
+    assert handoff.achieved == "On the search form"
+    assert handoff.entered == ["[3] <input name=\"marca\"> = 'AUDI'"]
+    assert handoff.elements == ['click_element_by_index [7] <button id="buscar">']
+    assert "Values already entered" in handoff.to_prompt()
+
+
+def test_from_empty_history():
+    handoff = PhaseHandoff.from_history("navigation", SimpleNamespace(history=[]))
+    assert (handoff.phase, handoff.url, handoff.entered) == ("navigation", "", [])
@@ -0,0 +1,85 @@
+from job_queue import JobQueue
+from scheduler import BATCH, INTERACTIVE
+
+
+def _queue(tmp_path) -> JobQueue:
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_lease_complete(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue({"vehicle_info": {"brand": "AUDI"}})
+    job = queue.lease("w1")
+    assert (job.id, job.attempts, job.payload["vehicle_info"]) == (job_id, 1, {"brand": "AUDI"})
+    assert queue.lease("w2") is None  # invisible while leased
+    assert queue.complete(job, {"status": "success"})
+    assert queue.get(job_id)["status"] == "done"
+
+
+def test_expired_lease_is_reclaimed_and_the_old_owner_loses_it(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue({})
+    stale = queue.lease("w1", visibility_timeout=0)
+    reclaimed = queue.lease("w2")
+    assert (reclaimed.id, reclaimed.attempts, reclaimed.lease_owner) == (job_id, 2, "w2")
+
+    assert not queue.heartbeat(stale)
+    assert not queue.complete(stale, {"status": "success"})
+    assert queue.heartbeat(reclaimed)
+    assert queue.complete(reclaimed, {"status": "success"})
+    assert queue.get(job_id)["status"] == "done"
+
+
+def test_expired_lease_out_of_attempts_is_buried(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue({}, max_attempts=1)
+    queue.lease("w1", visibility_timeout=0)
+    assert queue.lease("w2") is None
+    assert queue.status(job_id) == "dead"
+
+
+def test_fail_retries_until_attempts_run_out(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue({}, max_attempts=2)
+    assert queue.fail(queue.lease("w1"), "portal timeout", retry_delay=0)
+    assert queue.status(job_id) == "queued"
+    assert queue.fail(queue.lease("w1"), "portal timeout", retry_delay=0)
+    assert queue.status(job_id) == "dead"
+    assert queue.get(job_id)["result"] == {"error": "portal timeout"}
+
+
+def test_fail_without_retry_is_dead_at_once(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue({}, max_attempts=3)
+    assert queue.fail(queue.lease("w1"), "login_rejected", retry=False)
+    assert queue.get(job_id)["status"] == "dead"
+
+
+def test_release_does_not_count_as_an_attempt(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue({})
+    assert queue.release(queue.lease("w1"))
+    assert queue.lease("w1").attempts == 1
+
+
+def test_interactive_jobs_lease_first(tmp_path):
+    queue = _queue(tmp_path)
+    batch = queue.enqueue({"priority": BATCH})
+    interactive = queue.enqueue({"priority": INTERACTIVE})
+    assert queue.lease("w1", interactive_only=True).id == interactive
+    assert queue.lease("w1", interactive_only=True) is None
+    assert queue.lease("w1").id == batch
+
+
+def test_cancel_queued_and_leased(tmp_path):
+    queue = _queue(tmp_path)
+    queued = queue.enqueue({})
+    assert queue.cancel(queued) == "cancelled"
+    assert queue.lease("w1") is None
+
+    leased_id = queue.enqueue({})
+    leased = queue.lease("w1")
+    assert queue.cancel(leased_id) == "cancelling"
+    assert queue.complete(leased, {"status": "error", "failure": "cancelled"})
+    assert queue.status(leased_id) == "cancelled"
+    assert queue.cancel(leased_id) is None
@@ -0,0 +1,67 @@
+from metrics import Registry
+
+
+def test_render_counter_and_gauge():
+    registry = Registry()
+    quotes = registry.counter("quotes_total", "Quotes by status", ["insurer", "status"])
+    quotes.inc(insurer="qualitas", status="success")
+    quotes.inc(2, insurer="qualitas", status="error")
+    browsers = registry.gauge("browsers", "Live browsers")
+    browsers.set(3)
+    browsers.dec()
+
+    assert registry.render() == (
+        "# HELP browsers Live browsers\n"
+        "# TYPE browsers gauge\n"
+        "browsers 2\n"
+        "# HELP quotes_total Quotes by status\n"
+        "# TYPE quotes_total counter\n"
+        'quotes_total{insurer="qualitas",status="error"} 2\n'
+        'quotes_total{insurer="qualitas",status="success"} 1\n'
+    )
+
+
+def test_render_escapes_label_values():
+    registry = Registry()
+    registry.counter("errors_total", "Errors", ["message"]).inc(message='bad "zip"\\\n')
+    assert 'errors_total{message="bad \\"zip\\"\\\\\\n"} 1' in registry.render()
+
+
+def test_render_histogram_buckets_are_cumulative():
+    registry = Registry()
+    waits = registry.histogram("wait_seconds", "Waits", ["priority"], buckets=(1, 5))
+    for value in (0.5, 1, 3, 7.5):
+        waits.observe(value, priority="batch")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP wait_seconds Waits", "# TYPE wait_seconds histogram"]
+    assert lines[2:] == [
+        'wait_seconds_bucket{priority="batch",le="1"} 2',
+        'wait_seconds_bucket{priority="batch",le="5"} 3',
+        'wait_seconds_bucket{priority="batch",le="+Inf"} 4',
+        'wait_seconds_sum{priority="batch"} 12',
+        'wait_seconds_count{priority="batch"} 4',
+    ]
+
+
+def test_histogram_quantile_is_bucket_upper_bound():
+    registry = Registry()
+    steps = registry.histogram("steps", "Steps", buckets=(1, 5, 10))
+    assert steps.quantile(0.5) is None
+    for value in (1, 2, 3, 20):
+        steps.observe(value)
+    assert steps.quantile(0.5) == 5
+    assert steps.quantile(1.0) == float("inf")
+
+
+def test_collectors_run_on_render_and_broken_ones_are_skipped():
+    registry = Registry()
+    depth = registry.gauge("queue_depth", "Jobs queued")
+
+    def broken():
+        raise RuntimeError("database is locked")
+
+    registry.add_collector(broken)
+    registry.add_collector(lambda: depth.set(7))
+    assert "queue_depth 7" in registry.render()
+    assert registry.snapshot()["queue_depth"] == {(): 7}
@@ -0,0 +1,70 @@
+from portal_graph import PortalGraph, _successful_phases, url_pattern
+
+
+def _edge(source: str, target: str, actions: list, runs: int = 2) -> dict:
+    return {"from": source, "to": target, "variants": {str(actions): {"actions": actions, "runs": runs}}}
+
+
+def _graph(tmp_path, edges: list, goals: dict) -> PortalGraph:
+    graph = PortalGraph("qualitas", root=tmp_path, min_runs=2)
+    graph.graph.edges = {f"{e['from']}>{e['to']}": e for e in edges}
+    graph.graph.goals = goals
+    return graph
+
+
+CLICK = {"click": {"element": ["button", "entrar", 0]}}
+
+
+def test_shortest_path_takes_fewest_actions(tmp_path):
+    graph = _graph(tmp_path, [
+        _edge("login", "home", [CLICK]),
+        _edge("home", "search", [CLICK, CLICK, CLICK]),
+        _edge("home", "menu", [CLICK]),
+        _edge("menu", "search", [CLICK]),
+    ], {"navigation": {"search": 3}})
+
+    path = graph.shortest_path("login", "navigation")
+    assert [edge["to"] for edge, _ in path] == ["home", "menu", "search"]
+    assert graph.distance("login", "navigation") == 3
+    assert graph.shortest_path("search", "navigation") == []
+
+
+def test_edges_seen_in_too_few_runs_are_not_replayed(tmp_path):
+    graph = _graph(tmp_path, [
+        _edge("login", "search", [CLICK], runs=1),
+        _edge("login", "home", [CLICK]),
+        _edge("home", "search", [CLICK]),
+    ], {"navigation": {"search": 1}})
+    assert [edge["to"] for edge, _ in graph.shortest_path("login", "navigation")] == ["home", "search"]
+
+
+def test_no_path_without_goal_or_route(tmp_path):
+    graph = _graph(tmp_path, [_edge("login", "home", [CLICK])], {"navigation": {"search": 1}})
+    assert graph.shortest_path("login", "navigation") is None
+    assert graph.shortest_path("login", "select") is None
+    assert graph.distance(None, "navigation") is None
+
+
+def test_url_pattern_masks_ids_and_drops_query():
+    assert (url_pattern("https://agentes.qualitas.com.mx/cotizador/12345/paso?x=1#/vehiculo/9f8e7d6c5b4a")
+            == "https://agentes.qualitas.com.mx/cotizador/*/paso#/vehiculo/*")
+
+
+def _step(url: str) -> dict:
+    return {"url": url, "actions": [], "results": []}
+
+
+def test_successful_phases_skip_failed_and_unfinished_runs():
+    records = [
+        {"note": True, "insurer": "qualitas"},
+        _step("login"), _step("home"),
+        {"note": True, "phase": "navigation", "steps": 2, "done": True},
+        _step("search"),
+        {"note": True, "phase": "select", "steps": 1, "done": True},
+        {"note": True, "phase": "select", "failure": "wrong_vehicle"},
+        {"note": True, "recovery": {"reached": True}},
+        _step("form"),
+        {"note": True, "phase": "completion", "steps": 1, "done": False},
+    ]
+    phases = list(_successful_phases(records))
+    assert [(phase, [s["url"] for s in steps]) for phase, steps in phases] == [("navigation", ["login", "home"])]
@@ -0,0 +1,44 @@
+import time
+from datetime import datetime
+
+from quote_cache import QuoteCache, in_window, next_window_start, window_end
+
+
+VEHICLE = {"brand": "AUDI", "model": "Q3", "year": "2020", "zip_code": "05100"}
+RESULT = {"status": "success", "quote_id": "warm1"}
+
+
+def test_serves_only_fresh_precomputed_results(tmp_path):
+    cache = QuoteCache(str(tmp_path / "cache.db"))
+    cache.store("k", RESULT)
+    assert cache.lookup("qualitas", "k", VEHICLE) is None  # quoted on demand, never served
+
+    cache.store("k", RESULT, warmed=True)
+    hit = cache.lookup("qualitas", "k", VEHICLE)
+    assert hit["quote_id"] == "warm1" and hit["cache_age_s"] == 0
+    assert cache.lookup("qualitas", "k", VEHICLE, max_age=-1) is None
+
+
+def test_expired_results_are_missed_and_due_again(tmp_path):
+    cache = QuoteCache(str(tmp_path / "cache.db"), ttl=-1)
+    cache.store("k", RESULT, warmed=True)
+    assert cache.lookup("qualitas", "k", VEHICLE) is None
+    assert cache.due("qualitas", time.time()) == [("k", VEHICLE)]
+    stats = cache.stats()
+    assert (stats["requests"], stats["hit_rate"]) == (1, 0)
+
+
+def test_demand_ranks_due_keys(tmp_path):
+    cache = QuoteCache(str(tmp_path / "cache.db"))
+    for _ in range(3):
+        cache.lookup("qualitas", "popular", VEHICLE)
+    cache.lookup("qualitas", "rare", {**VEHICLE, "year": "2019"})
+    assert [key for key, _ in cache.due("qualitas", time.time(), top_n=1)] == ["popular"]
+
+
+def test_offpeak_window_wraps_midnight():
+    window = "23:00-05:00"
+    assert in_window(datetime(2026, 1, 1, 2, 0), window)
+    assert not in_window(datetime(2026, 1, 1, 12, 0), window)
+    assert window_end(datetime(2026, 1, 1, 23, 30), window) == datetime(2026, 1, 2, 5, 0)
+    assert next_window_start(datetime(2026, 1, 1, 23, 30), window) == datetime(2026, 1, 2, 23, 0)
@@ -0,0 +1,94 @@
+import asyncio
+
+from scheduler import BATCH, INTERACTIVE, PRIORITY_WEIGHTS, QuoteScheduler
+
+
+async def _hold(scheduler: QuoteScheduler, priority: str, release: asyncio.Event, started: list):
+    async with scheduler.slot(priority):
+        started.append(priority)
+        await release.wait()
+
+
+def test_reserved_slots_go_to_interactive_only():
+    async def run():
+        scheduler = QuoteScheduler(slots=2, reserved=1, rpm={})
+        release, started = asyncio.Event(), []
+        tasks = [asyncio.create_task(_hold(scheduler, BATCH, release, started)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert started == [BATCH]  # the second batch quote waits for the unreserved slot
+
+        tasks.append(asyncio.create_task(_hold(scheduler, INTERACTIVE, release, started)))
+        await asyncio.sleep(0)
+        assert started == [BATCH, INTERACTIVE]
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == [BATCH, INTERACTIVE, BATCH]
+
+    asyncio.run(run())
+
+
+async def _grant_order(scheduler: QuoteScheduler, waiting: dict) -> str:
+    """Order in which one busy slot is handed to the queued quotes"""
+    order = []
+
+    async def quote(priority: str):
+        async with scheduler.slot(priority):
+            order.append(priority[0])
+            await asyncio.sleep(0)
+
+    release = asyncio.Event()
+    holder = asyncio.create_task(_hold(scheduler, INTERACTIVE, release, []))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(quote(priority)) for priority, count in waiting.items() for _ in range(count)]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return "".join(order)
+
+
+def test_queued_classes_share_slots_by_weight():
+    share = PRIORITY_WEIGHTS[BATCH] / (PRIORITY_WEIGHTS[INTERACTIVE] + PRIORITY_WEIGHTS[BATCH])
+    scheduler = QuoteScheduler(slots=1, reserved=0, rpm={})
+    order = asyncio.run(_grant_order(scheduler, {BATCH: 10, INTERACTIVE: 40}))
+    # While both classes are queued, batch gets its weighted share instead of waiting for interactive to drain
+    for n in range(1, order.rindex("i") + 1):
+        assert abs(order[:n].count("b") - n * share) <= 1.5
+
+
+def test_lone_class_gets_every_slot():
+    scheduler = QuoteScheduler(slots=1, reserved=0, rpm={})
+    assert asyncio.run(_grant_order(scheduler, {BATCH: 5})) == "bbbbb"
+
+
+def test_idle_class_does_not_bank_credit():
+    async def run():
+        scheduler = QuoteScheduler(slots=1, reserved=0, rpm={})
+        # Interactive runs alone for a while before batch shows up
+        for _ in range(40):
+            async with scheduler.slot(INTERACTIVE):
+                pass
+        return await _grant_order(scheduler, {BATCH: 5, INTERACTIVE: 20})
+
+    order = asyncio.run(run())
+    assert order[:3].count("b") == 1
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        scheduler = QuoteScheduler(slots=1, reserved=0, rpm={})
+        release, started = asyncio.Event(), []
+        holder = asyncio.create_task(_hold(scheduler, INTERACTIVE, release, started))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(_hold(scheduler, BATCH, release, started))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await holder
+        assert started == [INTERACTIVE]
+        assert scheduler.stats()[BATCH]["running"] == 0
+        async with scheduler.slot(BATCH):
+            assert scheduler.stats()[BATCH]["running"] == 1
+
+    asyncio.run(run())
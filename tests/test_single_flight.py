@@ -0,0 +1,84 @@
+import asyncio
+
+from progress_events import EventStream
+from single_flight import SingleFlight, flight_key
+
+
+VEHICLE = {"brand": "AUDI", "model": "Q3", "year": "2020", "zip_code": "05100"}
+
+
+def test_flight_key_normalizes_accents_case_and_zip():
+    assert flight_key("qualitas", {**VEHICLE, "model": "q3 ", "zip_code": "5100"}) == flight_key("qualitas", VEHICLE)
+    assert flight_key("qualitas", {**VEHICLE, "engine": "Eléctrico"}) == flight_key("qualitas", {**VEHICLE, "engine": "ELECTRICO"})
+    assert flight_key("qualitas", {**VEHICLE, "year": "2021"}) != flight_key("qualitas", VEHICLE)
+
+
+def test_identical_quotes_coalesce_into_one_run():
+    async def run():
+        events = EventStream()
+        flights = SingleFlight("qualitas", events)
+        seen = []
+        events.add_listener(lambda event: seen.append((event.type, event.quote_id)))
+        runs = []
+        progress = {"a": [], "b": []}
+
+        async def quote(progress_callback):
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            progress_callback(2, "Selecting vehicle")
+            events.emit("step", "a", "select")
+            return {"status": "success", "quote_id": "a"}
+
+        key = flight_key("qualitas", VEHICLE)
+        leader = asyncio.create_task(flights.do(key, "a", lambda *p: progress["a"].append(p), quote))
+        await asyncio.sleep(0)
+        assert flights.leader(key) == "a"
+        follower = await flights.do(key, "b", lambda *p: progress["b"].append(p), quote)
+        assert len(runs) == 1
+        assert follower == {"status": "success", "quote_id": "b", "coalesced_with": "a"}
+        assert (await leader)["quote_id"] == "a"
+        assert progress["a"] == progress["b"] == [(2, "Selecting vehicle")]
+        assert ("step", "b") in seen and ("coalesced", "b") in seen
+        assert flights.leader(key) is None
+
+    asyncio.run(run())
+
+
+def test_follower_runs_its_own_quote_when_the_leader_is_cancelled():
+    async def run():
+        flights = SingleFlight("qualitas", EventStream())
+        started = asyncio.Event()
+        runs = []
+
+        async def quote(progress_callback):
+            runs.append(1)
+            started.set()
+            await asyncio.sleep(0.01)
+            return {"status": "success"}
+
+        key = flight_key("qualitas", VEHICLE)
+        leader = asyncio.create_task(flights.do(key, "a", None, quote))
+        await started.wait()
+        follower = asyncio.create_task(flights.do(key, "b", None, quote))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == {"status": "success"}
+        assert len(runs) == 2
+
+    asyncio.run(run())
+
+
+def test_leader_failure_reaches_followers():
+    async def run():
+        flights = SingleFlight("qualitas", EventStream())
+
+        async def quote(progress_callback):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("portal down")
+
+        key = flight_key("qualitas", VEHICLE)
+        results = await asyncio.gather(flights.do(key, "a", None, quote), flights.do(key, "b", None, quote),
+                                       return_exceptions=True)
+        assert [str(r) for r in results] == ["portal down", "portal down"]
+
+    asyncio.run(run())
@@ -0,0 +1,271 @@
+"""
+Trace archive - compact per-run step traces for post-mortem debugging
+
+Every quote run appends one record per agent step to output/traces/<run>.trace
+(action, DOM digest + serialized DOM, compressed screenshot, model response,
+timings) and a fixed-width offset to <run>.idx, so a single step is read with
+two seeks instead of loading the whole file. Old runs are pruned to
+TRACE_MAX_RUNS / TRACE_MAX_MB.
+
+Viewer:
+    python trace_archive.py list
+    python trace_archive.py show <run_id> [step]
+    python trace_archive.py view <run_id>     # step through interactively
+    python trace_archive.py steps             # mean steps per phase, handoff on vs off
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+
+TRACE_DIR = Path(os.getenv("TRACE_DIR", "output/traces"))
+TRACE_MAX_RUNS = int(os.getenv("TRACE_MAX_RUNS", "500"))
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "500"))
+SCREENSHOT_MAX_WIDTH = 1024
+SCREENSHOT_QUALITY = 50
+
+# Record header: meta length, screenshot length. Index entry: offset, record length.
+RECORD_HEADER = struct.Struct(">II")
+INDEX_ENTRY = struct.Struct(">QI")
+
+
+def compress_screenshot(data: bytes) -> bytes:
+    """Downscale and re-encode as JPEG; keep the original bytes if Pillow is unavailable"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    if image.width > SCREENSHOT_MAX_WIDTH:
+        image = image.resize((SCREENSHOT_MAX_WIDTH, int(image.height * SCREENSHOT_MAX_WIDTH / image.width)))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=SCREENSHOT_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+class TraceWriter:
+    """Append-only writer for one run"""
+
+    def __init__(self, run_id: str, trace_dir: Path = TRACE_DIR):
+        self.run_id = run_id
+        self.trace_dir = Path(trace_dir)
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        self._data = open(self.trace_dir / f"{run_id}.trace", "ab")
+        self._index = open(self.trace_dir / f"{run_id}.idx", "ab")
+        # Steps are written from a worker thread, notes from the event loop
+        self._lock = threading.Lock()
+
+    def append(self, record: dict, screenshot: Optional[bytes] = None):
+        meta = zlib.compress(json.dumps(record, default=str, ensure_ascii=False).encode(), 6)
+        screenshot = screenshot or b""
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(RECORD_HEADER.pack(len(meta), len(screenshot)) + meta + screenshot)
+            self._data.flush()
+            self._index.write(INDEX_ENTRY.pack(offset, RECORD_HEADER.size + len(meta) + len(screenshot)))
+            self._index.flush()
+
+    def record_step(self, agent, phase: str):
+        """Append the agent's latest history item"""
+        if agent.history.history:
+            self.record_item(agent.history.history[-1], phase)
+
+    def record_item(self, item, phase: str):
+        """Append one AgentHistory item"""
+        dom = item.state_message or ""
+        screenshot = None
+        if item.state and item.state.screenshot_path and os.path.exists(item.state.screenshot_path):
+            with open(item.state.screenshot_path, "rb") as f:
+                screenshot = compress_screenshot(f.read())
+        self.append({
+            "phase": phase,
+            "step": item.metadata.step_number if item.metadata else None,
+            "started": item.metadata.step_start_time if item.metadata else None,
+            "duration": round(item.metadata.duration_seconds, 3) if item.metadata else None,
+            "url": item.state.url if item.state else None,
+            "title": item.state.title if item.state else None,
+            "actions": [a.model_dump(exclude_none=True) for a in item.model_output.action] if item.model_output else [],
+            "model_output": item.model_output.current_state.model_dump() if item.model_output else None,
+            "results": [
+                {"error": r.error, "extracted_content": r.extracted_content, "is_done": r.is_done}
+                for r in item.result
+            ],
+            "dom_digest": hashlib.sha1(dom.encode()).hexdigest(),
+            "dom": dom,
+        }, screenshot)
+
+    async def snapshot(self, browser, reason: str, phase: Optional[str] = None):
+        """Record the page a stuck or cancelled run was on (URL, title, screenshot)"""
+        record = {"note": True, "ts": time.time(), "snapshot": reason, "phase": phase}
+        screenshot = None
+        try:
+            record["url"] = await asyncio.wait_for(browser.get_current_page_url(), 5)
+            record["title"] = await asyncio.wait_for(browser.get_current_page_title(), 5)
+            screenshot = compress_screenshot(await asyncio.wait_for(browser.take_screenshot(), 10))
+        except Exception as e:
+            # The browser may be the thing that hung; keep what we have
+            record["snapshot_error"] = repr(e)
+        self.append(record, screenshot)
+
+    def agent_hooks(self, phase: str) -> dict:
+        """on_step_end kwarg for Agent.run()"""
+        async def on_step_end(agent):
+            # Screenshot compression and the write stay off the event loop. Agent.run()
+            # doesn't guard its hooks, so a failed write must not end the run.
+            try:
+                await asyncio.to_thread(self.record_step, agent, phase)
+            except Exception as e:
+                print(f"⚠️ Trace {self.run_id}: step not recorded ({e!r})")
+        return {"on_step_end": on_step_end}
+
+    def note(self, **fields):
+        """Append a non-step record (phase boundaries, final outcome)"""
+        self.append({"note": True, "ts": time.time(), **fields})
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+        prune()
+
+
+class TraceReader:
+    """Random access to the records of one run"""
+
+    def __init__(self, run_id: str, trace_dir: Path = TRACE_DIR):
+        self.run_id = run_id
+        self.data_path = Path(trace_dir) / f"{run_id}.trace"
+        self.index_path = Path(trace_dir) / f"{run_id}.idx"
+
+    def __len__(self) -> int:
+        return self.index_path.stat().st_size // INDEX_ENTRY.size
+
+    def read(self, n: int, with_screenshot: bool = False) -> dict:
+        with open(self.index_path, "rb") as f:
+            f.seek(n * INDEX_ENTRY.size)
+            offset, _ = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            meta_len, shot_len = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            record = json.loads(zlib.decompress(f.read(meta_len)))
+            if with_screenshot:
+                record["screenshot"] = f.read(shot_len) or None
+            else:
+                record["screenshot_bytes"] = shot_len
+        return record
+
+    def __iter__(self) -> Iterator[dict]:
+        for n in range(len(self)):
+            yield self.read(n)
+
+
+def _stat(path: Path) -> Optional[os.stat_result]:
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        # Pruned by another process (workers prune concurrently)
+        return None
+
+
+def list_runs(trace_dir: Path = TRACE_DIR) -> List[Path]:
+    """Trace files, oldest first"""
+    stats = {path: _stat(path) for path in Path(trace_dir).glob("*.trace")}
+    return sorted((path for path, stat in stats.items() if stat), key=lambda p: stats[p].st_mtime)
+
+
+def prune(trace_dir: Path = TRACE_DIR, max_runs: int = TRACE_MAX_RUNS, max_mb: float = TRACE_MAX_MB):
+    """Delete the oldest runs until both retention limits hold; safe to run from several processes"""
+    runs = list_runs(trace_dir)
+    sizes = {p: getattr(_stat(p), "st_size", 0) for p in runs}
+    total = sum(sizes.values())
+    while runs and (len(runs) > max_runs or total > max_mb * 1024 * 1024):
+        oldest = runs.pop(0)
+        total -= sizes[oldest]
+        oldest.unlink(missing_ok=True)
+        oldest.with_suffix(".idx").unlink(missing_ok=True)
+
+
+def _format(n: int, record: dict) -> str:
+    if record.get("note"):
+        fields = {k: v for k, v in record.items() if k not in ("note", "screenshot_bytes")}
+        return f"[{n}] 📝 {json.dumps(fields, default=str, ensure_ascii=False)}"
+    state = record.get("model_output") or {}
+    lines = [
+        f"[{n}] {record['phase']} step {record['step']} ({record['duration']}s) {record['url']}",
+        f"    goal: {state.get('next_goal')}",
+        f"    eval: {state.get('evaluation_previous_goal')}",
+        f"    actions: {json.dumps(record['actions'], ensure_ascii=False)}",
+    ]
+    for result in record["results"]:
+        if result.get("error"):
+            lines.append(f"    ❌ {result['error']}")
+    lines.append(f"    dom {record['dom_digest'][:12]} ({len(record['dom'])} chars), screenshot {record.get('screenshot_bytes', 0)} bytes")
+    return "\n".join(lines)
+
+
+def phase_steps(trace_dir: Path = TRACE_DIR) -> dict:
+    """Step counts of every archived phase run, keyed by (phase, handoff)"""
+    steps = {}
+    for path in list_runs(trace_dir):
+        for record in TraceReader(path.stem, trace_dir):
+            if record.get("note") and "steps" in record and record.get("phase"):
+                key = (record["phase"], bool(record.get("handoff")))
+                steps.setdefault(key, []).append(record["steps"])
+    return steps
+
+
+def _view(reader: TraceReader):
+    """Interactive stepper: Enter/n next, p previous, <number> jump, d dump DOM, s save screenshot, q quit"""
+    n = 0
+    while 0 <= n < len(reader):
+        record = reader.read(n)
+        print(_format(n, record))
+        command = input("> ").strip()
+        if command == "q":
+            return
+        if command == "p":
+            n -= 1
+        elif command.isdigit():
+            n = int(command)
+        elif command == "d":
+            print(record.get("dom", ""))
+        elif command == "s":
+            path = f"{reader.run_id}_{n}.jpg"
+            Path(path).write_bytes(reader.read(n, with_screenshot=True)["screenshot"] or b"")
+            print(f"saved {path}")
+        else:
+            n += 1
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        for path in list_runs():
+            print(f"{path.stem}  {len(TraceReader(path.stem))} records  {path.stat().st_size / 1024:.0f} KB  "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(path.stat().st_mtime))}")
+    elif command == "show" and len(sys.argv) >= 3:
+        reader = TraceReader(sys.argv[2])
+        steps = [int(sys.argv[3])] if len(sys.argv) > 3 else range(len(reader))
+        for n in steps:
+            print(_format(n, reader.read(n)))
+    elif command == "view" and len(sys.argv) == 3:
+        _view(TraceReader(sys.argv[2]))
+    elif command == "steps":
+        steps = phase_steps()
+        for phase in sorted({phase for phase, _ in steps}):
+            cells = []
+            for handoff in (False, True):
+                counts = steps.get((phase, handoff), [])
+                mean = f"{sum(counts) / len(counts):.1f}" if counts else "-"
+                cells.append(f"{'with' if handoff else 'without'} handoff: {mean} steps ({len(counts)} runs)")
+            print(f"{phase:<12} " + "  |  ".join(cells))
+    else:
+        print("Usage: python trace_archive.py list | show <run_id> [step] | view <run_id> | steps")
@@ -0,0 +1,121 @@
+"""
+Static UI assets for the Streamlit app
+
+app.py used to base64-inline the background PNG (729 KB) and the logo SVG
+(62 KB, itself a wrapper around an embedded 1080x318 PNG) into its CSS on
+every rerun. That re-sent about 1 MB to the browser on each interaction and
+progress update. build_assets() instead writes optimized variants to
+static/ once per process:
+- WebP versions of both images, with the logo sized for its 180 px slot at 2x
+- the original background PNG, as a fallback
+
+Streamlit serves them from app/static/ (server.enableStaticServing in
+.streamlit/config.toml). File names carry a content hash, so browsers can
+cache them and a changed image gets a new URL.
+
+    python ui_assets.py    # rerun payload before/after
+"""
+import base64
+import hashlib
+import io
+import re
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+ROOT = Path(__file__).parent
+PUBLIC_DIR = ROOT / "public"
+# Streamlit serves <app dir>/static at app/static
+STATIC_DIR = ROOT / "static"
+STATIC_URL = "app/static"
+
+BACKGROUND = PUBLIC_DIR / "bg_image_logo.png"
+LOGO = PUBLIC_DIR / "LOGOBROVE_255x75.svg"
+LOGO_WIDTH = 360
+WEBP_QUALITY = 80
+
+
+@dataclass(frozen=True)
+class UIAssets:
+    background_webp: str
+    background_png: str
+    logo: str
+
+
+def _publish(data: bytes, stem: str, suffix: str) -> str:
+    """Write data under a content-hashed name; returns its URL"""
+    name = f"{stem}.{hashlib.sha1(data).hexdigest()[:10]}{suffix}"
+    path = STATIC_DIR / name
+    if not path.exists():
+        tmp = path.with_suffix(suffix + ".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    return f"{STATIC_URL}/{name}"
+
+
+def _webp(image, width: Optional[int] = None) -> bytes:
+    if width and image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)))
+    out = io.BytesIO()
+    image.save(out, "WEBP", quality=WEBP_QUALITY, method=6)
+    return out.getvalue()
+
+
+def _logo_png() -> Optional[bytes]:
+    """The PNG the logo SVG wraps"""
+    match = re.search(rb'data:image/png;base64,([A-Za-z0-9+/=\s]+)"', LOGO.read_bytes())
+    return base64.b64decode(match.group(1)) if match else None
+
+
+def build_assets() -> UIAssets:
+    """Write the static variants (skipped when already there) and return their URLs"""
+    STATIC_DIR.mkdir(exist_ok=True)
+    background_png = _publish(BACKGROUND.read_bytes(), "bg_image_logo", ".png")
+    logo_png = _logo_png()
+    try:
+        from PIL import Image
+
+        background_webp = _publish(_webp(Image.open(BACKGROUND)), "bg_image_logo", ".webp")
+        logo = _publish(_webp(Image.open(io.BytesIO(logo_png)), LOGO_WIDTH), "logo", ".webp") if logo_png else None
+    except Exception:
+        # No Pillow / WebP support: serve the originals as they are
+        background_webp = background_png
+        logo = _publish(logo_png, "logo", ".png") if logo_png else None
+    if logo is None:
+        logo = _publish(LOGO.read_bytes(), "logo", ".svg")
+    assets = UIAssets(background_webp=background_webp, background_png=background_png, logo=logo)
+
+    # Variants of images that have since changed
+    current = {url.rsplit("/", 1)[1] for url in (assets.background_webp, assets.background_png, assets.logo)}
+    for path in STATIC_DIR.iterdir():
+        if path.name not in current:
+            path.unlink()
+    return assets
+
+
+def _legacy_payload() -> int:
+    """Bytes app.py inlined per rerun before this module"""
+    bg = base64.b64encode(BACKGROUND.read_bytes())
+    logo = base64.b64encode(LOGO.read_bytes())
+    return len(bg) + len(logo)
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    _legacy_payload()
+    legacy_ms = (time.perf_counter() - started) * 1000
+
+    shutil.rmtree(STATIC_DIR, ignore_errors=True)
+    started = time.perf_counter()
+    assets = build_assets()
+    build_ms = (time.perf_counter() - started) * 1000
+    urls = len(assets.background_webp) + len(assets.background_png) + len(assets.logo)
+    files = {path.name: path.stat().st_size for path in STATIC_DIR.iterdir()}
+
+    print(f"📦 Before: {_legacy_payload() / 1024:.0f} KB of data URIs per rerun "
+          f"({legacy_ms:.0f} ms to read + encode, every rerun)")
+    print(f"📦 After:  {urls} bytes of URLs per rerun ({build_ms:.0f} ms once per process)")
+    for name, size in sorted(files.items()):
+        print(f"   {name}: {size / 1024:.0f} KB, fetched once and cached")
@@ -0,0 +1,233 @@
+"""
+Warm session pool - speculative pre-warming for the quote form
+
+As soon as a UI session shows the form, a browser is started and phase 1
+(login + navigation, which does not depend on the vehicle) runs in the
+background, holding an interactive scheduler slot like any quote (a warm
+session parked on the search box is bounded by WARM_MAX_SESSIONS instead).
+When the user submits, the quote attaches to that prepared session instead
+of starting cold. Unused warm sessions are killed after WARM_IDLE_TIMEOUT
+seconds.
+
+After a successful quote the browser goes back to an idle list and the next
+warm-up reuses it instead of launching Chromium again. It is still logged
+in, so the warm-up replays the learned path back to the vehicle search box
+(portal_graph.py) and only runs the navigation agent when no path is known.
+BrowserGovernor closes leftover tabs and decides when it must be recycled.
+
+Streamlit reruns the script on every interaction with a fresh event loop, so
+the pool owns a long-lived loop in a daemon thread and every browser lives on it.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from browser_use import Browser
+
+from browser_contexts import close_context_pool
+from browser_governor import BrowserGovernor
+from deadlines import cancel_quote
+from handoff import PhaseHandoff
+from metrics import REGISTRY
+from portal_graph import PORTAL_GRAPH
+from quote_agent import (INSURER, PORTAL, kill_browser, learn_portal, note_recovery, run_navigation, run_quote,
+                         start_browser)
+from scheduler import INTERACTIVE, SCHEDULER
+from trace_archive import TraceWriter
+
+
+WARM_IDLE_TIMEOUT = float(os.getenv("WARM_IDLE_TIMEOUT", "300"))
+WARM_MAX_SESSIONS = int(os.getenv("WARM_MAX_SESSIONS", "2"))
+
+POOL_BROWSERS = REGISTRY.gauge("warm_pool_browsers", "Browsers held by the warm session pool", ["state"])
+
+
+class WarmSessionPool:
+    """Warm browsers keyed by UI session id, driven from a background event loop"""
+
+    def __init__(self, idle_timeout: float = WARM_IDLE_TIMEOUT, max_sessions: int = WARM_MAX_SESSIONS):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="warm-sessions", daemon=True)
+        self._thread.start()
+        # Only touched from the pool loop
+        self._sessions: Dict[str, asyncio.Task] = {}
+        self._expiry: Dict[str, asyncio.TimerHandle] = {}
+        self._idle: List[Browser] = []
+        self._idle_expiry: Dict[int, asyncio.TimerHandle] = {}
+        self._submitted: Dict[str, Future] = {}
+        self.governor = BrowserGovernor()
+        REGISTRY.add_collector(self._collect)
+
+    def prewarm(self, session_key: str):
+        """Start a browser and run navigation for this session, if not already warming"""
+        self._loop.call_soon_threadsafe(self._prewarm, session_key)
+
+    def submit(self, session_key: str, vehicle_info: dict, progress_callback: Optional[Callable] = None,
+               quote_id: Optional[str] = None, priority: str = INTERACTIVE) -> Future:
+        """
+        Run a quote on the pool loop, attaching to the session's warm browser if any.
+
+        progress_callback is invoked from the pool thread; UI code should hand
+        the updates back to its own thread (e.g. through a queue). quote_id is
+        the handle for cancel().
+        """
+        quote_id = quote_id or uuid.uuid4().hex[:12]
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(session_key, vehicle_info, progress_callback, quote_id, priority), self._loop
+        )
+        self._submitted[quote_id] = future
+        future.add_done_callback(lambda _: self._submitted.pop(quote_id, None))
+        return future
+
+    def cancel(self, quote_id: str) -> bool:
+        """
+        Cancel a submitted quote. A running quote stops gracefully and reports
+        failure "cancelled"; one still waiting for its warm session is dropped.
+        """
+        if cancel_quote(quote_id):
+            return True
+        future = self._submitted.get(quote_id)
+        return future.cancel() if future else False
+
+    def release(self, session_key: str):
+        """Drop a warm session without using it"""
+        self._loop.call_soon_threadsafe(self._expire, session_key)
+
+    def shutdown(self, timeout: float = 30):
+        """Kill every warm and idle browser (quotes still running keep theirs)"""
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout)
+
+    def stats(self) -> dict:
+        return {"warm_sessions": len(self._sessions), "idle_browsers": len(self._idle),
+                "max_sessions": self.max_sessions, "scheduler": SCHEDULER.stats()}
+
+    def _collect(self):
+        POOL_BROWSERS.set(len(self._sessions), state="warm")
+        POOL_BROWSERS.set(len(self._idle), state="idle")
+        POOL_BROWSERS.set(len(self._submitted), state="quoting")
+
+    def _prewarm(self, session_key: str):
+        if session_key in self._sessions or len(self._sessions) >= self.max_sessions:
+            return
+        self._sessions[session_key] = self._loop.create_task(self._warm(session_key))
+        self._expiry[session_key] = self._loop.call_later(self.idle_timeout, self._expire, session_key)
+
+    async def _warm(self, session_key: str):
+        quote_id = f"warm-{session_key}"
+        trace = TraceWriter(quote_id)
+        trace.note(insurer=INSURER)
+        browser = handoff = None
+        try:
+            async with SCHEDULER.slot(INTERACTIVE):
+                if self._idle:
+                    browser = self._idle.pop()
+                    self._idle_expiry.pop(id(browser)).cancel()
+                    handoff = await self._back_to_search(browser, quote_id, trace)
+                else:
+                    # Kills its own Chromium if cancelled while launching
+                    browser = await start_browser()
+                if handoff is None:
+                    history = await run_navigation(browser, quote_id=quote_id, trace=trace)
+                    handoff = PhaseHandoff.from_history("navigation", history)
+        except BaseException as e:
+            trace.note(status="error", error=repr(e))
+            if browser is not None:
+                await self._kill(browser)
+            raise
+        finally:
+            trace.close()
+        await learn_portal(trace.run_id)
+        return browser, handoff
+
+    async def _back_to_search(self, browser: Browser, quote_id: str, trace: TraceWriter) -> Optional[PhaseHandoff]:
+        """Replay a reused browser to the navigation goal without the model, if the graph knows the way"""
+        if not PORTAL_GRAPH:
+            return None
+        recovery = await PORTAL.recover(browser, "navigation")
+        note_recovery(quote_id, recovery, trace=trace)
+        if not recovery.reached:
+            return None
+        return PhaseHandoff(phase="navigation", url=recovery.url,
+                            achieved="Still logged in; back on the vehicle search box")
+
+    def _take(self, session_key: str) -> Optional[asyncio.Task]:
+        handle = self._expiry.pop(session_key, None)
+        if handle:
+            handle.cancel()
+        return self._sessions.pop(session_key, None)
+
+    def _expire(self, session_key: str):
+        task = self._take(session_key)
+        if task:
+            self._loop.create_task(self._discard(task))
+
+    async def _discard(self, task: asyncio.Task):
+        if not task.done():
+            task.cancel()
+        try:
+            browser, _ = await task
+        except BaseException:
+            return
+        await self._kill(browser)
+
+    async def _kill(self, browser: Browser, success: bool = False):
+        self.governor.forget(browser)
+        await kill_browser(browser, success)
+
+    async def _recycle(self, browser: Browser, result: dict):
+        """Park a used browser for the next warm-up, or kill it if it's worn out"""
+        if result.get("status") != "success" or len(self._idle) >= self.max_sessions:
+            # After a failure the portal state is unknown; start the next one clean
+            await self._kill(browser, success=result.get("status") == "success")
+            return
+        if await self.governor.after_quote(browser):
+            await kill_browser(browser, success=True)
+            return
+        self._idle.append(browser)
+        self._idle_expiry[id(browser)] = self._loop.call_later(self.idle_timeout, self._expire_idle, browser)
+
+    async def _shutdown(self):
+        tasks = [self._take(session_key) for session_key in list(self._sessions)]
+        for handle in self._idle_expiry.values():
+            handle.cancel()
+        self._idle_expiry.clear()
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._discard(task) for task in tasks), *(self._kill(browser, success=True) for browser in idle),
+                             return_exceptions=True)
+        # Shared Chromium hosts of this loop (CONTEXT_HOSTS), once no session is left on them
+        await close_context_pool()
+
+    def _expire_idle(self, browser: Browser):
+        self._idle_expiry.pop(id(browser), None)
+        self._idle.remove(browser)
+        self._loop.create_task(self._kill(browser, success=True))
+
+    async def _run(self, session_key: str, vehicle_info: dict, progress_callback: Optional[Callable],
+                   quote_id: Optional[str], priority: str = INTERACTIVE):
+        task = self._take(session_key)
+        browser = handoff = None
+        if task:
+            if progress_callback and not task.done():
+                progress_callback(1, "Waiting for prepared session...")
+            started = time.monotonic()
+            try:
+                browser, handoff = await task
+            except Exception as e:
+                # Warm-up failed; run_quote falls back to a cold start
+                if progress_callback:
+                    progress_callback(1, f"Prepared session failed after {time.monotonic() - started:.0f}s ({e}), starting fresh...")
+        if browser is None:
+            return await run_quote(vehicle_info, progress_callback, quote_id=quote_id, priority=priority)
+        result = {}
+        try:
+            result = await run_quote(vehicle_info, progress_callback, browser=browser, quote_id=quote_id,
+                                     keep_browser=True, handoff=handoff, priority=priority)
+            return result
+        finally:
+            await self._recycle(browser, result)
@@ -0,0 +1,223 @@
+"""
+Quote workers - shard quote throughput across processes
+
+Each worker process runs its own event loop with up to --browsers concurrent
+quotes, leasing jobs from the shared SQLite queue (job_queue.py). DOM
+serialization and prompt building then use every core instead of
+saturating one loop.
+
+    python worker.py --processes 4 --browsers 2
+    python worker.py enqueue AUDI "Q3 S LINE SPORT BACK" 2020 05100 [--priority interactive]
+
+SIGTERM/SIGINT drain gracefully: workers stop leasing, finish the quotes in
+flight, and exit. A second signal cancels in-flight quotes and hands their
+jobs back to the queue.
+
+    python worker.py cancel <job_id>
+
+stops a single job; the worker running it notices within CANCEL_POLL_INTERVAL.
+The same poll stops a quote whose lease was lost (expired and taken by
+another worker), so a reclaimed job never runs twice to completion. A quote
+that ends in failure goes back to the queue for another attempt unless its
+failure class gives up (failures.RETRY_POLICIES), then it is marked dead.
+
+With METRICS_PORT set, worker N serves its metrics on METRICS_PORT + 1 + N;
+with SSE_PORT set, its progress events on SSE_PORT + 1 + N.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Optional
+
+from job_queue import VISIBILITY_TIMEOUT, Job, JobQueue
+from metrics import METRICS_PORT, REGISTRY, serve
+from progress_events import SSE_PORT, start_sse
+from scheduler import BATCH, INTERACTIVE, SCHED_INTERACTIVE_RESERVED, SCHEDULER
+from zip_index import ensure_index
+
+
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "5"))
+
+
+def _owned(job: Job, row: Optional[dict]) -> bool:
+    """Whether this lease is still the job's current one (not expired and re-leased)"""
+    return (row is not None and row["status"] in ("leased", "cancelling")
+            and row["lease_owner"] == job.lease_owner and row["attempts"] == job.attempts)
+
+
+async def _heartbeat(queue: JobQueue, job: Job, quote_id: str, quote: asyncio.Future, lost: asyncio.Event):
+    """
+    Keep the lease alive while the quote runs. Stop the quote if the job is
+    cancelled, or if the lease was lost: another worker is running it now.
+    """
+    from deadlines import cancel_quote
+
+    last_beat = time.monotonic()
+    while True:
+        await asyncio.sleep(CANCEL_POLL_INTERVAL)
+        row = await asyncio.to_thread(queue.get, job.id)
+        owned = _owned(job, row)
+        if owned and time.monotonic() - last_beat >= VISIBILITY_TIMEOUT / 3:
+            owned = await asyncio.to_thread(queue.heartbeat, job)
+            last_beat = time.monotonic()
+        if not owned:
+            print(f"⚠️ Lost the lease on job {job.id}; stopping its quote")
+            lost.set()
+            # Before the quote has a cancel scope (still queued for a slot) only the task can be cancelled
+            if not cancel_quote(quote_id):
+                quote.cancel()
+            return
+        if row["status"] == "cancelling":
+            cancel_quote(quote_id)
+
+
+async def _process(queue: JobQueue, job: Job):
+    # Imported lazily so `enqueue`/`status` don't pay for browser_use
+    from failures import RETRY_POLICIES, FailureClass, RetryAction
+    from quote_agent import run_quote
+
+    quote_id = f"job-{job.id}"
+    quote = asyncio.ensure_future(run_quote(job.payload["vehicle_info"], quote_id=quote_id,
+                                            priority=job.payload.get("priority", BATCH)))
+    lost = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(queue, job, quote_id, quote, lost))
+    try:
+        result = await quote
+    except asyncio.CancelledError:
+        if lost.is_set() and quote.cancelled():
+            # Stopped by _heartbeat, not by a drain: nothing to hand back
+            return
+        await asyncio.to_thread(queue.release, job)
+        raise
+    except Exception as e:
+        if not lost.is_set():
+            await asyncio.to_thread(queue.fail, job, str(e))
+        return
+    finally:
+        heartbeat.cancel()
+        if not quote.done():
+            quote.cancel()
+    if lost.is_set():
+        # The job belongs to whoever re-leased it; this run's outcome is not recorded
+        return
+    if result.get("status") == "success":
+        await asyncio.to_thread(queue.complete, job, result)
+        return
+    # run_quote already retried per phase; another attempt on a fresh browser only helps
+    # failures whose policy allows retrying (not a rejected login, a missing vehicle, a cancel...)
+    failure = result.get("failure")
+    retry = failure is not None and RETRY_POLICIES[FailureClass(failure)].action != RetryAction.GIVE_UP
+    await asyncio.to_thread(queue.fail, job, result.get("message") or failure, retry=retry)
+
+
+async def worker_loop(worker_id: str, browsers: int, queue_path: str):
+    queue = JobQueue(queue_path)
+    draining = asyncio.Event()
+    in_flight = set()
+    loop = asyncio.get_running_loop()
+    # Batch jobs never fill the last `reserved` browsers (see scheduler.py)
+    reserved = min(SCHED_INTERACTIVE_RESERVED, browsers - 1)
+    SCHEDULER.configure(slots=browsers, reserved=reserved)
+
+    def on_signal():
+        if draining.is_set():
+            for task in in_flight:
+                task.cancel()
+        draining.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, on_signal)
+
+    print(f"👷 {worker_id} ready ({browsers} browsers)")
+    while not draining.is_set():
+        if len(in_flight) >= browsers:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        job = await asyncio.to_thread(queue.lease, worker_id,
+                                      interactive_only=len(in_flight) >= browsers - reserved)
+        if job is None:
+            try:
+                await asyncio.wait_for(draining.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        print(f"📥 {worker_id} took job {job.id} (attempt {job.attempts})")
+        task = asyncio.create_task(_process(queue, job))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        print(f"⏳ {worker_id} draining {len(in_flight)} quotes...")
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    from browser_contexts import close_context_pool
+
+    await close_context_pool()
+    print(f"👋 {worker_id} stopped")
+
+
+def _worker_main(index: int, browsers: int, queue_path: str):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    if METRICS_PORT:
+        REGISTRY.add_collector(JobQueue(queue_path).record_depth)
+        serve(METRICS_PORT + 1 + index)
+    if SSE_PORT:
+        start_sse(SSE_PORT + 1 + index)
+    asyncio.run(worker_loop(worker_id, browsers, queue_path))
+
+
+def run_workers(processes: int, browsers: int, queue_path: str):
+    """Start worker processes and forward SIGTERM to them for a graceful drain"""
+    ensure_index()
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_worker_main, args=(i, browsers, queue_path)) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    def forward(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    # Ctrl-C already reaches every worker through the terminal's process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quote worker pool")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--browsers", type=int, default=int(os.getenv("WORKER_BROWSERS", "2")),
+                        help="concurrent browsers per process")
+    parser.add_argument("--queue", default=None, help="queue database (default: QUEUE_DB)")
+    subparsers = parser.add_subparsers(dest="command")
+    enqueue = subparsers.add_parser("enqueue", help="add a quote job")
+    enqueue.add_argument("brand")
+    enqueue.add_argument("model")
+    enqueue.add_argument("year")
+    enqueue.add_argument("zip_code", nargs="?", default="05100")
+    enqueue.add_argument("--priority", choices=[INTERACTIVE, BATCH], default=BATCH)
+    subparsers.add_parser("status", help="job counts per status")
+    cancel = subparsers.add_parser("cancel", help="cancel a queued or running job")
+    cancel.add_argument("job_id", type=int)
+    args = parser.parse_args()
+
+    queue_path = args.queue or JobQueue().path
+    if args.command == "enqueue":
+        vehicle_info = {"brand": args.brand.upper(), "model": args.model.upper(),
+                        "year": args.year, "zip_code": args.zip_code}
+        job_id = JobQueue(queue_path).enqueue({"vehicle_info": vehicle_info, "priority": args.priority})
+        print(f"✅ Job {job_id} queued ({args.priority})")
+    elif args.command == "status":
+        print(JobQueue(queue_path).depth())
+    elif args.command == "cancel":
+        status = JobQueue(queue_path).cancel(args.job_id)
+        print(f"🛑 Job {args.job_id} {status}" if status else f"Job {args.job_id} is not queued or running")
+    else:
+        run_workers(args.processes, args.browsers, queue_path)
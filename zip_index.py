@@ -0,0 +1,217 @@
+"""
+Offline zip-code index - validate and resolve Mexican zips before any browser starts
+
+lookup("05100") returns the estado/municipio/colonias for a zip from a compact
+local index (one dict lookup after the first load), or None when the zip does
+not exist, so bad requests fail in milliseconds instead of minutes into the
+select phase.
+
+The index is generated from SEPOMEX's public "CPdescarga.txt" export.
+ensure_index() downloads and builds it when it is missing, and the app, the
+daemon and the workers call it at startup, so a default install resolves
+zones. To build it by hand (e.g. on a host without outbound access):
+
+    python zip_index.py fetch               # download from SEPOMEX_URL and build
+    python zip_index.py build CPdescarga.txt
+    python zip_index.py check               # non-zero until the index exists
+
+If the index can't be built, lookups run in a degraded mode on the bundled
+estado prefix table: zips in unassigned ranges are rejected and only the
+estado is resolved. Those zones come back with degraded=True (the UI shows
+it), and with no municipio the zone pick is left to the select agent.
+"""
+import gzip
+import io
+import os
+import sys
+import tempfile
+import urllib.request
+import zipfile
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+
+ZIP_INDEX_PATH = os.getenv("ZIP_INDEX_PATH", "data/zip_codes.tsv.gz")
+SEPOMEX_URL = os.getenv("SEPOMEX_URL", "https://www.correosdemexico.gob.mx/datosabiertos/cp/cpdescarga.txt")
+# Set to 0 on hosts without outbound access; the index then has to be built by hand
+ZIP_INDEX_FETCH = os.getenv("ZIP_INDEX_FETCH", "1") == "1"
+
+# First two digits of the zip -> estado (SEPOMEX allocation)
+ESTADO_PREFIXES = {
+    **{f"{n:02d}": "Ciudad de México" for n in range(1, 17)},
+    "20": "Aguascalientes",
+    "21": "Baja California", "22": "Baja California",
+    "23": "Baja California Sur",
+    "24": "Campeche",
+    "25": "Coahuila de Zaragoza", "26": "Coahuila de Zaragoza", "27": "Coahuila de Zaragoza",
+    "28": "Colima",
+    "29": "Chiapas", "30": "Chiapas",
+    "31": "Chihuahua", "32": "Chihuahua", "33": "Chihuahua",
+    "34": "Durango", "35": "Durango",
+    "36": "Guanajuato", "37": "Guanajuato", "38": "Guanajuato",
+    "39": "Guerrero", "40": "Guerrero", "41": "Guerrero",
+    "42": "Hidalgo", "43": "Hidalgo",
+    **{f"{n}": "Jalisco" for n in range(44, 50)},
+    **{f"{n}": "México" for n in range(50, 58)},
+    **{f"{n}": "Michoacán de Ocampo" for n in range(58, 62)},
+    "62": "Morelos",
+    "63": "Nayarit",
+    **{f"{n}": "Nuevo León" for n in range(64, 68)},
+    **{f"{n}": "Oaxaca" for n in range(68, 72)},
+    **{f"{n}": "Puebla" for n in range(72, 76)},
+    "76": "Querétaro",
+    "77": "Quintana Roo",
+    "78": "San Luis Potosí", "79": "San Luis Potosí",
+    "80": "Sinaloa", "81": "Sinaloa", "82": "Sinaloa",
+    "83": "Sonora", "84": "Sonora", "85": "Sonora",
+    "86": "Tabasco",
+    "87": "Tamaulipas", "88": "Tamaulipas", "89": "Tamaulipas",
+    "90": "Tlaxcala",
+    **{f"{n}": "Veracruz de Ignacio de la Llave" for n in range(91, 97)},
+    "97": "Yucatán",
+    "98": "Zacatecas", "99": "Zacatecas",
+}
+
+
+@dataclass
+class ZipZone:
+    zip_code: str
+    estado: str
+    municipio: Optional[str] = None
+    colonias: List[str] = field(default_factory=list)
+    degraded: bool = False  # resolved from the estado prefix table, not the index
+
+    def describe(self) -> str:
+        """Human-readable zone, most specific first"""
+        parts = [self.municipio, self.estado]
+        if len(self.colonias) == 1:
+            parts.insert(0, self.colonias[0])
+        return ", ".join(p for p in parts if p)
+
+
+def normalize_zip(zip_code: str) -> str:
+    """Strip spaces and restore the leading zero dropped by spreadsheets ('5100' -> '05100')"""
+    digits = str(zip_code).strip()
+    return digits.zfill(5) if digits.isdigit() and len(digits) == 4 else digits
+
+
+@lru_cache(maxsize=1)
+def _load(path: str = ZIP_INDEX_PATH) -> Optional[Dict[str, tuple]]:
+    """zip -> (estado, municipio, colonias) from the generated index, or None if not built"""
+    if not os.path.exists(path):
+        return None
+    index = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        estados = f.readline().rstrip("\n").split("\t")
+        for line in f:
+            zip_code, estado, municipio, colonias = line.rstrip("\n").split("\t")
+            index[zip_code] = (estados[int(estado)], municipio, colonias.split("|") if colonias else [])
+    return index
+
+
+@lru_cache(maxsize=1)
+def _warn_fallback(path: str = ZIP_INDEX_PATH):
+    print(f"⚠️ No zip index at {path}: zips resolve to the estado only and the zone is left to the select agent. "
+          f"Build it with: python zip_index.py fetch", file=sys.stderr)
+
+
+def lookup(zip_code: str) -> Optional[ZipZone]:
+    """Resolve a zip to its zone; None means the zip does not exist"""
+    zip_code = normalize_zip(zip_code)
+    if len(zip_code) != 5 or not zip_code.isdigit():
+        return None
+    index = _load(ZIP_INDEX_PATH)
+    if index is None:
+        _warn_fallback(ZIP_INDEX_PATH)
+        estado = ESTADO_PREFIXES.get(zip_code[:2])
+        return ZipZone(zip_code, estado, degraded=True) if estado else None
+    entry = index.get(zip_code)
+    return ZipZone(zip_code, entry[0], entry[1], list(entry[2])) if entry else None
+
+
+def build(source_path: str, output_path: str = ZIP_INDEX_PATH) -> int:
+    """
+    Compile SEPOMEX's CPdescarga.txt into the compact gzip index.
+
+    Output format: first line is the tab-separated estado table, then one line
+    per zip: zip, estado position, municipio, colonias joined by '|'.
+    """
+    zones: Dict[str, tuple] = {}
+    with open(source_path, encoding="latin-1") as f:
+        header = None
+        for line in f:
+            fields = line.rstrip("\r\n").split("|")
+            if header is None:
+                # The export starts with a disclaimer line before the real header
+                if fields[0] == "d_codigo":
+                    header = {name: i for i, name in enumerate(fields)}
+                continue
+            zip_code = fields[header["d_codigo"]]
+            estado, municipio, colonia = (
+                fields[header["d_estado"]], fields[header["D_mnpio"]], fields[header["d_asenta"]]
+            )
+            zone = zones.setdefault(zip_code, (estado, municipio, []))
+            zone[2].append(colonia)
+
+    estados = sorted({zone[0] for zone in zones.values()})
+    positions = {estado: i for i, estado in enumerate(estados)}
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with gzip.open(output_path, "wt", encoding="utf-8") as f:
+        f.write("\t".join(estados) + "\n")
+        for zip_code in sorted(zones):
+            estado, municipio, colonias = zones[zip_code]
+            f.write(f"{zip_code}\t{positions[estado]}\t{municipio}\t{'|'.join(colonias)}\n")
+    _load.cache_clear()
+    return len(zones)
+
+
+def fetch(url: str = SEPOMEX_URL, output_path: str = ZIP_INDEX_PATH) -> int:
+    """Download the SEPOMEX export (plain or zipped) and build the index from it"""
+    with urllib.request.urlopen(url, timeout=120) as response:
+        payload = response.read()
+    if payload[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(payload)) as archive:
+            name = next(n for n in archive.namelist() if n.lower().endswith(".txt"))
+            payload = archive.read(name)
+    with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
+        f.write(payload)
+    try:
+        return build(f.name, output_path)
+    finally:
+        os.unlink(f.name)
+
+
+def ensure_index(path: str = ZIP_INDEX_PATH) -> bool:
+    """Build the index if it is missing; False means lookups run degraded"""
+    if _load(path) is not None:
+        return True
+    if ZIP_INDEX_FETCH:
+        try:
+            print(f"📥 Building zip index from {SEPOMEX_URL}")
+            fetch(SEPOMEX_URL, path)
+            return _load(path) is not None
+        except Exception as e:
+            print(f"⚠️ Could not build the zip index: {e}", file=sys.stderr)
+    _warn_fallback(path)
+    return False
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "build":
+        print(f"✅ Indexed {build(sys.argv[2])} zip codes into {ZIP_INDEX_PATH}")
+    elif len(sys.argv) in (2, 3) and sys.argv[1] == "fetch":
+        url = sys.argv[2] if len(sys.argv) == 3 else SEPOMEX_URL
+        print(f"✅ Indexed {fetch(url)} zip codes from {url} into {ZIP_INDEX_PATH}")
+    elif len(sys.argv) == 2 and sys.argv[1] == "check":
+        index = _load()
+        if index is None:
+            print(f"❌ No zip index at {ZIP_INDEX_PATH} (python zip_index.py fetch)")
+            sys.exit(1)
+        print(f"✅ {len(index)} zip codes indexed in {ZIP_INDEX_PATH}")
+    elif len(sys.argv) == 2:
+        zone = lookup(sys.argv[1])
+        degraded = " (estado only, no zip index)" if zone and zone.degraded else ""
+        print(f"📍 {zone.describe()}{degraded}" if zone else f"❌ Unknown zip code: {sys.argv[1]}")
+    else:
+        print("Usage: python zip_index.py fetch [url] | build CPdescarga.txt | check | <zip>")